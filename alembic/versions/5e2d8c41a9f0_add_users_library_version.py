@@ -0,0 +1,71 @@
+"""add users.library_version
+
+Revision ID: 5e2d8c41a9f0
+Revises: c3a91f6d2b47
+Create Date: 2026-10-17 16:42:37.905113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2d8c41a9f0'
+down_revision: Union[str, Sequence[str], None] = 'c3a91f6d2b47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Версия библиотеки увеличивается на 1 за транзакцию, изменившую user_gif_tags пользователя:
+# повторные изменения в той же транзакции строку users уже обновили (xmin — текущая транзакция),
+# поэтому не увеличивают версию ещё раз. Внутри SAVEPOINT xmin — ID подтранзакции, и версия
+# может вырасти больше чем на 1: для сравнения версий это безопасно, меняется только шаг.
+BUMP_FUNCTION = """
+CREATE FUNCTION users_bump_library_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET library_version = library_version + 1
+        WHERE id IN (SELECT user_id FROM new_rows) AND xmin <> pg_current_xact_id()::xid;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE users SET library_version = library_version + 1
+        WHERE id IN (SELECT user_id FROM old_rows) AND xmin <> pg_current_xact_id()::xid;
+    ELSE
+        UPDATE users SET library_version = library_version + 1
+        WHERE id IN (SELECT user_id FROM new_rows UNION SELECT user_id FROM old_rows)
+          AND xmin <> pg_current_xact_id()::xid;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+TRIGGERS = (
+    'CREATE TRIGGER users_library_version_insert AFTER INSERT ON user_gif_tags '
+    'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION users_bump_library_version()',
+    'CREATE TRIGGER users_library_version_update AFTER UPDATE ON user_gif_tags '
+    'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT '
+    'EXECUTE FUNCTION users_bump_library_version()',
+    'CREATE TRIGGER users_library_version_delete AFTER DELETE ON user_gif_tags '
+    'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION users_bump_library_version()',
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Значение по умолчанию — константа, поэтому столбец добавляется без перезаписи таблицы
+    op.add_column('users', sa.Column('library_version', sa.BigInteger(), server_default='0', nullable=False))
+
+    for statement in (BUMP_FUNCTION, *TRIGGERS):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS users_library_version_delete ON user_gif_tags')
+    op.execute('DROP TRIGGER IF EXISTS users_library_version_update ON user_gif_tags')
+    op.execute('DROP TRIGGER IF EXISTS users_library_version_insert ON user_gif_tags')
+    op.execute('DROP FUNCTION IF EXISTS users_bump_library_version()')
+    op.drop_column('users', 'library_version')
@@ -0,0 +1,44 @@
+"""add user_gif_tags indexes
+
+Revision ID: 78ed718d5087
+Revises: 4a18bf358b54
+Create Date: 2026-10-17 06:21:43.163234
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '78ed718d5087'
+down_revision: Union[str, Sequence[str], None] = '4a18bf358b54'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Индексы создаются CONCURRENTLY, чтобы не блокировать запись в user_gif_tags на время построения
+    with op.get_context().autocommit_block():
+        # Каскадное удаление из gifs и поиск по гифке
+        op.create_index(op.f('ix_user_gif_tags_gif_id'), 'user_gif_tags', ['gif_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        # Каскадное удаление из tags
+        op.create_index(op.f('ix_user_gif_tags_tag_id'), 'user_gif_tags', ['tag_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        # Поиск гифок пользователя по тегам и список тегов пользователя
+        op.create_index('ix_user_gif_tags_user_id_tag_id_gif_id', 'user_gif_tags', ['user_id', 'tag_id', 'gif_id'],
+                        unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_user_gif_tags_user_id_tag_id_gif_id', table_name='user_gif_tags',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index(op.f('ix_user_gif_tags_tag_id'), table_name='user_gif_tags',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index(op.f('ix_user_gif_tags_gif_id'), table_name='user_gif_tags',
+                      postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,80 @@
+"""guard users.library_version bump by transaction id
+
+Revision ID: 9b7e4c2a1d3f
+Revises: 5e2d8c41a9f0
+Create Date: 2026-10-17 19:05:12.418230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b7e4c2a1d3f'
+down_revision: Union[str, Sequence[str], None] = '5e2d8c41a9f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Версия библиотеки увеличивается на 1 за транзакцию, изменившую user_gif_tags пользователя.
+# Транзакция, уже увеличившая версию, записывает свой ID в users.library_version_xact и
+# повторно версию не увеличивает. Проверка по xmin, которая была здесь раньше, пропускала
+# увеличение, если строку users в той же транзакции уже обновил другой запрос (например,
+# `UsersCRUD.create_user` с ON CONFLICT DO UPDATE перед импортом библиотеки).
+# pg_current_xact_id() внутри SAVEPOINT возвращает ID основной транзакции, поэтому шаг
+# остаётся равным 1 и с точками сохранения.
+BUMP_FUNCTION = """
+CREATE OR REPLACE FUNCTION users_bump_library_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    xact bigint := pg_current_xact_id()::text::bigint;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET library_version = library_version + 1, library_version_xact = xact
+        WHERE id IN (SELECT user_id FROM new_rows) AND library_version_xact IS DISTINCT FROM xact;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE users SET library_version = library_version + 1, library_version_xact = xact
+        WHERE id IN (SELECT user_id FROM old_rows) AND library_version_xact IS DISTINCT FROM xact;
+    ELSE
+        UPDATE users SET library_version = library_version + 1, library_version_xact = xact
+        WHERE id IN (SELECT user_id FROM new_rows UNION SELECT user_id FROM old_rows)
+          AND library_version_xact IS DISTINCT FROM xact;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+XMIN_BUMP_FUNCTION = """
+CREATE OR REPLACE FUNCTION users_bump_library_version() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET library_version = library_version + 1
+        WHERE id IN (SELECT user_id FROM new_rows) AND xmin <> pg_current_xact_id()::xid;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE users SET library_version = library_version + 1
+        WHERE id IN (SELECT user_id FROM old_rows) AND xmin <> pg_current_xact_id()::xid;
+    ELSE
+        UPDATE users SET library_version = library_version + 1
+        WHERE id IN (SELECT user_id FROM new_rows UNION SELECT user_id FROM old_rows)
+          AND xmin <> pg_current_xact_id()::xid;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('library_version_xact', sa.BigInteger(), nullable=True))
+    op.execute(BUMP_FUNCTION)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(XMIN_BUMP_FUNCTION)
+    op.drop_column('users', 'library_version_xact')
@@ -0,0 +1,183 @@
+"""add user_gifs projection
+
+Revision ID: c3a91f6d2b47
+Revises: 78ed718d5087
+Create Date: 2026-10-17 14:05:12.418530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3a91f6d2b47'
+down_revision: Union[str, Sequence[str], None] = '78ed718d5087'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Пересчёт строк user_gifs для пар (user_id, gif_id) по текущему содержимому user_gif_tags.
+# Перед пересчётом берётся advisory-блокировка на пользователя (с точностью до одного из 1024 слотов,
+# чтобы массовые операции не переполняли таблицу блокировок): параллельные транзакции,
+# меняющие теги одного пользователя, пересчитывают его строки по очереди, и каждая видит
+# зафиксированный результат предыдущей.
+REFRESH_FUNCTION = """
+CREATE FUNCTION user_gifs_refresh(p_user_ids integer[], p_gif_ids integer[]) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('user_gifs'), slot)
+    FROM (SELECT DISTINCT user_id & 1023 AS slot FROM unnest(p_user_ids) AS user_id ORDER BY 1) AS slots;
+
+    DELETE FROM user_gifs
+    USING unnest(p_user_ids, p_gif_ids) AS changed(user_id, gif_id)
+    WHERE user_gifs.user_id = changed.user_id
+      AND user_gifs.gif_id = changed.gif_id
+      AND NOT EXISTS (
+          SELECT 1 FROM user_gif_tags
+          WHERE user_gif_tags.user_id = changed.user_id AND user_gif_tags.gif_id = changed.gif_id
+      );
+
+    INSERT INTO user_gifs (user_id, gif_id, tg_gif_id, tags)
+    SELECT changed.user_id, changed.gif_id, gifs.tg_gif_id, array_agg(tags.tag ORDER BY tags.tag)
+    FROM unnest(p_user_ids, p_gif_ids) AS changed(user_id, gif_id)
+    JOIN user_gif_tags ON user_gif_tags.user_id = changed.user_id AND user_gif_tags.gif_id = changed.gif_id
+    JOIN gifs ON gifs.id = changed.gif_id
+    JOIN tags ON tags.id = user_gif_tags.tag_id
+    GROUP BY changed.user_id, changed.gif_id, gifs.tg_gif_id
+    ON CONFLICT (user_id, gif_id) DO UPDATE SET tags = EXCLUDED.tags
+    WHERE user_gifs.tags IS DISTINCT FROM EXCLUDED.tags;
+END
+$$
+"""
+
+# Триггерная функция уровня оператора: собирает изменённые пары из таблиц переходов
+SYNC_FUNCTION = """
+CREATE FUNCTION user_gifs_sync() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    user_ids integer[];
+    gif_ids integer[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(user_id), array_agg(gif_id) INTO user_ids, gif_ids
+        FROM (SELECT DISTINCT user_id, gif_id FROM new_rows) AS changed;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(user_id), array_agg(gif_id) INTO user_ids, gif_ids
+        FROM (SELECT DISTINCT user_id, gif_id FROM old_rows) AS changed;
+    ELSE
+        SELECT array_agg(user_id), array_agg(gif_id) INTO user_ids, gif_ids
+        FROM (
+            SELECT user_id, gif_id FROM new_rows
+            UNION
+            SELECT user_id, gif_id FROM old_rows
+        ) AS changed;
+    END IF;
+
+    IF user_ids IS NOT NULL THEN
+        PERFORM user_gifs_refresh(user_ids, gif_ids);
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+# Переименование гифки или тега (через update_instance) тоже отражается в проекции
+GIFS_RENAME_FUNCTION = """
+CREATE FUNCTION user_gifs_gif_renamed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE user_gifs SET tg_gif_id = new_rows.tg_gif_id
+    FROM new_rows
+    WHERE user_gifs.gif_id = new_rows.id AND user_gifs.tg_gif_id <> new_rows.tg_gif_id;
+    RETURN NULL;
+END
+$$
+"""
+
+TAGS_RENAME_FUNCTION = """
+CREATE FUNCTION user_gifs_tag_renamed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    user_ids integer[];
+    gif_ids integer[];
+BEGIN
+    SELECT array_agg(user_id), array_agg(gif_id) INTO user_ids, gif_ids
+    FROM (
+        SELECT DISTINCT user_gif_tags.user_id, user_gif_tags.gif_id
+        FROM user_gif_tags JOIN new_rows ON new_rows.id = user_gif_tags.tag_id
+    ) AS changed;
+
+    IF user_ids IS NOT NULL THEN
+        PERFORM user_gifs_refresh(user_ids, gif_ids);
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+TRIGGERS = (
+    'CREATE TRIGGER user_gifs_sync_insert AFTER INSERT ON user_gif_tags '
+    'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION user_gifs_sync()',
+    'CREATE TRIGGER user_gifs_sync_update AFTER UPDATE ON user_gif_tags '
+    'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION user_gifs_sync()',
+    'CREATE TRIGGER user_gifs_sync_delete AFTER DELETE ON user_gif_tags '
+    'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION user_gifs_sync()',
+    'CREATE TRIGGER user_gifs_gif_renamed AFTER UPDATE ON gifs '
+    'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION user_gifs_gif_renamed()',
+    'CREATE TRIGGER user_gifs_tag_renamed AFTER UPDATE ON tags '
+    'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION user_gifs_tag_renamed()',
+)
+
+BACKFILL = """
+INSERT INTO user_gifs (user_id, gif_id, tg_gif_id, tags)
+SELECT user_gif_tags.user_id, user_gif_tags.gif_id, gifs.tg_gif_id, array_agg(tags.tag ORDER BY tags.tag)
+FROM user_gif_tags
+JOIN gifs ON gifs.id = user_gif_tags.gif_id
+JOIN tags ON tags.id = user_gif_tags.tag_id
+GROUP BY user_gif_tags.user_id, user_gif_tags.gif_id, gifs.tg_gif_id
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'user_gifs',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('gif_id', sa.Integer(), nullable=False),
+        sa.Column('tg_gif_id', sa.String(length=255), nullable=False),
+        sa.Column('tags', postgresql.ARRAY(sa.Text()), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['gif_id'], ['gifs.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'gif_id'),
+    )
+    op.create_index(op.f('ix_user_gifs_gif_id'), 'user_gifs', ['gif_id'], unique=False)
+
+    for statement in (REFRESH_FUNCTION, SYNC_FUNCTION, GIFS_RENAME_FUNCTION, TAGS_RENAME_FUNCTION, *TRIGGERS):
+        op.execute(statement)
+
+    # Триггеры уже созданы, а блокировка не даёт записи в user_gif_tags проскочить
+    # между заполнением проекции и концом миграции
+    op.execute('LOCK TABLE user_gif_tags IN SHARE MODE')
+    op.execute(BACKFILL)
+    # GIN-индекс строится после заполнения: так быстрее, чем обновлять его построчно
+    op.create_index('ix_user_gifs_tags', 'user_gifs', ['tags'], unique=False, postgresql_using='gin')
+    op.execute('ANALYZE user_gifs')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS user_gifs_tag_renamed ON tags')
+    op.execute('DROP TRIGGER IF EXISTS user_gifs_gif_renamed ON gifs')
+    op.execute('DROP TRIGGER IF EXISTS user_gifs_sync_delete ON user_gif_tags')
+    op.execute('DROP TRIGGER IF EXISTS user_gifs_sync_update ON user_gif_tags')
+    op.execute('DROP TRIGGER IF EXISTS user_gifs_sync_insert ON user_gif_tags')
+    op.execute('DROP FUNCTION IF EXISTS user_gifs_tag_renamed()')
+    op.execute('DROP FUNCTION IF EXISTS user_gifs_gif_renamed()')
+    op.execute('DROP FUNCTION IF EXISTS user_gifs_sync()')
+    op.execute('DROP FUNCTION IF EXISTS user_gifs_refresh(integer[], integer[])')
+    op.drop_index('ix_user_gifs_tags', table_name='user_gifs', postgresql_using='gin')
+    op.drop_index(op.f('ix_user_gifs_gif_id'), table_name='user_gifs')
+    op.drop_table('user_gifs')
@@ -0,0 +1,82 @@
+"""add user_gifs_lock_users
+
+Revision ID: d4f1a7c93e52
+Revises: 9b7e4c2a1d3f
+Create Date: 2026-10-17 19:48:30.216904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4f1a7c93e52'
+down_revision: Union[str, Sequence[str], None] = '9b7e4c2a1d3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Advisory-блокировки пользователей для пересчёта user_gifs, вынесенные в отдельную функцию.
+# Внутри одного оператора слоты блокируются по возрастанию, но транзакция, меняющая связи
+# нескольких пользователей несколькими операторами (пакет group commit), брала их в порядке
+# операторов, и две такие транзакции могли заблокировать друг друга. Такие транзакции
+# вызывают функцию заранее со всеми пользователями (`UserGifTagCRUD.lock_users`): повторная
+# блокировка уже взятого слота в триггере не ждёт.
+LOCK_FUNCTION = """
+CREATE FUNCTION user_gifs_lock_users(p_user_ids integer[]) RETURNS void
+LANGUAGE sql AS $$
+    SELECT pg_advisory_xact_lock(hashtext('user_gifs'), slot)
+    FROM (SELECT DISTINCT user_id & 1023 AS slot FROM unnest(p_user_ids) AS user_id ORDER BY 1) AS slots;
+$$
+"""
+
+REFRESH_BODY = """
+    DELETE FROM user_gifs
+    USING unnest(p_user_ids, p_gif_ids) AS changed(user_id, gif_id)
+    WHERE user_gifs.user_id = changed.user_id
+      AND user_gifs.gif_id = changed.gif_id
+      AND NOT EXISTS (
+          SELECT 1 FROM user_gif_tags
+          WHERE user_gif_tags.user_id = changed.user_id AND user_gif_tags.gif_id = changed.gif_id
+      );
+
+    INSERT INTO user_gifs (user_id, gif_id, tg_gif_id, tags)
+    SELECT changed.user_id, changed.gif_id, gifs.tg_gif_id, array_agg(tags.tag ORDER BY tags.tag)
+    FROM unnest(p_user_ids, p_gif_ids) AS changed(user_id, gif_id)
+    JOIN user_gif_tags ON user_gif_tags.user_id = changed.user_id AND user_gif_tags.gif_id = changed.gif_id
+    JOIN gifs ON gifs.id = changed.gif_id
+    JOIN tags ON tags.id = user_gif_tags.tag_id
+    GROUP BY changed.user_id, changed.gif_id, gifs.tg_gif_id
+    ON CONFLICT (user_id, gif_id) DO UPDATE SET tags = EXCLUDED.tags
+    WHERE user_gifs.tags IS DISTINCT FROM EXCLUDED.tags;
+END
+$$
+"""
+
+REFRESH_FUNCTION = """
+CREATE OR REPLACE FUNCTION user_gifs_refresh(p_user_ids integer[], p_gif_ids integer[]) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM user_gifs_lock_users(p_user_ids);
+""" + REFRESH_BODY
+
+INLINE_LOCK_REFRESH_FUNCTION = """
+CREATE OR REPLACE FUNCTION user_gifs_refresh(p_user_ids integer[], p_gif_ids integer[]) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('user_gifs'), slot)
+    FROM (SELECT DISTINCT user_id & 1023 AS slot FROM unnest(p_user_ids) AS user_id ORDER BY 1) AS slots;
+""" + REFRESH_BODY
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(LOCK_FUNCTION)
+    op.execute(REFRESH_FUNCTION)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(INLINE_LOCK_REFRESH_FUNCTION)
+    op.execute('DROP FUNCTION IF EXISTS user_gifs_lock_users(integer[])')
@@ -0,0 +1,75 @@
+"""bump users.library_version on gif and tag renames
+
+Revision ID: e1b5c7a2f9d4
+Revises: d4f1a7c93e52
+Create Date: 2026-10-17 21:12:44.508317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1b5c7a2f9d4'
+down_revision: Union[str, Sequence[str], None] = 'd4f1a7c93e52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Переименование гифки или тега (UPDATE gifs / tags, например через update_instance) меняет ответы
+# поиска и чтения гифок всех пользователей, у которых есть эта гифка или тег, хотя user_gif_tags
+# не меняется. Версия их библиотек увеличивается, иначе ETag и кэши по версии отдавали бы старые данные.
+# Учитываются только строки, у которых значение действительно изменилось (EXCEPT, а не соединение
+# таблиц переходов: у них нет индексов и статистики, и соединение при массовых переименованиях
+# выполнялось вложенными циклами). Шаг — 1 за транзакцию, с той же проверкой по library_version_xact,
+# что и в users_bump_library_version.
+RENAME_FUNCTION = """
+CREATE FUNCTION users_bump_library_version_renamed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    xact bigint := pg_current_xact_id()::text::bigint;
+BEGIN
+    IF TG_TABLE_NAME = 'gifs' THEN
+        UPDATE users SET library_version = library_version + 1, library_version_xact = xact
+        WHERE id IN (
+            SELECT user_id FROM user_gif_tags
+            WHERE gif_id IN (
+                SELECT id FROM (SELECT id, tg_gif_id FROM new_rows EXCEPT SELECT id, tg_gif_id FROM old_rows) AS renamed
+            )
+        ) AND library_version_xact IS DISTINCT FROM xact;
+    ELSE
+        UPDATE users SET library_version = library_version + 1, library_version_xact = xact
+        WHERE id IN (
+            SELECT user_id FROM user_gif_tags
+            WHERE tag_id IN (
+                SELECT id FROM (SELECT id, tag FROM new_rows EXCEPT SELECT id, tag FROM old_rows) AS renamed
+            )
+        ) AND library_version_xact IS DISTINCT FROM xact;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+TRIGGERS = (
+    'CREATE TRIGGER users_library_version_gif_renamed AFTER UPDATE ON gifs '
+    'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT '
+    'EXECUTE FUNCTION users_bump_library_version_renamed()',
+    'CREATE TRIGGER users_library_version_tag_renamed AFTER UPDATE ON tags '
+    'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT '
+    'EXECUTE FUNCTION users_bump_library_version_renamed()',
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for statement in (RENAME_FUNCTION, *TRIGGERS):
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS users_library_version_tag_renamed ON tags')
+    op.execute('DROP TRIGGER IF EXISTS users_library_version_gif_renamed ON gifs')
+    op.execute('DROP FUNCTION IF EXISTS users_bump_library_version_renamed()')
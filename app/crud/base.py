@@ -1,10 +1,127 @@
+import functools
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
 from sqlalchemy.orm.attributes import InstrumentedAttribute
-from sqlalchemy import select, update, delete, inspect
-from sqlalchemy.dialects.postgresql import insert
-from app.utils import is_valid_column_for_model, get_orm_columns
-from typing import Sequence, Any
+from sqlalchemy import select, update, delete, inspect, bindparam, cast, func, any_, column, values, event, String, Text
+from sqlalchemy.dialects.postgresql import insert, ARRAY
+from sqlalchemy.sql import Executable
+from app.utils import is_valid_column_for_model, get_orm_columns, precompile, LRUCache
+from typing import Sequence, Iterable, Any, Callable, Hashable, AsyncIterator
 from app.models import Base
+from app.query_log import traced
+
+
+class _ModelMetadata:
+    """
+    Метаданные ORM-модели, которые нужны методам `_BaseCRUD`, и кэш построенных по ним запросов.
+
+    Вычисляются один раз на модель (см. `_model_metadata`), а не при каждом вызове метода.
+    Запросы строятся без значений — значения передаются параметрами при выполнении, поэтому
+    один и тот же объект запроса каждый раз попадает в кэш компиляции SQLAlchemy.
+    """
+    def __init__(self, model: type[Base]):
+        mapper = inspect(model)
+        self.model = model
+        self.columns = get_orm_columns(model)
+        self.pk_column = getattr(model, mapper.primary_key[0].key)
+        self.unique_keys = frozenset(column.key for column in mapper.columns if column.unique or column.primary_key)
+        # Колонка, которую create_instance при конфликте обновляет на саму себя, чтобы RETURNING вернул строку
+        self.conflict_update_column = next((
+            column.name for column in mapper.columns
+            if not column.autoincrement or bool(column.foreign_keys)
+            or not column.primary_key and column.autoincrement == 'auto'
+        ), None)
+        # Ключи — формы запросов (какие колонки переданы), поэтому их число ограничено местами вызова
+        self.statements: dict[Hashable, Executable] = {}
+
+    def statement(self, key: Hashable, build: Callable[[], Executable]) -> Executable:
+        """Возвращает запрос формы `key`, при первом обращении строя его функцией `build`."""
+        stmt = self.statements.get(key)
+        if stmt is None:
+            stmt = self.statements[key] = build()
+        return stmt
+
+
+# Ограничение PostgreSQL на количество параметров одного запроса (номер параметра — int16)
+MAX_BIND_PARAMS = 32767
+# Строк в одном запросе пакетных методов по умолчанию
+BULK_CHUNK_SIZE = 1000
+# Строк, получаемых из серверного курсора за один раз в stream_instances
+STREAM_BATCH_SIZE = 1000
+
+
+def _chunks(rows: Sequence, params_per_row: int, chunk_size: int | None = None) -> Iterable[Sequence]:
+    """
+    Делит строки пакетного метода на части по `chunk_size` (по умолчанию `BULK_CHUNK_SIZE`) строк,
+    но не больше, чем помещается в `MAX_BIND_PARAMS` параметров запроса.
+    """
+    size = max(1, min(chunk_size or BULK_CHUNK_SIZE, MAX_BIND_PARAMS // max(params_per_row, 1)))
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+@functools.cache
+def _model_metadata(model: type[Base]) -> _ModelMetadata:
+    return _ModelMetadata(model)
+
+
+@functools.cache
+def _resolve_statements(model: type[Base], identity_key: str) -> tuple[Executable, Executable]:
+    """
+    Запросы `resolve_ids`: выборка первичных ключей по массиву `keys` значений колонки `identity_key`
+    и та же выборка с созданием отсутствующих записей.
+    """
+    key_column = getattr(model, identity_key)
+    pk_column = _model_metadata(model).pk_column
+    # Строковые ключи — массив TEXT без ограничения длины: приведение к VARCHAR(n)[] молча обрезало бы
+    # длинные ключи, и они совпадали бы с другими записями. Слишком длинный ключ теперь не находится,
+    # а его вставка завершается ошибкой
+    key_type = Text() if isinstance(key_column.type, String) else key_column.type
+    keys = cast(bindparam('keys'), ARRAY(key_type))
+
+    existing = select(key_column, pk_column).where(key_column == any_(keys))
+    table = model.__table__
+    inserted = (
+        insert(table)
+        .from_select([key_column.key], select(func.unnest(keys)))
+        .on_conflict_do_nothing(index_elements=[key_column.key])
+        .returning(table.c[key_column.key], table.c[pk_column.key])
+        .cte('inserted')
+    )
+    existing_or_create = select(inserted.c[key_column.key], inserted.c[pk_column.key]).union_all(existing)
+    # PostgreSQL-вариант insert() не кэшируется SQLAlchemy, поэтому компилируется один раз здесь
+    return existing, precompile(existing_or_create)
+
+
+# Соответствия из транзакции, которая создавала записи, ждут её фиксации в `Session.info`
+# (см. `_BaseCRUD._remember_ids`): {транзакция сессии: [(identity_map, ключ, первичный ключ), ...]}
+_PENDING_IDS = 'crud_pending_ids'
+_COMMITTED = 'crud_transaction_committed'
+
+
+@event.listens_for(Session, 'after_commit')
+def _mark_transaction_committed(session: Session) -> None:
+    # Срабатывает и при RELEASE SAVEPOINT, непосредственно перед after_transaction_end той же транзакции
+    session.info[_COMMITTED] = True
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _apply_pending_ids(session: Session, transaction: SessionTransaction) -> None:
+    """
+    По завершении транзакции сессии переносит отложенные соответствия: после фиксации точки
+    сохранения — в родительскую транзакцию, после фиксации основной транзакции — в `identity_map`.
+    После отката (в том числе до точки сохранения) соответствия отбрасываются.
+    """
+    committed = session.info.pop(_COMMITTED, False)
+    pending = session.info.get(_PENDING_IDS)
+    entries = pending.pop(transaction, None) if pending else None
+    if not entries or not committed:
+        return
+    if transaction.parent is not None:
+        pending.setdefault(transaction.parent, []).extend(entries)
+        return
+    for identity_map, key, id_ in entries:
+        identity_map.set(key, id_)
 
 
 class _BaseCRUD:
@@ -14,7 +131,8 @@ class _BaseCRUD:
 
     Класс инкапсулирует часто используемые шаблоны запросов: вставку с обработкой конфликтов
     (`create_instance`), выборку с универсальными фильтрами (`get_instances`), обновление одной
-    записи (`update_instance`) и удаление записей (`delete_instances`).
+    записи (`update_instance`) и удаление записей (`delete_instances`), а также пакетные варианты
+    для многих строк за один запрос: `create_instances`, `upsert_instances` и `update_instances`.
 
     Важные моменты:
         - Экземпляр класса привязывается к конкретной ORM-модели и асинхронной сессии:
@@ -27,8 +145,18 @@ class _BaseCRUD:
           `commit()` автоматически. За фиксацию транзакции (commit/rollback) отвечает вызывающий код.
         - Возвращаемые значения типичны для асинхронного SQLAlchemy:
             - `create_instance` / `update_instance` возвращают одну строку (Row) или None.
-            - `get_instances` возвращает список строк (List[Row]).
+            - `create_instances` / `upsert_instances` / `update_instances` возвращают список строк.
+            - `get_instances` возвращает список строк (List[Row]), `stream_instances` — асинхронный итератор строк.
             - `delete_instances` возвращает количество удалённых строк (int).
+        - Наследник может задать `identity_key` — имя уникальной колонки с внешним идентификатором
+          (например `'tg_id'` для `User`) — и `identity_map` — общий для процесса кэш соответствий
+          «внешний идентификатор -> первичный ключ». Тогда `resolve_ids` отвечает из кэша без
+          обращения к БД, а `delete_instances` / `update_instance` поддерживают кэш в актуальном состоянии.
+          Если транзакция сессии создавала записи, новые соответствия попадают в кэш только после
+          её фиксации (см. `_remember_ids`).
+        - Наследник задаёт модель атрибутом класса `model`: метаданные модели и запросы `resolve_ids`
+          вычисляются один раз при определении класса, а запросы остальных методов — при первом вызове
+          с данным набором колонок. Экземпляр класса создаётся дёшево, его можно создавать на каждый запрос.
 
     Пример использования:
     
@@ -50,18 +178,37 @@ class _BaseCRUD:
         
         deleted_count = await crud.delete_instances(filters={User.id: [2, 3]})
     """
+    model: type[Base] | None = None
+    identity_key: str | None = None
+    identity_map: LRUCache | None = None
+
+    _meta: _ModelMetadata | None = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.model is None:
+            return
+        cls._meta = _model_metadata(cls.model)
+        if cls.identity_key is not None:
+            _resolve_statements(cls.model, cls.identity_key)
+
     def __init__(
             self,
             async_session: AsyncSession,
-            model: type[Base],
+            model: type[Base] | None = None,
     ):
         """
         :param async_session: Объект асинхронной сессии SQLAlchemy.
-        :param model: SQLAlchemy модель.
+        :param model: SQLAlchemy модель (по умолчанию атрибут класса `model`).
         """
         self.async_session = async_session
-        self.model = model
+        if model is not None and model is not self.model:
+            self.model = model
+            self._meta = _model_metadata(model)
+        if self.model is None:
+            raise TypeError(f"Для {type(self).__name__} не задана модель.")
 
+    @traced
     async def create_instance(
             self,
             values: dict[InstrumentedAttribute, Any],
@@ -79,41 +226,227 @@ class _BaseCRUD:
                        а value — значение для вставки.
         :return: Строка результата (Row), содержащая значения всех колонок модели после операции. 
         """
-        columns = get_orm_columns(self.model)
-        not_autoincrement_key_index = -1
-        for i, col in enumerate(inspect(self.model).columns):
-            if not col.autoincrement or bool(col.foreign_keys) or not col.primary_key and col.autoincrement == 'auto':
-                not_autoincrement_key_index = i
-                break
-                
-        unique_cols = []
-        for col in values.keys():
-            if col.unique or col.primary_key:
-                unique_cols.append(col)
-
-        if not_autoincrement_key_index == -1:
+        meta = self._meta
+        if meta.conflict_update_column is None:
             raise ValueError(f"Все колонки текущей таблицы {self.model.__tablename__} - primary_key. "
                              "Данный метод не может работать с такими таблицами.")
-        
+
         for column in values:
             if not is_valid_column_for_model(column, self.model):
                 raise ValueError(f"В ключе для вставки ожидается колонка модели {self.model.__name__}. "
                                  f"Вы передали {type(column)}, а именно {column}.")
 
-        insert_stmt = insert(self.model).values(values)
+        keys = tuple(column.key for column in values)
+        stmt = meta.statement(('create', keys), lambda: self._build_create_statement(keys))
+        result = await self.async_session.execute(stmt, {f'values_{column.key}': value for column, value in values.items()})
+        row = result.fetchone()
+
+        if row is not None and self.identity_key in keys:
+            self._remember_ids([(values[getattr(self.model, self.identity_key)], getattr(row, meta.pk_column.key))],
+                               created=True)
+
+        return row
+
+    def _build_create_statement(self, keys: tuple[str, ...]) -> Executable:
+        """INSERT для `create_instance` с колонками `keys`: ON CONFLICT по тем из них, что уникальны."""
+        meta = self._meta
+        columns = [getattr(self.model, key) for key in keys]
+        insert_stmt = insert(self.model).values({
+            column: bindparam(f'values_{column.key}', type_=column.type) for column in columns
+        })
+        unique_cols = [column for column in columns if column.key in meta.unique_keys]
         if unique_cols:
-            col_name = columns[not_autoincrement_key_index].name
+            col_name = meta.conflict_update_column
             stmt = insert_stmt.on_conflict_do_update(
                 index_elements=unique_cols,
                 set_={col_name: insert_stmt.excluded[col_name]},
-            ).returning(*columns)
+            ).returning(*meta.columns)
         else:
-            stmt = insert_stmt.returning(*columns)
-            
-        result = await self.async_session.execute(stmt)
+            stmt = insert_stmt.returning(*meta.columns)
+        # PostgreSQL-вариант insert() не кэшируется SQLAlchemy, поэтому компилируется один раз здесь
+        return precompile(stmt)
 
-        return result.fetchone()
+    @traced
+    async def create_instances(
+            self,
+            rows: Sequence[dict[InstrumentedAttribute, Any]],
+            *,
+            chunk_size: int | None = None,
+    ) -> list:
+        """
+        Пакетный вариант `create_instance`: создаёт записи или возвращает существующие при конфликте.
+
+        Все словари `rows` должны содержать одни и те же колонки. Строки вставляются запросом
+        `INSERT ... ON CONFLICT (уникальные колонки) DO UPDATE ... RETURNING`; SQLAlchemy
+        (insertmanyvalues) отправляет его многострочными VALUES, а не отдельным запросом на строку.
+        Строки с одинаковыми значениями уникальных колонок объединяются (действует последняя):
+        PostgreSQL не позволяет одному запросу изменить строку дважды.
+
+        :param rows: список словарей {column: value}, как в `create_instance`.
+        :param chunk_size: максимальное количество строк в одном запросе (см. `_chunks`).
+        :return: строки (Row) со всеми колонками модели — созданные и уже существовавшие,
+                 в произвольном порядке.
+        """
+        return await self._insert_instances(rows, update_columns=None, chunk_size=chunk_size)
+
+    @traced
+    async def upsert_instances(
+            self,
+            rows: Sequence[dict[InstrumentedAttribute, Any]],
+            *,
+            update_columns: Sequence[InstrumentedAttribute] | None = None,
+            chunk_size: int | None = None,
+    ) -> list:
+        """
+        Создаёт записи, а существующие (по уникальным колонкам из `rows`) обновляет значениями из `rows`:
+        `INSERT ... ON CONFLICT DO UPDATE SET колонка = excluded.колонка ... RETURNING`.
+
+        Все словари `rows` должны содержать одни и те же колонки, среди которых есть уникальная
+        колонка или первичный ключ. Строки с одинаковыми значениями уникальных колонок объединяются
+        (действует последняя).
+
+        :param rows: список словарей {column: value}.
+        :param update_columns: колонки, которые обновляются у существующих записей
+                               (по умолчанию все переданные колонки, кроме уникальных).
+        :param chunk_size: максимальное количество строк в одном запросе (см. `_chunks`).
+        :return: строки (Row) со всеми колонками модели после вставки или обновления, в произвольном порядке.
+        """
+        if update_columns is None:
+            update_columns = ()
+        return await self._insert_instances(rows, update_columns=update_columns, chunk_size=chunk_size)
+
+    async def _insert_instances(
+            self,
+            rows: Sequence[dict[InstrumentedAttribute, Any]],
+            update_columns: Sequence[InstrumentedAttribute] | None,
+            chunk_size: int | None,
+    ) -> list:
+        """
+        Общая часть `create_instances` (`update_columns` is None) и `upsert_instances`.
+        Пустой `update_columns` у `upsert_instances` означает «все переданные колонки, кроме уникальных».
+        """
+        if not rows:
+            return []
+
+        meta = self._meta
+        keys = self._bulk_keys(rows, "В ключе для вставки")
+        for column in update_columns or ():
+            if not is_valid_column_for_model(column, self.model) or column.key not in keys:
+                raise ValueError(f"Обновлять можно только переданные колонки модели {self.model.__name__}. "
+                                 f"Вы передали {column}.")
+
+        conflict_keys = tuple(key for key in keys if key in meta.unique_keys)
+        if update_columns is None:
+            # Как в create_instance: конфликтующая строка «обновляется» на саму себя, чтобы попасть в RETURNING
+            if meta.conflict_update_column is None:
+                raise ValueError(f"Все колонки текущей таблицы {self.model.__tablename__} - primary_key. "
+                                 "Данный метод не может работать с такими таблицами.")
+            set_keys = (meta.conflict_update_column,)
+        else:
+            if not conflict_keys:
+                raise ValueError(f"Для upsert нужна уникальная колонка модели {self.model.__name__} среди переданных.")
+            set_keys = tuple(column.key for column in update_columns) or tuple(
+                key for key in keys if key not in conflict_keys
+            ) or (conflict_keys[0],)
+
+        params = [{column.key: value for column, value in row.items()} for row in rows]
+        if conflict_keys:
+            params = list({tuple(row[key] for key in conflict_keys): row for row in params}.values())
+
+        def build():
+            table = self.model.__table__
+            stmt = insert(table)
+            if conflict_keys:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=list(conflict_keys),
+                    set_={key: stmt.excluded[key] for key in set_keys},
+                )
+            return stmt.returning(*table.columns)
+
+        stmt = meta.statement(('insert_many', keys, set_keys if conflict_keys else None), build)
+        result_rows = []
+        for chunk in _chunks(params, len(keys), chunk_size):
+            # Список параметров: SQLAlchemy разбивает его на многострочные VALUES (insertmanyvalues)
+            result_rows.extend((await self.async_session.execute(stmt, chunk)).all())
+
+        if self.identity_key in keys:
+            self._remember_ids(
+                [(getattr(row, self.identity_key), getattr(row, meta.pk_column.key)) for row in result_rows],
+                created=True,
+            )
+        return result_rows
+
+    @traced
+    async def update_instances(
+            self,
+            rows: Sequence[dict[InstrumentedAttribute, Any]],
+            *,
+            key_columns: Sequence[InstrumentedAttribute] | None = None,
+            chunk_size: int | None = None,
+    ) -> list:
+        """
+        Пакетный вариант `update_instance`: обновляет много записей, у каждой свои значения,
+        одним запросом на пачку строк:
+
+            UPDATE таблица SET колонка = v.колонка FROM (VALUES (...), (...)) AS v (...)
+            WHERE таблица.ключ = v.ключ RETURNING ...
+
+        Все словари `rows` должны содержать одни и те же колонки: колонки `key_columns`
+        определяют запись, остальные — новые значения.
+
+        :param rows: список словарей {column: value}.
+        :param key_columns: колонки, по которым ищется запись (по умолчанию первичный ключ).
+        :param chunk_size: максимальное количество строк в одном запросе (см. `_chunks`).
+        :return: строки (Row) со всеми колонками обновлённых записей в произвольном порядке.
+                 Ненайденные записи пропускаются.
+        """
+        if not rows:
+            return []
+
+        meta = self._meta
+        keys = self._bulk_keys(rows, "В ключе для обновления")
+        key_keys = tuple(column.key for column in key_columns) if key_columns else (meta.pk_column.key,)
+        set_keys = tuple(key for key in keys if key not in key_keys)
+        if not set(key_keys) <= set(keys) or not set_keys:
+            raise ValueError(f"В каждой строке нужны колонки {', '.join(key_keys)} и хотя бы одна колонка для обновления.")
+
+        if self.identity_key is not None and self.identity_key in set_keys:
+            # Старые значения ключа неизвестны, поэтому кэш модели сбрасывается целиком
+            self.forget_ids()
+
+        table = self.model.__table__
+        columns = [column(key, table.c[key].type) for key in (*key_keys, *set_keys)]
+        data = [tuple(row[getattr(self.model, key)] for key in (*key_keys, *set_keys)) for row in rows]
+
+        result_rows = []
+        for chunk in _chunks(data, len(columns), chunk_size):
+            source = values(*columns, name='v').data(chunk)
+            stmt = (
+                update(table)
+                .values({key: source.c[key] for key in set_keys})
+                .where(*(table.c[key] == source.c[key] for key in key_keys))
+                .returning(*table.columns)
+            )
+            result_rows.extend((await self.async_session.execute(stmt)).all())
+        return result_rows
+
+    def _bulk_keys(self, rows: Sequence[dict[InstrumentedAttribute, Any]], message: str) -> tuple[str, ...]:
+        """
+        Проверяет, что строки пакетного метода содержат одни и те же колонки модели, и возвращает их имена.
+
+        :param message: начало сообщения об ошибке для колонки другой модели.
+        """
+        for column in rows[0]:
+            if not is_valid_column_for_model(column, self.model):
+                raise ValueError(f"{message} ожидается колонка модели {self.model.__name__}. "
+                                 f"Вы передали {type(column)}, а именно {column}.")
+        columns = rows[0].keys()
+        for row in rows:
+            if row.keys() != columns:
+                raise ValueError("Все строки пакетного метода должны содержать одни и те же колонки.")
+        return tuple(column.key for column in columns)
 
+    @traced
     async def get_instances(
             self,
             columns: Sequence[InstrumentedAttribute] | InstrumentedAttribute | None = None,
@@ -127,32 +460,238 @@ class _BaseCRUD:
                        а value — значение для фильтрации.
         :return: Список объектов с выбранными колонками.
         """
+        stmt, params = self._select_statement(columns, filters)
+        result = await self.async_session.execute(stmt, params)
+        return result.all()
+
+    @traced
+    async def stream_instances(
+            self,
+            columns: Sequence[InstrumentedAttribute] | InstrumentedAttribute | None = None,
+            filters: dict[InstrumentedAttribute, Sequence[Any] | Any] | None = None,
+            *,
+            batch_size: int = STREAM_BATCH_SIZE,
+            pk_range: tuple[Any, Any] | None = None,
+    ) -> AsyncIterator:
+        """
+        Потоковый вариант `get_instances`: отдаёт записи по одной, не загружая их все в память.
+
+        Строки читаются через серверный курсор (`AsyncSession.stream`) порциями по `batch_size`,
+        поэтому потребление памяти не зависит от размера таблицы. Курсор живёт внутри транзакции
+        сессии и занимает её соединение, пока итерация не закончится.
+
+        Для параллельного чтения одной таблицы её можно разделить на диапазоны первичного ключа
+        (`pk_ranges`) и читать каждый диапазон в своей сессии:
+
+            ranges = await crud.pk_ranges(4)
+            async def scan(pk_range):
+                async with AsyncSessionLocal() as session:
+                    async for row in UserGifTagCRUD(session).stream_instances(pk_range=pk_range):
+                        ...
+            await asyncio.gather(*(scan(pk_range) for pk_range in ranges))
+
+        :param columns: Колонки для возврата. Если None — вернутся все.
+        :param filters: Словарь {column: value}, как в `get_instances`.
+        :param batch_size: количество строк, получаемых из курсора за один раз.
+        :param pk_range: диапазон [от, до) значений первичного ключа (для составного ключа — первой его колонки);
+                         граница None означает отсутствие ограничения с этой стороны.
+        :return: асинхронный итератор строк (Row) с выбранными колонками.
+        """
+        stmt, params = self._select_statement(columns, filters, pk_range)
+        result = await self.async_session.stream(stmt, params, execution_options={'yield_per': batch_size})
+        try:
+            async for row in result:
+                yield row
+        finally:
+            # Итерацию могли прервать: курсор закрывается сразу, а не при сборке мусора
+            await result.close()
+
+    @traced
+    async def pk_ranges(self, partitions: int) -> list[tuple[Any, Any]]:
+        """
+        Делит таблицу на `partitions` диапазонов первичного ключа равной ширины для `stream_instances`.
+
+        Границы считаются по минимальному и максимальному значению ключа (один запрос по индексу),
+        поэтому при неравномерно заполненных ключах диапазоны могут содержать разное число строк.
+        Первый и последний диапазоны открыты, так что вместе диапазоны покрывают любые значения ключа,
+        в том числе записи, добавленные после вызова. Поддерживаются только целочисленные ключи.
+
+        :param partitions: количество диапазонов.
+        :return: список пар [от, до); пустой список, если таблица пуста.
+        """
+        if partitions < 1:
+            raise ValueError("Количество диапазонов должно быть положительным.")
+
+        pk_column = self._meta.pk_column
+        low, high = (await self.async_session.execute(select(func.min(pk_column), func.max(pk_column)))).one()
+        if low is None:
+            return []
+
+        step = max(1, -(-(high - low + 1) // partitions))
+        bounds = [low + step * i for i in range(1, partitions) if low + step * i <= high]
+        return list(zip([None, *bounds], [*bounds, None]))
+
+    def _select_statement(
+            self,
+            columns: Sequence[InstrumentedAttribute] | InstrumentedAttribute | None,
+            filters: dict[InstrumentedAttribute, Sequence[Any] | Any] | None,
+            pk_range: tuple[Any, Any] | None = None,
+    ) -> tuple[Executable, dict[str, Any]]:
+        """Запрос и параметры `get_instances` / `stream_instances` с проверкой колонок."""
         if columns and not isinstance(columns, (list, tuple)):
             columns = (columns, )
-    
+
         if not columns:
-            columns = get_orm_columns(self.model)
+            columns = self._meta.columns
         else:
             for column in columns:
                 if not is_valid_column_for_model(column, self.model):
                     raise ValueError(f"В списке колонок ожидается колонка модели {self.model.__name__}. "
                                      f"Вы передали {type(column)}, а именно {column}.")
-        
-        stmt = select(*columns)
-    
-        if filters:
-            for column, values in filters.items():
-                if not is_valid_column_for_model(column, self.model):
-                    raise ValueError(f"В ключе для фильтрации ожидается колонка модели {self.model.__name__}. "
-                                     f"Вы передали {type(column)}, а именно {column}.")
-                if not isinstance(values, (list, tuple)):
-                    values = (values,)
-    
-                stmt = stmt.where(column.in_(values))
-    
-        result = await self.async_session.execute(stmt)
-        return result.all()
+
+        params = self._filter_params(filters, "В ключе для фильтрации")
+        filter_keys = tuple(params)
+        column_keys = tuple(column.key for column in columns)
+        pk_from, pk_to = pk_range or (None, None)
+        if pk_from is not None:
+            params['pk_from'] = pk_from
+        if pk_to is not None:
+            params['pk_to'] = pk_to
+
+        def build():
+            stmt = select(*columns)
+            for key in filter_keys:
+                stmt = stmt.where(getattr(self.model, key.removeprefix('filter_')).in_(bindparam(key, expanding=True)))
+            if pk_from is not None:
+                stmt = stmt.where(self._meta.pk_column >= bindparam('pk_from'))
+            if pk_to is not None:
+                stmt = stmt.where(self._meta.pk_column < bindparam('pk_to'))
+            return stmt
+
+        key = ('select', column_keys, filter_keys, pk_from is not None, pk_to is not None)
+        return self._meta.statement(key, build), params
+
+    def _filter_params(
+            self,
+            filters: dict[InstrumentedAttribute, Sequence[Any] | Any] | None,
+            message: str,
+    ) -> dict[str, Sequence[Any]]:
+        """
+        Проверяет колонки фильтров и возвращает параметры запроса {`filter_<колонка>`: список значений}.
+
+        :param message: начало сообщения об ошибке для колонки другой модели.
+        """
+        params = {}
+        for column, values in (filters or {}).items():
+            if not is_valid_column_for_model(column, self.model):
+                raise ValueError(f"{message} ожидается колонка модели {self.model.__name__}. "
+                                 f"Вы передали {type(column)}, а именно {column}.")
+            if not isinstance(values, (list, tuple)):
+                values = (values,)
+            params[f'filter_{column.key}'] = list(values)
+        return params
+
+    @traced
+    async def resolve_ids(
+            self,
+            keys: Iterable[Any],
+            *,
+            create: bool = False,
+    ) -> dict[Any, Any]:
+        """
+        Возвращает первичные ключи записей по значениям колонки `identity_key`.
+
+        Сначала ключи ищутся в `identity_map`, недостающие получаются одним запросом
+        и сохраняются в кэш (при `create=True` — после фиксации транзакции, см. `_remember_ids`).
+        Если все ключи есть в кэше, обращения к БД не происходит.
+
+        При `create=True` отсутствующие записи создаются тем же запросом:
+        `INSERT ... SELECT unnest(...) ON CONFLICT DO NOTHING` в CTE и выборка уже существующих записей.
+        Существующие строки не обновляются и не блокируются. Ключи передаются одним параметром-массивом,
+        поэтому текст запроса не зависит от их количества (см. `_resolve_statements`).
+
+        :param keys: значения колонки `identity_key` (повторы допускаются).
+        :param create: создавать ли отсутствующие записи.
+        :return: словарь {ключ: первичный ключ}. Без `create` ненайденных ключей в нём нет.
+        """
+        if self.identity_key is None:
+            raise TypeError(f"Для {type(self).__name__} не задана колонка identity_key.")
+
+        ids = {}
+        missing = []
+        for key in set(keys):
+            id_ = self.identity_map.get(key) if self.identity_map is not None else None
+            if id_ is None:
+                missing.append(key)
+            else:
+                ids[key] = id_
+
+        if not missing:
+            return ids
+
+        existing, existing_or_create = _resolve_statements(self.model, self.identity_key)
+        # Сортировка задаёт одинаковый порядок вставки в конкурирующих транзакциях
+        missing.sort()
+        found = dict((await self.async_session.execute(
+            existing_or_create if create else existing, {'keys': missing},
+        )).all())
+
+        if create and len(found) < len(missing):
+            # Запись, вставленная параллельной транзакцией после начала запроса,
+            # не видна ни одной из его частей — дочитываем такие записи отдельно.
+            rest = [key for key in missing if key not in found]
+            found.update((await self.async_session.execute(existing, {'keys': rest})).all())
+
+        self._remember_ids(found.items(), created=create)
+
+        ids.update(found)
+        return ids
+
+    def _remember_ids(self, ids: Iterable[tuple[Any, Any]], created: bool = False) -> None:
+        """
+        Сохраняет соответствия «значение `identity_key` -> первичный ключ» в `identity_map`.
+
+        Если текущая транзакция сессии создавала записи (этим вызовом, `created=True`, или раньше),
+        соответствия откладываются до её фиксации: после отката в кэше не должны остаться первичные
+        ключи записей, которых нет в БД. Соответствия из транзакций без вставок — это уже
+        зафиксированные записи, они сохраняются сразу.
+
+        :param ids: пары (значение `identity_key`, первичный ключ).
+        :param created: могли ли записи быть созданы в текущей транзакции.
+        """
+        if self.identity_map is None:
+            return
+
+        session = self.async_session.sync_session
+        pending = session.info.setdefault(_PENDING_IDS, {})
+        transaction = session.get_nested_transaction() or session.get_transaction()
+        if transaction is None or not (created or pending):
+            for key, id_ in ids:
+                self.identity_map.set(key, id_)
+            return
+
+        pending.setdefault(transaction, []).extend((self.identity_map, key, id_) for key, id_ in ids)
+
+    def forget_ids(self, keys: Iterable[Any] | None = None) -> None:
+        """
+        Удаляет соответствия из `identity_map`.
+
+        Нужно, если записи могли быть удалены в обход этого класса
+        (например, другим процессом или каскадным удалением).
+
+        :param keys: значения колонки `identity_key`. Если None — кэш модели очищается полностью.
+        """
+        if self.identity_map is None:
+            return
+
+        if keys is None:
+            self.identity_map.clear()
+            return
+
+        for key in keys:
+            self.identity_map.invalidate(key)
     
+    @traced
     async def update_instance(
             self,
             instance_id: int | None,
@@ -172,34 +711,51 @@ class _BaseCRUD:
         :param filters: Словарь {column: value} для фильтрации обновляемых записей, используется если `instance_id` не задан. Воз
         :return: Row с колонками модели после обновления, или None, если запись не найдена.
         """
-        
+
         for column in values:
             if not is_valid_column_for_model(column, self.model):
                 raise ValueError(f"В ключе для вставки ожидается колонка модели {self.model.__name__}. "
                                  f"Вы передали {type(column)}, а именно {column}.")
-        
-        columns = get_orm_columns(self.model)
-        
-        if instance_id is not None:
-            stmt = update(self.model).where(inspect(self.model).primary_key[0] == instance_id).values(values).returning(*columns)
-            result = await self.async_session.execute(stmt)
-            return result.fetchone()        
 
-        if not filters:
+        if self.identity_key is not None and getattr(self.model, self.identity_key) in values:
+            # Старое значение ключа неизвестно, поэтому кэш модели сбрасывается целиком
+            self.forget_ids()
+
+        params = {f'values_{column.key}': value for column, value in values.items()}
+        if instance_id is not None:
+            params['instance_id'] = instance_id
+        elif not filters:
             raise ValueError("Нужно указать либо instance_id, либо фильтры для удаления.")
+        else:
+            for column, id_ in filters.items():
+                if not is_valid_column_for_model(column, self.model):
+                    raise ValueError(f"В ключе для фильтрации ожидается колонка модели {self.model.__name__}. "
+                                     f"Вы передали {type(column)}, а именно {column}.")
+                params[f'filter_{column.key}'] = id_
 
-        stmt = update(self.model).returning(*columns)
-        for column, id_ in filters.items():
-            if not is_valid_column_for_model(column, self.model):
-                raise ValueError(f"В ключе для фильтрации ожидается колонка модели {self.model.__name__}. "
-                                 f"Вы передали {type(column)}, а именно {column}.")
+        value_keys = tuple(column.key for column in values)
+        filter_keys = None if instance_id is not None else tuple(column.key for column in filters)
 
-            stmt = stmt.where(column == id_)
+        def build():
+            stmt = update(self.model).values({
+                key: bindparam(f'values_{key}', type_=getattr(self.model, key).type) for key in value_keys
+            })
+            if filter_keys is None:
+                stmt = stmt.where(self._meta.pk_column == bindparam('instance_id'))
+            else:
+                for key in filter_keys:
+                    stmt = stmt.where(getattr(self.model, key) == bindparam(f'filter_{key}'))
+            # Строки возвращаются через RETURNING, ORM-объекты сессии не синхронизируются: значения в запросе —
+            # параметры кэшируемого текста, и синхронизация SQLAlchemy ('evaluate' / 'fetch') записала бы
+            # в загруженные объекты не новые значения. CRUD-классы и сервисы ORM-объекты не загружают
+            return stmt.returning(*self._meta.columns).execution_options(synchronize_session=False)
 
-        result = await self.async_session.execute(stmt)
+        stmt = self._meta.statement(('update', value_keys, filter_keys), build)
+        result = await self.async_session.execute(stmt, params)
         # noinspection PyUnresolvedReferences
         return result.fetchone()
 
+    @traced
     async def delete_instances(
             self,
             instance_id: int | None = None,
@@ -218,24 +774,42 @@ class _BaseCRUD:
         :return: Количество удалённых строк.
         """
         if instance_id is not None:
-            stmt = delete(self.model).where(inspect(self.model).primary_key[0] == instance_id)
-            result = await self.async_session.execute(stmt)
-            # noinspection PyTypeChecker
-            return result.rowcount
-    
+            return await self._execute_delete(None, {'instance_id': instance_id})
+
         if not filters:
             raise ValueError("Нужно указать либо instance_id, либо фильтры для удаления.")
 
-        stmt = delete(self.model)
-        for column, values in filters.items():
-            if not is_valid_column_for_model(column, self.model):
-                raise ValueError(f"В ключе для фильтрации ожидается колонка модели {self.model.__name__}. "
-                                 f"Вы передали {type(column)}, а именно {column}.")
-            if not isinstance(values, (list, tuple)):
-                values = (values,)
-    
-            stmt = stmt.where(column.in_(values))
-        
-        result = await self.async_session.execute(stmt)
-        # noinspection PyUnresolvedReferences
-        return result.rowcount
+        params = self._filter_params(filters, "В ключе для фильтрации")
+        return await self._execute_delete(tuple(params), params)
+
+    async def _execute_delete(self, filter_keys: tuple[str, ...] | None, params: dict[str, Any]) -> int:
+        """
+        Выполняет DELETE по первичному ключу (`filter_keys` is None) или по фильтрам
+        и возвращает количество удалённых строк.
+
+        Если у модели есть `identity_map`, удалённые ключи возвращаются через RETURNING
+        и убираются из кэша.
+        """
+        tracks_ids = self.identity_key is not None and self.identity_map is not None
+
+        def build():
+            stmt = delete(self.model)
+            if filter_keys is None:
+                stmt = stmt.where(self._meta.pk_column == bindparam('instance_id'))
+            else:
+                for key in filter_keys:
+                    stmt = stmt.where(getattr(self.model, key.removeprefix('filter_')).in_(bindparam(key, expanding=True)))
+            if tracks_ids:
+                stmt = stmt.returning(getattr(self.model, self.identity_key))
+            # Как в update_instance: загруженных ORM-объектов моделей в сессиях сервисов нет
+            return stmt.execution_options(synchronize_session=False)
+
+        stmt = self._meta.statement(('delete', filter_keys, tracks_ids and self.identity_key), build)
+        result = await self.async_session.execute(stmt, params)
+        if not tracks_ids:
+            # noinspection PyUnresolvedReferences
+            return result.rowcount
+
+        deleted = result.scalars().all()
+        self.forget_ids(deleted)
+        return len(deleted)
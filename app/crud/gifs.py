@@ -1,5 +1,6 @@
-from sqlalchemy.ext.asyncio import AsyncSession
 from app.crud import _BaseCRUD
+from app.utils import LRUCache
+from app import config
 from app.models import Gif
 
 
@@ -11,11 +12,9 @@ class GifsCRUD(_BaseCRUD):
     Остальные операции наследуются от BaseCRUD.
     """
     
-    def __init__(
-            self, 
-            async_session: AsyncSession
-    ):
-        super().__init__(async_session, model=Gif)
+    model = Gif
+    identity_key = 'tg_gif_id'
+    identity_map = LRUCache(max_weight=config.IDENTITY_MAP_MAX_ENTRIES)
 
     async def create_gif(
             self,
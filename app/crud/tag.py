@@ -1,6 +1,7 @@
-from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import Tag
 from app.crud import _BaseCRUD
+from app.utils import LRUCache
+from app import config
 
 
 class TagsCRUD(_BaseCRUD):
@@ -11,8 +12,9 @@ class TagsCRUD(_BaseCRUD):
     Остальные операции (get / update / delete) наследуются от BaseCRUD.
     """
 
-    def __init__(self, async_session: AsyncSession):
-        super().__init__(async_session, model=Tag)
+    model = Tag
+    identity_key = 'tag'
+    identity_map = LRUCache(max_weight=config.IDENTITY_MAP_MAX_ENTRIES)
 
     async def create_tag(
             self,
@@ -37,4 +39,3 @@ class TagsCRUD(_BaseCRUD):
         return await super().create_instance({
             Tag.tag: tag
         })
-    
\ No newline at end of file
@@ -1,6 +1,67 @@
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, select, func, bindparam, cast, all_, tuple_, Integer
+from sqlalchemy.dialects.postgresql import insert, ARRAY
+from typing import Iterable, Sequence
 from app.crud import _BaseCRUD
 from app.models import UserGifTag
+from app.utils import precompile
+from app.query_log import traced
+
+
+def _int_array(name: str):
+    """Параметр-массив целых чисел с явным приведением типа (нужно для `precompile`)."""
+    return cast(bindparam(name), ARRAY(Integer))
+
+
+def _unnest(name: str, *columns: str):
+    """Таблица из массивов-параметров `<name>_<column>s` (по одному массиву на колонку)."""
+    return (
+        func.unnest(*(_int_array(f'{name}_{column}s') for column in columns))
+        .table_valued(*columns)
+        .render_derived(name=name)
+    )
+
+
+# Запросы принимают теги и связи массивами, поэтому текст запроса не зависит от их количества.
+# PostgreSQL-вариант insert() не кэшируется SQLAlchemy, поэтому INSERT компилируется один раз здесь.
+_create_user_gif_tags_stmt = precompile(
+    insert(UserGifTag.__table__)
+    .from_select(['user_id', 'gif_id', 'tag_id'], select(
+        cast(bindparam('user_id', type_=Integer), Integer),
+        cast(bindparam('gif_id', type_=Integer), Integer),
+        func.unnest(_int_array('tag_ids')),
+    ))
+    .on_conflict_do_nothing()
+)
+_delete_user_gif_tags_except_stmt = (
+    delete(UserGifTag)
+    .where(UserGifTag.user_id == bindparam('user_id'), UserGifTag.gif_id == bindparam('gif_id'))
+    # `<> ALL` пустого массива истинно: без тегов для сохранения удаляются все связи
+    .where(UserGifTag.tag_id != all_(_int_array('keep_tag_ids')))
+    .execution_options(synchronize_session=False)
+)
+
+_links = _unnest('links', 'user_id', 'gif_id', 'tag_id')
+_pairs = _unnest('pairs', 'user_id', 'gif_id')
+# INSERT ... SELECT строится по таблице, а не по ORM-модели: ORM поддерживает только INSERT ... VALUES
+_create_links_stmt = precompile(
+    insert(UserGifTag.__table__)
+    .from_select(['user_id', 'gif_id', 'tag_id'], select(_links.c.user_id, _links.c.gif_id, _links.c.tag_id))
+    .on_conflict_do_nothing()
+    .returning(UserGifTag.__table__.c.user_id, UserGifTag.__table__.c.gif_id)
+)
+_delete_links_except_stmt = (
+    delete(UserGifTag)
+    .where(tuple_(UserGifTag.user_id, UserGifTag.gif_id).in_(select(_pairs.c.user_id, _pairs.c.gif_id)))
+    .where(tuple_(UserGifTag.user_id, UserGifTag.gif_id, UserGifTag.tag_id).not_in(
+        select(_links.c.user_id, _links.c.gif_id, _links.c.tag_id)
+    ))
+    .returning(UserGifTag.user_id, UserGifTag.gif_id)
+    .execution_options(synchronize_session=False)
+)
+
+# Advisory-блокировки пересчёта user_gifs для всех пользователей сразу, по возрастанию слотов
+# (функция user_gifs_lock_users, см. миграцию d4f1a7c93e52)
+_lock_users_stmt = select(func.user_gifs_lock_users(_int_array('user_ids')))
 
 
 class UserGifTagCRUD(_BaseCRUD):
@@ -11,9 +72,9 @@ class UserGifTagCRUD(_BaseCRUD):
     Остальные операции наследуются от BaseCRUD.    
     """
 
-    def __init__(self, async_session: AsyncSession):
-        super().__init__(async_session, model=UserGifTag)
+    model = UserGifTag
 
+    @traced
     async def create_user_gif_tag(
             self,
             user_id: int,
@@ -35,3 +96,112 @@ class UserGifTagCRUD(_BaseCRUD):
             UserGifTag.gif_id: gif_id,
             UserGifTag.tag_id: tag_id,
         })
+
+    @traced
+    async def create_user_gif_tags(
+            self,
+            user_id: int,
+            gif_id: int,
+            tag_ids: Sequence[int],
+    ) -> int:
+        """
+        Создаёт связи пользователя и гифки сразу с несколькими тегами
+        одним `INSERT ... SELECT unnest(...) ON CONFLICT DO NOTHING`.
+
+        Уже существующие связи не изменяются.
+
+        :return: количество созданных связей.
+        """
+        if not tag_ids:
+            return 0
+
+        result = await self.async_session.execute(_create_user_gif_tags_stmt, {
+            'user_id': user_id,
+            'gif_id': gif_id,
+            'tag_ids': list(tag_ids),
+        })
+        # noinspection PyUnresolvedReferences
+        return result.rowcount
+
+    @traced
+    async def delete_user_gif_tags_except(
+            self,
+            user_id: int,
+            gif_id: int,
+            keep_tag_ids: Sequence[int],
+    ) -> int:
+        """
+        Удаляет одним запросом все связи пользователя и гифки, кроме связей с тегами `keep_tag_ids`.
+
+        Если `keep_tag_ids` пуст, удаляются все теги гифки у пользователя.
+
+        :return: количество удалённых связей.
+        """
+        result = await self.async_session.execute(_delete_user_gif_tags_except_stmt, {
+            'user_id': user_id,
+            'gif_id': gif_id,
+            'keep_tag_ids': list(keep_tag_ids),
+        })
+        # noinspection PyUnresolvedReferences
+        return result.rowcount
+
+    @traced
+    async def create_links(self, links: Sequence[tuple[int, int, int]]) -> set[tuple[int, int]]:
+        """
+        Создаёт связи (user_id, gif_id, tag_id) сразу для нескольких пар пользователь-гифка
+        одним `INSERT ... SELECT FROM unnest(...) ON CONFLICT DO NOTHING`.
+
+        Уже существующие связи не изменяются.
+
+        :return: пары (user_id, gif_id), у которых появились новые связи.
+        """
+        if not links:
+            return set()
+
+        user_ids, gif_ids, tag_ids = zip(*links)
+        result = await self.async_session.execute(_create_links_stmt, {
+            'links_user_ids': list(user_ids),
+            'links_gif_ids': list(gif_ids),
+            'links_tag_ids': list(tag_ids),
+        })
+        return {(row.user_id, row.gif_id) for row in result}
+
+    @traced
+    async def delete_links_except(
+            self,
+            pairs: Sequence[tuple[int, int]],
+            keep_links: Sequence[tuple[int, int, int]],
+    ) -> set[tuple[int, int]]:
+        """
+        Удаляет одним запросом все связи пар (user_id, gif_id) из `pairs`, кроме связей `keep_links`
+        (user_id, gif_id, tag_id). Пакетный вариант `delete_user_gif_tags_except`.
+
+        :return: пары (user_id, gif_id), у которых были удалены связи.
+        """
+        if not pairs:
+            return set()
+
+        pair_user_ids, pair_gif_ids = zip(*pairs)
+        user_ids, gif_ids, tag_ids = zip(*keep_links) if keep_links else ((), (), ())
+        result = await self.async_session.execute(_delete_links_except_stmt, {
+            'pairs_user_ids': list(pair_user_ids),
+            'pairs_gif_ids': list(pair_gif_ids),
+            'links_user_ids': list(user_ids),
+            'links_gif_ids': list(gif_ids),
+            'links_tag_ids': list(tag_ids),
+        })
+        return {(row.user_id, row.gif_id) for row in result}
+
+    @traced
+    async def lock_users(self, user_ids: Iterable[int]) -> None:
+        """
+        Берёт до конца транзакции advisory-блокировки, под которыми триггеры пересчитывают
+        строки `user_gifs` пользователей `user_ids`.
+
+        Транзакция, меняющая связи нескольких пользователей несколькими запросами, должна вызвать
+        метод до первого изменения: иначе триггеры берут блокировки в порядке запросов, и две
+        такие транзакции могут ждать друг друга (deadlock).
+        """
+        user_ids = list(user_ids)
+        if user_ids:
+            await self.async_session.execute(_lock_users_stmt, {'user_ids': user_ids})
@@ -1,6 +1,8 @@
-from sqlalchemy.ext.asyncio import AsyncSession
 from app.crud import _BaseCRUD
+from app.utils import LRUCache
+from app import config
 from app.models import User
+from app.query_log import traced
 
 
 class UsersCRUD(_BaseCRUD):
@@ -11,9 +13,11 @@ class UsersCRUD(_BaseCRUD):
     Остальные операции наследуются от BaseCRUD.
     """
 
-    def __init__(self, async_session: AsyncSession):
-        super().__init__(async_session, model=User)
+    model = User
+    identity_key = 'tg_id'
+    identity_map = LRUCache(max_weight=config.IDENTITY_MAP_MAX_ENTRIES)
 
+    @traced
     async def create_user(
             self,
             tg_id: int,
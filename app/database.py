@@ -1,22 +1,131 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from environs import Env
+import asyncio
+import itertools
+from typing import Awaitable, Callable
+from fastapi import Request
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
+from app import config
+from app.config import env
+from app.utils import InstrumentedAsyncQueuePool, LRUCache
+from app.metrics import instrument_engine, DB_READ_SESSIONS
+from app.query_log import install_slow_query_log
 
 
-env = Env()
-env.read_env()
+# Движок создаётся при первом обращении (get_engine), а не при импорте модуля: импорт `app.*`
+# не требует переменных подключения к БД. Сессии AsyncSessionLocal привязываются к движку при его создании.
+_engine: AsyncEngine | None = None
+AsyncSessionLocal = async_sessionmaker()
 
-POSTGRES_USER = env("POSTGRES_USER")
-POSTGRES_PASSWORD = env("POSTGRES_PASSWORD")
-POSTGRES_DB = env("POSTGRES_DB")
-POSTGRES_HOST = env("POSTGRES_HOST")
-POSTGRES_PORT = env("POSTGRES_PORT")
+# Движки реплик (DB_REPLICA_URLS) создаются вместе с основным, чтения распределяются по ним по кругу
+_replica_engines: list[AsyncEngine] = []
+_replica_counter = itertools.count()
 
-DATABASE_URL = (
-    f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-)
+# Пользователи, недавно изменившие библиотеку: их чтения идут в основную БД, пока реплики не догонят её.
+# Кэш свой у каждого процесса: при нескольких воркерах (`uvicorn --workers N`) см. ограничение в `stick_to_primary`
+recent_writers = LRUCache(max_weight=100_000, ttl=config.DB_READ_YOUR_WRITES_SECONDS)
 
-engine = create_async_engine(DATABASE_URL)
-AsyncSessionLocal = async_sessionmaker(bind=engine)
+
+def get_database_url() -> str:
+    """URL подключения к PostgreSQL из переменных окружения `POSTGRES_*` (читаются при вызове)."""
+    return (
+        f"postgresql+asyncpg://{env('POSTGRES_USER')}:{env('POSTGRES_PASSWORD')}"
+        f"@{env('POSTGRES_HOST')}:{env('POSTGRES_PORT')}/{env('POSTGRES_DB')}"
+    )
+
+
+def build_engine(url: str | None = None) -> AsyncEngine:
+    """
+    Создаёт движок с пулом из настроек `DB_POOL_*` и подключает к нему метрики и журнал медленных запросов.
+
+    :param url: URL подключения (по умолчанию `get_database_url()`).
+    """
+    engine = create_async_engine(
+        url or get_database_url(),
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+        connect_args={'prepared_statement_cache_size': config.DB_PREPARED_STATEMENT_CACHE_SIZE},
+    )
+    instrument_engine(engine)
+    install_slow_query_log(engine)
+    return engine
+
+
+def get_engine() -> AsyncEngine:
+    """
+    Движок основной БД; при первом вызове создаётся и становится движком сессий `AsyncSessionLocal`.
+    Вместе с ним создаются движки реплик из `DB_REPLICA_URLS`.
+    """
+    global _engine
+    if _engine is None:
+        _engine = build_engine()
+        _replica_engines[:] = [build_engine(url) for url in config.DB_REPLICA_URLS]
+        AsyncSessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def get_replica_engines() -> list[AsyncEngine]:
+    """Движки реплик для чтения (пустой список, если реплики не настроены)."""
+    get_engine()
+    return list(_replica_engines)
+
+
+async def dispose_engine() -> None:
+    """Закрывает соединения основной БД и реплик. Следующий `get_engine()` создаст новые движки."""
+    global _engine
+    if _engine is None:
+        return
+    engines = [_engine, *_replica_engines]
+    _engine = None
+    _replica_engines.clear()
+    AsyncSessionLocal.configure(bind=None)
+    for engine in engines:
+        await engine.dispose()
+
+
+def stick_to_primary(tg_user_id: int) -> None:
+    """
+    Направляет чтения пользователя в основную БД на `DB_READ_YOUR_WRITES_SECONDS` секунд.
+
+    Вызывается после фиксации изменений библиотеки пользователя, чтобы следующий запрос
+    не прочитал с отстающей реплики данные до изменения.
+
+    Ограничение: отметка хранится в памяти процесса (`recent_writers`), поэтому read-your-writes
+    гарантируется только в пределах одного воркера. При нескольких воркерах (`uvicorn --workers N`,
+    несколько контейнеров) чтение, попавшее в другой воркер, может вернуть данные отстающей реплики.
+    Если это важно, запускайте приложение с репликами в одном воркере или направляйте запросы
+    одного пользователя в один и тот же воркер (балансировка по `tg_user_id`).
+    """
+    if _replica_engines:
+        recent_writers.set(tg_user_id, True)
+
+
+def read_session(tg_user_id: int | None = None) -> AsyncSession:
+    """
+    Сессия только для чтения: на следующей по кругу реплике или на основной БД, если реплик нет
+    или пользователь `tg_user_id` недавно менял свою библиотеку через этот же воркер
+    (см. ограничение в `stick_to_primary`).
+
+    Запись через такую сессию допускать нельзя: реплика её отклонит.
+    """
+    get_engine()
+    if not _replica_engines or (tg_user_id is not None and tg_user_id in recent_writers):
+        DB_READ_SESSIONS.labels('primary').inc()
+        return AsyncSessionLocal()
+
+    DB_READ_SESSIONS.labels('replica').inc()
+    return AsyncSessionLocal(bind=_replica_engines[next(_replica_counter) % len(_replica_engines)])
+
+
+def _request_tg_user_id(request: Request) -> int | None:
+    """Telegram ID пользователя из пути или параметров запроса, если он там есть."""
+    value = request.path_params.get('tg_user_id', request.query_params.get('tg_user_id'))
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
 
 
 async def get_db():
@@ -25,3 +134,61 @@ async def get_db():
             yield db
         finally:
             await db.close()
+
+
+async def get_read_db(request: Request):
+    """
+    Зависимость для читающих эндпоинтов: сессия на реплике (см. `read_session`).
+
+    Пользователь определяется по параметру `tg_user_id` пути или запроса, чтобы после его изменений
+    чтения шли в основную БД. Без реплик сессия та же, что у `get_db`.
+    """
+    async with read_session(_request_tg_user_id(request)) as db:
+        try:
+            yield db
+        finally:
+            await db.close()
+
+
+async def warmup_pool(
+        async_engine: AsyncEngine | None = None,
+        connections: int = config.DB_POOL_WARMUP,
+        prepare: Callable[[AsyncSession], Awaitable] | None = None,
+) -> int:
+    """
+    Заранее открывает соединения пула, чтобы первые запросы после старта не тратили время на подключение.
+
+    Соединения открываются одновременно и удерживаются, пока не откроются все,
+    иначе пул раз за разом выдавал бы одно и то же соединение.
+    Количество ограничено размером пула: соединения сверх него закрылись бы при возврате.
+
+    :param async_engine: движок, пул которого нужно заполнить (по умолчанию движок приложения).
+    :param connections: сколько соединений открыть.
+    :param prepare: вызывается на каждом открытом соединении с сессией поверх него, например чтобы
+                    подготовить часто используемые запросы. Транзакция сессии затем откатывается.
+    :return: количество открытых соединений.
+    """
+    async_engine = async_engine or get_engine()
+    connections = min(connections, async_engine.pool.size())
+    if connections <= 0:
+        return 0
+
+    opened = asyncio.Event()
+    ready = 0
+
+    async def hold_connection():
+        nonlocal ready
+        async with async_engine.connect() as connection:
+            if prepare is not None:
+                async with AsyncSession(bind=connection) as session:
+                    await prepare(session)
+            ready += 1
+            if ready == connections:
+                opened.set()
+            await opened.wait()
+
+    # TaskGroup отменит остальные подключения, если одно из них завершится ошибкой
+    async with asyncio.TaskGroup() as group:
+        for _ in range(connections):
+            group.create_task(hold_connection())
+    return connections
@@ -1,8 +1,65 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
-from app.routers import user, search
+from app import config
+from app.database import get_engine, get_replica_engines, dispose_engine, warmup_pool
+from app.metrics import MetricsMiddleware
+from app.routers import user, search, health, metrics
+from app.services import prepare_statements
+from app.services.user_services import tag_writes
 
-app = FastAPI()
+
+logger = logging.getLogger(__name__)
+
+# Пауза между попытками прогрева, если БД недоступна: удваивается до максимума
+WARMUP_RETRY_DELAY = 1
+WARMUP_RETRY_MAX_DELAY = 30
+
+
+async def warmup(app: FastAPI) -> None:
+    """
+    Прогревает пулы соединений основной БД и реплик и подготавливает горячие запросы,
+    затем отмечает воркер готовым (`GET /health/ready`). Пока БД недоступна, повторяет попытки.
+    """
+    # Без кэша подготовленных запросов asyncpg (например, за pgbouncer) готовить их заранее бессмысленно
+    prepare = prepare_statements if config.DB_PREPARED_STATEMENT_CACHE_SIZE else None
+    delay = WARMUP_RETRY_DELAY
+    while True:
+        try:
+            for engine in (get_engine(), *get_replica_engines()):
+                await warmup_pool(engine, prepare=prepare)
+            break
+        except Exception:
+            logger.exception("Database warmup failed, retrying in %s s", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_RETRY_MAX_DELAY)
+    app.state.ready = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Прогрев идёт в фоне: воркер сразу отвечает на /health/live, а трафик получает после /health/ready
+    app.state.ready = False
+    get_engine()
+    warmup_task = asyncio.create_task(warmup(app))
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        warmup_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await warmup_task
+        # Записи, уже поставленные в очередь group commit, применяются до закрытия соединений
+        await tag_writes.drain()
+        await dispose_engine()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 
 app.include_router(search.router)
 app.include_router(user.router)
+app.include_router(health.router)
+app.include_router(metrics.router)
@@ -0,0 +1,344 @@
+"""
+Метрики приложения в текстовом формате Prometheus.
+
+Модуль содержит минимальные реализации счётчика, gauge и гистограммы без внешних зависимостей,
+ASGI-middleware для HTTP-запросов и обработчики событий SQLAlchemy для SQL-запросов.
+
+Метрики хранятся в памяти процесса и изменяются только из его event loop, поэтому обходятся
+без блокировок. При нескольких воркерах каждый отдаёт свои значения, суммирует их Prometheus.
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Callable, Iterable, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+# ===== Примитивы =====
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """Базовый класс метрики: имя, описание, имена меток и значения по наборам меток."""
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values):
+        """Возвращает значение метрики для набора меток (в порядке `labelnames`), создавая его при необходимости."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name}: expected labels {self.labelnames}, got {values}')
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        # Метрика без меток хранит единственное значение под пустым набором
+        return self.labels()
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {_escape(self.documentation)}'
+        yield f'# TYPE {self.name} {self.type_name}'
+        for values, child in self._children.items():
+            yield from self._render_child(values, child)
+
+    def _render_child(self, values, child) -> Iterable[str]:
+        yield f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}'
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """Монотонно возрастающий счётчик."""
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    """Значение, которое может как расти, так и уменьшаться."""
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default().dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # Последний элемент — корзина +Inf; значения хранятся некумулятивно, суммируются при выводе
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин (`le`)."""
+    type_name = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = (),
+            registry=None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def _render_child(self, values, child) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float('inf')), child.counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            yield f'{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}'
+        labels = _format_labels(self.labelnames, values)
+        yield f'{self.name}_sum{labels} {_format_value(child.sum)}'
+        yield f'{self.name}_count{labels} {child.count}'
+
+
+# Функция, возвращающая метрики, значения которых вычисляются в момент запроса /metrics:
+# список (имя, тип, описание, [({метки}, значение), ...])
+Collector = Callable[[], Iterable[tuple[str, str, str, list[tuple[dict, float]]]]]
+
+
+class Registry:
+    """Набор метрик, отдаваемых эндпоинтом /metrics."""
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Collector] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Возвращает все метрики в текстовом формате Prometheus (версия 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, type_name, documentation, samples in collector():
+                lines.append(f'# HELP {name} {_escape(documentation)}')
+                lines.append(f'# TYPE {name} {type_name}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# ===== Метрики приложения =====
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROWS_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+HTTP_REQUESTS = Counter(
+    'http_requests_total', 'Количество HTTP-запросов', ('method', 'route', 'status'),
+)
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Время обработки HTTP-запроса', ('method', 'route'), LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'HTTP-запросы, обрабатываемые в данный момент',
+)
+DB_STATEMENT_DURATION = Histogram(
+    'db_statement_duration_seconds', 'Время выполнения SQL-запроса', ('operation', 'fingerprint'), LATENCY_BUCKETS,
+)
+DB_STATEMENT_ROWS = Histogram(
+    'db_statement_rows', 'Количество строк, возвращённых или изменённых SQL-запросом',
+    ('operation', 'fingerprint'), ROWS_BUCKETS,
+)
+DB_READ_SESSIONS = Counter(
+    'db_read_sessions_total', 'Сессии читающих эндпоинтов по базе, в которую они направлены', ('target',),
+)
+GROUP_COMMIT_FALLBACKS = Counter(
+    'group_commit_fallbacks_total', 'Пакеты group commit, применённые по одной записи через SAVEPOINT после ошибки',
+)
+
+# Текст SQL-запроса для значения метки fingerprint записывается в журнал один раз на процесс,
+# а не в метку: длинный текст в метке раздувал бы каждый ряд и ответ /metrics
+logger = logging.getLogger('app.sql_fingerprint')
+_logged_fingerprints: set[str] = set()
+
+# Запросы, не сопоставленные ни с одним маршрутом, объединяются, чтобы не плодить метки
+UNMATCHED_ROUTE = '<unmatched>'
+
+
+# ===== HTTP =====
+class MetricsMiddleware:
+    """
+    ASGI-middleware, собирающее метрики HTTP-запросов.
+
+    Время и количество запросов учитываются по шаблону маршрута (`/user/{tg_user_id}/tags`),
+    а не по фактическому пути, чтобы количество рядов не зависело от ID в URL.
+    Для потоковых ответов время включает передачу всего тела.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            # FastAPI кладёт сопоставленный маршрут в scope при маршрутизации
+            route = scope.get('route')
+            template = getattr(route, 'path', UNMATCHED_ROUTE)
+            method = scope['method']
+            HTTP_REQUEST_DURATION.labels(method, template).observe(elapsed)
+            HTTP_REQUESTS.labels(method, template, str(status)).inc()
+
+
+# ===== SQL =====
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?\b')
+_PARAMETER = re.compile(r'\$\d+|%\(\w+\)s|\?')
+_PARAMETER_LIST = re.compile(r'(\?(?:::\w+)?)(?:\s*,\s*\?(?:::\w+)?)+')
+_IN_LIST = re.compile(r'\bIN \((\?(?:::\w+)?)\)', re.IGNORECASE)
+_VALUES_LIST = re.compile(r'\b(VALUES \([^()]*\))(?:\s*,\s*\([^()]*\))*', re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def statement_fingerprint(statement: str) -> tuple[str, str, str]:
+    """
+    Нормализует SQL-запрос и возвращает (fingerprint, operation, нормализованный текст).
+
+    Литералы и параметры заменяются на `?`, списки параметров (`IN (...)`, развёрнутые
+    SQLAlchemy) и строки `VALUES` сворачиваются до первого элемента, поэтому запросы,
+    отличающиеся только количеством значений, получают один fingerprint — короткий хэш нормализованного текста.
+    При первом появлении fingerprint его нормализованный текст пишется в журнал `app.sql_fingerprint`
+    (уровень INFO, запись JSON в формате журнала медленных запросов).
+
+    Результат кэшируется по исходному тексту: SQLAlchemy отправляет одни и те же строки запросов,
+    поэтому нормализация выполняется один раз на запрос.
+    """
+    normalized = _WHITESPACE.sub(' ', statement).strip()
+    normalized = _STRING_LITERAL.sub('?', normalized)
+    normalized = _PARAMETER.sub('?', normalized)
+    normalized = _NUMBER_LITERAL.sub('?', normalized)
+    normalized = _PARAMETER_LIST.sub(r'\1, ...', normalized)
+    normalized = _IN_LIST.sub(r'IN (\1, ...)', normalized)
+    normalized = _VALUES_LIST.sub(r'\1, ...', normalized)
+
+    operation = normalized.split(' ', 1)[0].upper() if normalized else ''
+    fingerprint = hashlib.blake2b(normalized.encode(), digest_size=6).hexdigest()
+    if fingerprint not in _logged_fingerprints:
+        _logged_fingerprints.add(fingerprint)
+        logger.info(json.dumps(
+            {'event': 'sql_fingerprint', 'fingerprint': fingerprint, 'operation': operation, 'statement': normalized},
+            ensure_ascii=False,
+        ))
+    return fingerprint, operation, normalized
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    fingerprint, operation, _ = statement_fingerprint(statement)
+    DB_STATEMENT_DURATION.labels(operation, fingerprint).observe(elapsed)
+    # Для серверных курсоров (stream) и executemany количество строк заранее неизвестно
+    if cursor.rowcount >= 0:
+        DB_STATEMENT_ROWS.labels(operation, fingerprint).observe(cursor.rowcount)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Подключает сбор метрик SQL-запросов к движку."""
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
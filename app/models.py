@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, Index, Text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import declarative_base
 
 
@@ -10,6 +11,10 @@ class User(Base):
 
     id = Column(Integer, primary_key=True)
     tg_id = Column(BigInteger, unique=True, index=True, nullable=False)
+    # Увеличивается триггером в каждой транзакции, изменившей user_gif_tags пользователя (ETag ответов)
+    library_version = Column(BigInteger, nullable=False, server_default='0')
+    # ID транзакции, последней увеличившей library_version: не даёт увеличить версию дважды за транзакцию
+    library_version_xact = Column(BigInteger)
 
 
 class Gif(Base):
@@ -30,5 +35,30 @@ class UserGifTag(Base):
     __tablename__ = 'user_gif_tags'
 
     user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
-    gif_id = Column(Integer, ForeignKey('gifs.id', ondelete="CASCADE"), primary_key=True)
-    tag_id = Column(Integer, ForeignKey('tags.id', ondelete="CASCADE"), primary_key=True)
+    gif_id = Column(Integer, ForeignKey('gifs.id', ondelete="CASCADE"), primary_key=True, index=True)
+    tag_id = Column(Integer, ForeignKey('tags.id', ondelete="CASCADE"), primary_key=True, index=True)
+
+    __table_args__ = (
+        # Поиск гифок пользователя по тегам и список тегов пользователя (index-only scan)
+        Index('ix_user_gif_tags_user_id_tag_id_gif_id', 'user_id', 'tag_id', 'gif_id'),
+    )
+
+
+class UserGif(Base):
+    """
+    Проекция `user_gif_tags` для чтения: одна строка на гифку пользователя с массивом её тегов.
+
+    Таблица поддерживается триггерами на `user_gif_tags`, `gifs` и `tags` (см. миграцию c3a91f6d2b47),
+    приложение в неё не пишет. Поиск гифок со всеми заданными тегами — `tags @> ARRAY[...]` по GIN-индексу.
+    """
+    __tablename__ = 'user_gifs'
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    gif_id = Column(Integer, ForeignKey('gifs.id', ondelete="CASCADE"), primary_key=True, index=True)
+    tg_gif_id = Column(String(255), nullable=False)
+    # Теги отсортированы
+    tags = Column(ARRAY(Text), nullable=False)
+
+    __table_args__ = (
+        Index('ix_user_gifs_tags', 'tags', postgresql_using='gin'),
+    )
@@ -0,0 +1,185 @@
+"""
+Журнал медленных SQL-запросов.
+
+Каждый запрос дольше `SLOW_QUERY_THRESHOLD_MS` записывается в логгер `app.slow_query` одной строкой JSON:
+
+    {
+        "event": "slow_query",
+        "duration_ms": 1234.5,
+        "fingerprint": "1a7bca3c75bd",      # тот же, что в метриках /metrics
+        "operation": "SELECT",
+        "statement": "SELECT ... WHERE users.tg_id IN (?::BIGINT, ...)",
+        "parameters": ["int"],              # или сами значения при SLOW_QUERY_LOG_PARAMETERS
+        "rows": 10,
+        "caller": "get_user_gifs_with_tags",
+        "call_stack": ["get_user_gifs_with_tags", "UsersCRUD.resolve_ids"],
+        "plan": [...]                       # EXPLAIN (FORMAT JSON), если запрос попал в выборку
+    }
+
+Вызывающая функция берётся из стека, который ведёт декоратор `traced` на функциях сервисов
+и методах CRUD-классов. По `fingerprint` записи группируются по форме запроса.
+"""
+import functools
+import inspect
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app import config
+from app.metrics import statement_fingerprint
+
+
+logger = logging.getLogger('app.slow_query')
+
+# Функции сервисов и методы CRUD, выполняющиеся в текущей задаче, от внешней к внутренней
+_call_stack: ContextVar[tuple[str, ...]] = ContextVar('call_stack', default=())
+
+# Длинные значения параметров обрезаются, чтобы запись журнала оставалась небольшой
+MAX_PARAMETER_LENGTH = 200
+MAX_PARAMETERS = 50
+
+# Запросы, для которых EXPLAIN имеет смысл (DDL, ANALYZE и т.п. не разбираются)
+EXPLAINABLE_OPERATIONS = frozenset({'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'})
+
+
+# ===== Стек вызовов =====
+def _call_name(func, args) -> str:
+    # Для методов CRUD подставляем класс экземпляра (UsersCRUD), а не класс, где объявлен метод (_BaseCRUD)
+    if '.' in func.__qualname__ and args and not inspect.isclass(args[0]):
+        return f'{type(args[0]).__name__}.{func.__name__}'
+    return func.__qualname__
+
+
+def traced(func):
+    """
+    Декоратор для асинхронных функций и асинхронных генераторов: на время выполнения добавляет
+    имя функции в стек вызовов, который попадает в журнал медленных запросов.
+    """
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def generator_wrapper(*args, **kwargs):
+            name = _call_name(func, args)
+            generator = func(*args, **kwargs)
+            try:
+                while True:
+                    # Генератор может продолжаться в другой задаче, поэтому стек выставляется на каждый шаг
+                    token = _call_stack.set((*_call_stack.get(), name))
+                    try:
+                        item = await anext(generator)
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        _call_stack.reset(token)
+                    yield item
+            finally:
+                await generator.aclose()
+
+        return generator_wrapper
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _call_stack.set((*_call_stack.get(), _call_name(func, args)))
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _call_stack.reset(token)
+
+    return wrapper
+
+
+# ===== Журнал =====
+def _describe_parameters(parameters: Any) -> Any:
+    """Значения параметров (обрезанные) или только их типы, если значения не логируются."""
+    if isinstance(parameters, dict):
+        return {key: _describe_parameters(value) for key, value in list(parameters.items())[:MAX_PARAMETERS]}
+    if isinstance(parameters, (list, tuple)):
+        return [_describe_parameters(value) for value in parameters[:MAX_PARAMETERS]]
+    if not config.SLOW_QUERY_LOG_PARAMETERS:
+        return type(parameters).__name__
+    if isinstance(parameters, (int, float, bool)) or parameters is None:
+        return parameters
+    value = str(parameters)
+    return value if len(value) <= MAX_PARAMETER_LENGTH else value[:MAX_PARAMETER_LENGTH] + '...'
+
+
+def _explain(conn, statement: str, parameters) -> list | str:
+    """
+    Выполняет EXPLAIN медленного запроса на том же соединении и возвращает план в формате JSON.
+
+    ANALYZE выполняет запрос повторно, поэтому применяется только к SELECT: изменяющие запросы
+    разбираются без выполнения. EXPLAIN идёт через отдельный DBAPI-курсор (события SQLAlchemy
+    не срабатывают, рекурсии нет) и внутри SAVEPOINT, чтобы его ошибка не прервала транзакцию приложения.
+    """
+    analyze = statement.lstrip()[:6].upper() == 'SELECT'
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    dbapi_connection = conn.connection.dbapi_connection
+    in_transaction = not getattr(dbapi_connection, 'autocommit', False)
+
+    cursor = dbapi_connection.cursor()
+    try:
+        if in_transaction:
+            cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            cursor.execute(f'EXPLAIN ({options}) {statement}', parameters)
+            plan = cursor.fetchone()[0]
+        except Exception as e:
+            if in_transaction:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+            return f'EXPLAIN failed: {e}'
+        if in_transaction:
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+        return json.loads(plan) if isinstance(plan, str) else plan
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._slow_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - context._slow_query_start) * 1000
+    if duration_ms < config.SLOW_QUERY_THRESHOLD_MS:
+        return
+
+    fingerprint, operation, normalized = statement_fingerprint(statement)
+    call_stack = _call_stack.get()
+    record = {
+        'event': 'slow_query',
+        'duration_ms': round(duration_ms, 3),
+        'fingerprint': fingerprint,
+        'operation': operation,
+        'statement': normalized,
+        'parameters': _describe_parameters(parameters),
+        'executemany': executemany,
+        'rows': cursor.rowcount if cursor.rowcount >= 0 else None,
+        'caller': call_stack[-1] if call_stack else None,
+        'call_stack': list(call_stack),
+    }
+
+    # Серверный курсор (stream) ещё читает результат, а у executemany нет единственного набора параметров
+    streaming = context.execution_options.get('stream_results', False)
+    if (
+            not executemany
+            and not streaming
+            and operation in EXPLAINABLE_OPERATIONS
+            and config.SLOW_QUERY_EXPLAIN_SAMPLE_RATE > 0
+            and random.random() < config.SLOW_QUERY_EXPLAIN_SAMPLE_RATE
+    ):
+        record['plan'] = _explain(conn, statement, parameters)
+
+    logger.warning(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def install_slow_query_log(engine: AsyncEngine) -> None:
+    """Подключает журнал медленных запросов к движку, если задан порог `SLOW_QUERY_THRESHOLD_MS`."""
+    if config.SLOW_QUERY_THRESHOLD_MS <= 0:
+        return
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
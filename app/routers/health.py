@@ -0,0 +1,57 @@
+from fastapi import APIRouter, HTTPException, Request
+from app.schemas import PoolStatsOut, HealthOut
+from app.database import get_engine
+
+
+router = APIRouter(
+    prefix='/health'
+)
+
+
+@router.get('/live', response_model=HealthOut)
+async def live():
+    """
+    Проверка живости воркера: отвечает, пока процесс обрабатывает запросы, без обращения к БД.
+
+    **Returns:**
+    Объект `HealthOut` со **status** `alive`.
+    """
+    return HealthOut(status='alive')
+
+
+@router.get('/ready', response_model=HealthOut, responses={503: {'description': 'Warming up'}})
+async def ready(request: Request):
+    """
+    Проверка готовности воркера принимать трафик.
+
+    Воркер становится готовым после прогрева при старте: открыты соединения пула (`DB_POOL_WARMUP`)
+    и на каждом подготовлены часто используемые запросы. До этого и во время остановки
+    возвращается HTTP 503, чтобы балансировщик не отправлял запросы холодному воркеру.
+
+    **Returns:**
+    Объект `HealthOut` со **status** `ready`.
+    """
+    if not getattr(request.app.state, 'ready', False):
+        raise HTTPException(status_code=503, detail="Warming up")
+    return HealthOut(status='ready')
+
+
+@router.get('/pool', response_model=PoolStatsOut)
+async def pool_stats():
+    """
+    Состояние пула соединений с БД текущего воркера.
+
+    **Returns:**
+    Объект `PoolStatsOut`:
+    - **pool_size**, **max_overflow**: настроенные размер пула и допустимое превышение
+    - **checked_out**: соединения, выданные запросам
+    - **checked_in**: свободные соединения в пуле
+    - **overflow**: соединения сверх `pool_size` (отрицательное значение — пул ещё не заполнен)
+    - **waiting**: запросы, ожидающие соединение прямо сейчас
+    - **checkouts**, **timeouts**: количество выданных соединений и отказов по таймауту
+    - **wait_seconds_total**, **wait_seconds_max**: суммарное и максимальное время получения соединения
+
+    Если `waiting` и `wait_seconds_max` растут, а `checked_out` держится на уровне
+    `pool_size + max_overflow`, запросы упираются в пул.
+    """
+    return get_engine().pool.stats()
@@ -0,0 +1,101 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.metrics import REGISTRY, CONTENT_TYPE
+from app.database import get_engine, recent_writers
+from app.crud import UsersCRUD, GifsCRUD, TagsCRUD
+from app.services.user_services import user_tags_cache, tag_index_cache, gif_index_cache, gifs_flight, tags_flight, tag_writes
+
+
+router = APIRouter()
+
+
+CACHES = {
+    'user_tags': user_tags_cache,
+    'tag_index': tag_index_cache,
+    'gif_index': gif_index_cache,
+    'identity_users': UsersCRUD.identity_map,
+    'identity_gifs': GifsCRUD.identity_map,
+    'identity_tags': TagsCRUD.identity_map,
+    'read_your_writes': recent_writers,
+}
+
+
+def collect_caches():
+    """Счётчики и размеры кэшей в памяти процесса."""
+    stats = {name: cache.stats() for name, cache in CACHES.items()}
+    for key, type_name, documentation in (
+            ('hits', 'counter', 'Попадания в кэш'),
+            ('misses', 'counter', 'Промахи кэша'),
+            ('evictions', 'counter', 'Записи, вытесненные из-за ограничения размера'),
+            ('expirations', 'counter', 'Записи, удалённые по истечении TTL'),
+            ('invalidations', 'counter', 'Записи, сброшенные после изменения данных'),
+            ('entries', 'gauge', 'Количество записей в кэше'),
+            ('weight', 'gauge', 'Суммарный вес записей кэша (байты или количество записей)'),
+            ('max_weight', 'gauge', 'Ограничение суммарного веса записей кэша'),
+    ):
+        suffix = '_total' if type_name == 'counter' else ''
+        samples = [({'cache': name}, cache_stats[key]) for name, cache_stats in stats.items()]
+        yield f'cache_{key}{suffix}', type_name, documentation, samples
+
+
+FLIGHTS = {
+    'user_gifs': gifs_flight,
+    'user_tags': tags_flight,
+}
+
+
+def collect_single_flight():
+    """Счётчики объединения одинаковых одновременных чтений."""
+    stats = {name: flight.stats() for name, flight in FLIGHTS.items()}
+    for key, type_name, documentation in (
+            ('executions', 'counter', 'Выполненные вызовы (запросы к источнику данных)'),
+            ('coalesced', 'counter', 'Вызовы, получившие результат уже выполнявшегося вызова'),
+            ('in_flight', 'gauge', 'Выполняющиеся вызовы'),
+    ):
+        suffix = '_total' if type_name == 'counter' else ''
+        samples = [({'flight': name}, flight_stats[key]) for name, flight_stats in stats.items()]
+        yield f'single_flight_{key}{suffix}', type_name, documentation, samples
+
+
+def collect_group_commit():
+    """Счётчики group commit замен тегов."""
+    stats = tag_writes.stats()
+    for key, type_name, documentation in (
+            ('batches', 'counter', 'Применённые пакеты (транзакции)'),
+            ('items', 'counter', 'Записи, переданные в пакетах'),
+            ('failures', 'counter', 'Записи, завершившиеся ошибкой'),
+            ('pending', 'gauge', 'Записи, ожидающие применения'),
+    ):
+        suffix = '_total' if type_name == 'counter' else ''
+        yield f'group_commit_{key}{suffix}', type_name, documentation, [({}, stats[key])]
+
+
+def collect_pool():
+    """Состояние пула соединений с БД."""
+    stats = get_engine().pool.stats()
+    for key, type_name, documentation in (
+            ('pool_size', 'gauge', 'Размер пула соединений'),
+            ('max_overflow', 'gauge', 'Допустимое количество соединений сверх размера пула'),
+            ('checked_out', 'gauge', 'Соединения, выданные запросам'),
+            ('checked_in', 'gauge', 'Свободные соединения в пуле'),
+            ('overflow', 'gauge', 'Соединения сверх размера пула'),
+            ('waiting', 'gauge', 'Запросы, ожидающие соединение'),
+            ('checkouts', 'counter', 'Выданные соединения'),
+            ('timeouts', 'counter', 'Отказы в соединении по таймауту'),
+            ('wait_seconds_total', 'counter', 'Суммарное время получения соединения'),
+            ('wait_seconds_max', 'gauge', 'Максимальное время получения соединения'),
+    ):
+        suffix = '_total' if type_name == 'counter' and not key.endswith('_total') else ''
+        yield f'db_pool_{key}{suffix}', type_name, documentation, [({}, stats[key])]
+
+
+REGISTRY.add_collector(collect_caches)
+REGISTRY.add_collector(collect_single_flight)
+REGISTRY.add_collector(collect_group_commit)
+REGISTRY.add_collector(collect_pool)
+
+
+@router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Метрики процесса в текстовом формате Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
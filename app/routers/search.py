@@ -1,18 +1,82 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from app.schemas import SearchOut
-from app.database import get_db
-from app.services import get_user_gifs_with_tags
-from typing import Optional, List
+from app.database import get_read_db, read_session
+from app.services import get_user_gifs_with_tags, stream_user_gifs_with_tags, get_library_version
+from app.utils import encode_cursor, decode_cursor, library_etag, not_modified, etag_headers, FastJSONResponse, json_dumps
+from starlette.types import Scope, Receive, Send
+from typing import Optional, List, AsyncIterator, AsyncGenerator
 
 
 router = APIRouter()
 
 
-@router.get('/search', response_model=SearchOut)
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+# Строки копятся до этого размера перед отправкой клиенту, чтобы не делать отдельную запись на каждую гифку
+NDJSON_CHUNK_SIZE = 64 * 1024
+
+
+class _NDJSONResponse(StreamingResponse):
+    """
+    Потоковый ответ NDJSON, который после отправки закрывает генератор строк `lines` (и его сессию).
+
+    Генератор закрывается и тогда, когда клиент отключился до начала или во время отправки тела:
+    иначе незавершённый генератор держал бы соединение с БД до сборки мусора.
+    """
+    def __init__(self, content: AsyncIterator[bytes], lines: AsyncGenerator[bytes, None], **kwargs):
+        super().__init__(content, media_type=NDJSON_MEDIA_TYPE, **kwargs)
+        self.lines = lines
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.lines.aclose()
+
+
+async def _ndjson_gifs(**filters) -> AsyncGenerator[bytes, None]:
+    """
+    Отдаёт гифки пользователя в формате NDJSON (один объект `GifOut` на строку).
+
+    Использует собственную сессию (на реплике, как и `get_read_db`): сессия зависимости закрывается
+    до того, как начнётся отправка тела потокового ответа.
+    Первая гифка отправляется сразу, остальные — блоками по `NDJSON_CHUNK_SIZE` байт.
+    """
+    async with read_session(filters.get('tg_user_id')) as db:
+        chunk = []
+        chunk_size = 0
+        first = True
+        async for gif in stream_user_gifs_with_tags(db, **filters):
+            line = json_dumps(gif) + b'\n'
+            if first:
+                first = False
+                yield line
+                continue
+
+            chunk.append(line)
+            chunk_size += len(line)
+            if chunk_size >= NDJSON_CHUNK_SIZE:
+                yield b''.join(chunk)
+                chunk = []
+                chunk_size = 0
+
+        if chunk:
+            yield b''.join(chunk)
+
+
+@router.get(
+    '/search',
+    response_model=SearchOut,
+    responses={200: {'content': {NDJSON_MEDIA_TYPE: {}}}, 304: {'description': 'Not Modified'}},
+)
 async def search_gifs(
+        request: Request,
         tg_user_id: int = Query(),
         tags: Optional[List[str]] = Query(None),
-        db=Depends(get_db)
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        cursor: Optional[str] = Query(None),
+        stream: bool = Query(False),
+        db=Depends(get_read_db)
 ):
     """
     Поиск GIF по тегам для конкретного пользователя.
@@ -20,6 +84,11 @@ async def search_gifs(
     - **tg_user_id**: Telegram ID пользователя
     - **tags**: список тегов для фильтрации (опционально).
       Если не передан, вернутся все GIF пользователя.
+    - **limit**: максимальное количество GIF в ответе (опционально).
+      Если не передан, вернутся все подходящие GIF.
+    - **cursor**: значение `next_cursor` из предыдущего ответа для получения следующей страницы (опционально).
+    - **stream**: потоковая выдача в формате NDJSON (опционально).
+      Того же можно добиться заголовком `Accept: application/x-ndjson`.
 
     **Returns:**
     Объект `SearchOut` с полями:
@@ -29,9 +98,68 @@ async def search_gifs(
         - **id**: int — внутренний ID GIF
         - **tg_gif_id**: str — идентификатор GIF в Telegram
         - **tags**: list[str] — список тегов, связанных с GIF
+    - **next_cursor**: str | None — курсор следующей страницы или `null`, если страница последняя
+
+    В потоковом режиме тело ответа — по одному объекту `GifOut` на строку,
+    `next_cursor` не передаётся (курсор следующей страницы — ID последней гифки).
+
+    Ответ содержит `ETag` по версии библиотеки пользователя. Если клиент передал его в `If-None-Match`
+    и библиотека с тех пор не менялась, возвращается `304 Not Modified` без выполнения поиска.
     """
-    data = await get_user_gifs_with_tags(db, tg_user_id=tg_user_id, tags=tags)
+    try:
+        after_gif_id = decode_cursor(cursor) if cursor is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    version = await get_library_version(db, tg_user_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    user_id, library_version = version
+
+    ndjson = stream or NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+    # Представление зависит от Accept (JSON или NDJSON), поэтому у вариантов разные ETag
+    etag = library_etag(user_id, library_version, 'ndjson' if ndjson else '')
+    not_modified_response = not_modified(request.headers.get('if-none-match'), etag, vary='Accept')
+    if not_modified_response is not None:
+        return not_modified_response
+
+    if ndjson:
+        lines = _ndjson_gifs(tg_user_id=tg_user_id, tags=tags, after_gif_id=after_gif_id, limit=limit)
+        first_line = await anext(lines, None)
+        if first_line is None and not await get_user_gifs_with_tags(db, tg_user_id=tg_user_id, limit=1):
+            await lines.aclose()
+            raise HTTPException(status_code=404, detail="User not found")
+
+        async def body():
+            try:
+                if first_line is not None:
+                    yield first_line
+                    async for chunk in lines:
+                        yield chunk
+            finally:
+                await lines.aclose()
+
+        return _NDJSONResponse(body(), lines, headers=etag_headers(etag, vary='Accept'))
+
+    data = await get_user_gifs_with_tags(
+        db,
+        tg_user_id=tg_user_id,
+        tags=tags,
+        after_gif_id=after_gif_id,
+        limit=limit,
+        library_version=library_version,
+    )
     if not data:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    return data
+
+    # Ответ уже имеет форму SearchOut, поэтому сериализуется напрямую, без повторной проверки каждой гифки
+    next_gif_id = data['next_gif_id']
+    return FastJSONResponse(
+        {
+            'tg_user_id': data['tg_user_id'],
+            'id': data['id'],
+            'gifs_data': data['gifs_data'],
+            'next_cursor': encode_cursor(next_gif_id) if next_gif_id is not None else None,
+        },
+        headers=etag_headers(etag, vary='Accept'),
+    )
@@ -1,7 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from app.schemas import GifOut, GifUpdate, Successful
-from app.database import get_db
-from app.services import get_user_gifs_with_tags, set_new_user_tags_on_gif, get_all_user_tags, delete_user_gif_tags
+from typing import Annotated, AsyncIterator
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, Response
+from app.schemas import (
+    GifOut,
+    GifUpdate,
+    Successful,
+    ImportOut,
+    GifBatchIn,
+    GifBatchOut,
+    GIF_ID_MAX_LENGTH,
+    TAG_MAX_LENGTH,
+)
+from app import config
+from app.database import get_db, get_read_db
+from app.services import (
+    get_user_gifs_with_tags,
+    get_user_gifs_batch,
+    set_new_user_tags_on_gif,
+    get_all_user_tags,
+    suggest_user_tags,
+    delete_user_gif_tags,
+    import_user_library,
+    parse_ndjson_library,
+    parse_csv_library,
+    get_library_version,
+)
+from app.utils import library_etag, not_modified, etag_headers, FastJSONResponse
 
 
 router = APIRouter(
@@ -9,11 +32,35 @@ router = APIRouter(
 )
 
 
-@router.get('/{tg_user_id}/gif/{tg_gif_id}', response_model=GifOut)
+NOT_MODIFIED = {304: {'description': 'Not Modified'}}
+
+
+async def _library_etag(
+        db,
+        request: Request,
+        tg_user_id: int,
+        not_found_detail: str = "User not found",
+) -> tuple[int, str, Response | None]:
+    """
+    Версия библиотеки пользователя, ETag по ней и готовый ответ 304, если ETag клиента актуален.
+
+    Если пользователь не найден, выбрасывает HTTP 404 с сообщением `not_found_detail`
+    (у каждого эндпоинта своё, как при отсутствии данных).
+    """
+    version = await get_library_version(db, tg_user_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+    user_id, library_version = version
+    etag = library_etag(user_id, library_version)
+    return library_version, etag, not_modified(request.headers.get('if-none-match'), etag)
+
+
+@router.get('/{tg_user_id}/gif/{tg_gif_id}', response_model=GifOut, responses=NOT_MODIFIED)
 async def get_gif(
         tg_user_id: int,
-        tg_gif_id: str,
-        db=Depends(get_db)
+        tg_gif_id: Annotated[str, Path(max_length=GIF_ID_MAX_LENGTH)],
+        request: Request,
+        db=Depends(get_read_db)
 ):
     """
     Получить GIF пользователя по его Telegram ID и идентификатору GIF.
@@ -26,20 +73,60 @@ async def get_gif(
     - **id**: int — внутренний ID GIF в базе
     - **tg_gif_id**: str — идентификатор GIF в Telegram
     - **tags**: list[str] — список тегов GIF
+
+    Поддерживает `ETag` / `If-None-Match` по версии библиотеки пользователя (ответ `304 Not Modified`).
     """
+    library_version, etag, not_modified_response = await _library_etag(db, request, tg_user_id, "Data not found")
+    if not_modified_response is not None:
+        return not_modified_response
+
     # Если что-то не найдено при попытке обращения выбросит ошибку
     try:
-        data = (await get_user_gifs_with_tags(db, tg_user_id=tg_user_id, tg_gifs_id=tg_gif_id))['gifs_data'][0]
+        data = (await get_user_gifs_with_tags(
+            db,
+            tg_user_id=tg_user_id,
+            tg_gifs_id=tg_gif_id,
+            library_version=library_version,
+        ))['gifs_data'][0]
     except:
         raise HTTPException(status_code=404, detail="Data not found")
 
-    return data
+    return FastJSONResponse(data, headers=etag_headers(etag))
+
+
+@router.post('/gifs/batch', response_model=GifBatchOut)
+async def get_gifs_batch(
+        batch: GifBatchIn,
+        db=Depends(get_db)
+):
+    """
+    Получить несколько GIF (в том числе разных пользователей) одним запросом.
+
+    - **items**: список пар `{"tg_user_id": int, "tg_gif_id": str}`, не больше `GIF_BATCH_MAX_ITEMS`
+
+    Все пары обрабатываются одним SQL-запросом, поэтому вызов заменяет серию
+    `GET /user/{tg_user_id}/gif/{tg_gif_id}`.
+
+    **Returns:**
+    Объект `GifBatchOut`:
+    - **results**: список в порядке `items`, для каждой пары — **tg_user_id**, **tg_gif_id**
+      и **gif** (объект `GifOut` или `null`, если у пользователя нет такого GIF)
+    """
+    # Пары относятся к разным пользователям, поэтому чтение идёт в основную БД:
+    # правило read-your-writes для реплик проверяется по одному пользователю запроса
+    pairs = [(item.tg_user_id, item.tg_gif_id) for item in batch.items]
+    gifs = await get_user_gifs_batch(db, pairs)
+
+    return FastJSONResponse({'results': [
+        {'tg_user_id': tg_user_id, 'tg_gif_id': tg_gif_id, 'gif': gif}
+        for (tg_user_id, tg_gif_id), gif in zip(pairs, gifs)
+    ]})
 
 
 @router.put('/{tg_user_id}/gif/{tg_gif_id}', response_model=Successful)
 async def update_gif_tags(
         tg_user_id: int,
-        tg_gif_id: str,
+        tg_gif_id: Annotated[str, Path(max_length=GIF_ID_MAX_LENGTH)],
         gif_data: GifUpdate,
         db=Depends(get_db)
 ):
@@ -62,7 +149,7 @@ async def update_gif_tags(
 @router.delete('/{tg_user_id}/gif/{gif_id}', response_model=Successful)
 async def delete_gif_tags(
         tg_user_id: int,
-        gif_id: str,
+        gif_id: Annotated[str, Path(max_length=GIF_ID_MAX_LENGTH)],
         gif_id_type: str | None = Query(None),
         db=Depends(get_db)
 ):
@@ -93,10 +180,11 @@ async def delete_gif_tags(
     return Successful()
 
 
-@router.get('/{tg_user_id}/tags', response_model=list[str])
+@router.get('/{tg_user_id}/tags', response_model=list[str], responses=NOT_MODIFIED)
 async def get_user_tags(
         tg_user_id: int,
-        db=Depends(get_db)
+        request: Request,
+        db=Depends(get_read_db)
 ):
     """
     Получение всех тегов пользователя по его Telegram ID.
@@ -106,9 +194,113 @@ async def get_user_tags(
 
     **Возвращает**:
     Список тегов (list[str]) или HTTP 404, если пользователь не найден.
+    Поддерживает `ETag` / `If-None-Match` по версии библиотеки пользователя (ответ `304 Not Modified`).
     """
-    data = await get_all_user_tags(db, tg_user_id=tg_user_id)
+    library_version, etag, not_modified_response = await _library_etag(db, request, tg_user_id)
+    if not_modified_response is not None:
+        return not_modified_response
+
+    data = await get_all_user_tags(db, tg_user_id=tg_user_id, library_version=library_version)
     if not data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return data
+    return FastJSONResponse(data, headers=etag_headers(etag))
+
+
+@router.get('/{tg_user_id}/tags/suggest', response_model=list[str], responses=NOT_MODIFIED)
+async def suggest_tags(
+        tg_user_id: int,
+        request: Request,
+        q: str = Query(min_length=1, max_length=TAG_MAX_LENGTH),
+        limit: int = Query(10, ge=1, le=100),
+        db=Depends(get_read_db)
+):
+    """
+    Подсказки тегов пользователя по введённой строке.
+
+    - **tg_user_id**: Telegram ID пользователя
+    - **q**: введённая строка
+    - **limit**: максимальное количество подсказок (по умолчанию 10)
+
+    Сначала возвращаются теги, начинающиеся с `q` (без учёта регистра), затем теги,
+    похожие на `q` по триграммам (метрика `similarity()` из `pg_trgm`).
+
+    **Возвращает**:
+    Список тегов (list[str]), возможно пустой, или HTTP 404, если у пользователя нет тегов.
+    Поддерживает `ETag` / `If-None-Match` по версии библиотеки пользователя (ответ `304 Not Modified`).
+    """
+    library_version, etag, not_modified_response = await _library_etag(db, request, tg_user_id)
+    if not_modified_response is not None:
+        return not_modified_response
+
+    data = await suggest_user_tags(db, tg_user_id=tg_user_id, query=q, limit=limit, library_version=library_version)
+    if data is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return FastJSONResponse(data, headers=etag_headers(etag))
+
+
+async def _limited_body(request: Request, max_bytes: int) -> AsyncIterator[bytes]:
+    """Тело запроса по частям по мере получения; HTTP 413, если оно больше `max_bytes`."""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise HTTPException(status_code=413, detail="Request body is too large")
+        yield chunk
+
+
+@router.post(
+    '/{tg_user_id}/import',
+    response_model=ImportOut,
+    openapi_extra={
+        'requestBody': {
+            'required': True,
+            'content': {
+                'application/x-ndjson': {'schema': {'type': 'string'}},
+                'text/csv': {'schema': {'type': 'string'}},
+            },
+        },
+    },
+)
+async def import_library(
+        tg_user_id: int,
+        request: Request,
+        db=Depends(get_db)
+):
+    """
+    Массовый импорт библиотеки GIF пользователя одной транзакцией.
+
+    Тело запроса в одном из форматов (определяется по `Content-Type`):
+    - **application/x-ndjson** (по умолчанию): по одному объекту на строку,
+      `{"tg_gif_id": "...", "tags": ["...", ...]}`
+    - **text/csv**: `tg_gif_id,tag1,tag2,...` — гифка и её теги в одной строке,
+      первая строка может быть заголовком
+
+    Для каждой гифки из импорта теги заменяются так же, как при `PUT /user/{tg_user_id}/gif/{tg_gif_id}`,
+    остальные GIF пользователя не затрагиваются.
+
+    Тело разбирается и загружается в БД по мере получения. Тело больше `IMPORT_MAX_BODY_BYTES`
+    отклоняется с ответом 413, импорт при этом не применяется.
+
+    **Returns:**
+    Объект `ImportOut`:
+    - **gifs**: int — количество GIF в импорте
+    - **links**: int — количество загруженных строк (GIF, тег)
+    - **seconds**: float — длительность импорта
+    - **rows_per_second**: float — скорость загрузки строк
+    """
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > config.IMPORT_MAX_BODY_BYTES:
+        raise HTTPException(status_code=413, detail="Request body is too large")
+
+    body = _limited_body(request, config.IMPORT_MAX_BODY_BYTES)
+    if request.headers.get('content-type', '').startswith('text/csv'):
+        library = parse_csv_library(body)
+    else:
+        library = parse_ndjson_library(body)
+
+    try:
+        return await import_user_library(db, tg_user_id=tg_user_id, library=library)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
@@ -1,4 +1,16 @@
-from pydantic import BaseModel
+from typing import Annotated
+from pydantic import BaseModel, Field
+from app import config
+from app.models import Gif, Tag
+
+
+# Ограничения длины совпадают с колонками gifs.tg_gif_id и tags.tag: более длинные значения
+# не поместятся в БД, поэтому отклоняются при разборе запроса (422), а не на вставке
+GIF_ID_MAX_LENGTH = Gif.__table__.c.tg_gif_id.type.length
+TAG_MAX_LENGTH = Tag.__table__.c.tag.type.length
+
+TgGifId = Annotated[str, Field(max_length=GIF_ID_MAX_LENGTH)]
+TagName = Annotated[str, Field(max_length=TAG_MAX_LENGTH)]
 
 
 # ===== Пользователь =====
@@ -18,13 +30,13 @@ class UserOut(UserBase):
 
 # ===== Гифка =====
 class GifBase(BaseModel):
-    tg_gif_id: str
+    tg_gif_id: TgGifId
 
 class GifCreate(GifBase):
     pass
 
 class GifUpdate(BaseModel):
-    tags: list[str]
+    tags: list[TagName]
 
 class GifOut(GifBase):
     id: int
@@ -35,14 +47,30 @@ class GifOut(GifBase):
     }
 
 
+# ===== Пакетное чтение гифок =====
+class GifKey(BaseModel):
+    tg_user_id: int
+    tg_gif_id: TgGifId
+
+class GifBatchIn(BaseModel):
+    items: list[GifKey] = Field(min_length=1, max_length=config.GIF_BATCH_MAX_ITEMS)
+
+class GifBatchItemOut(GifKey):
+    gif: GifOut | None
+
+class GifBatchOut(BaseModel):
+    results: list[GifBatchItemOut]
+
+
 # ===== Поиск по тегам =====
 class SearchOut(UserOut):
     gifs_data: list[GifOut]
+    next_cursor: str | None = None
 
 
 # ===== Тег =====
 class TagBase(BaseModel):
-    tag: str
+    tag: TagName
 
 class TagCreate(TagBase):
     pass
@@ -62,5 +90,30 @@ class UserGifTagBase(BaseModel):
     tag_id: int
 
 
+# ===== Импорт библиотеки =====
+class ImportOut(BaseModel):
+    gifs: int
+    links: int
+    seconds: float
+    rows_per_second: float
+
+
 class Successful(BaseModel):
     successful: bool = True
+
+
+# ===== Состояние сервиса =====
+class HealthOut(BaseModel):
+    status: str
+
+class PoolStatsOut(BaseModel):
+    pool_size: int
+    max_overflow: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    waiting: int
+    checkouts: int
+    timeouts: int
+    wait_seconds_total: float
+    wait_seconds_max: float
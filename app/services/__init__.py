@@ -1 +1,12 @@
-from .user_services import get_user_gifs_with_tags, set_new_user_tags_on_gif, get_all_user_tags, delete_user_gif_tags
\ No newline at end of file
+from .user_services import (
+    get_user_gifs_with_tags,
+    stream_user_gifs_with_tags,
+    get_user_gifs_batch,
+    get_library_version,
+    set_new_user_tags_on_gif,
+    get_all_user_tags,
+    suggest_user_tags,
+    delete_user_gif_tags,
+    prepare_statements,
+)
+from .import_services import import_user_library, parse_ndjson_library, parse_csv_library
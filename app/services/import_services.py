@@ -0,0 +1,292 @@
+import codecs
+import csv
+import io
+import json
+import time
+from typing import AsyncIterable, AsyncIterator, Iterable, Sequence
+from sqlalchemy import Table, MetaData, Column, String, Integer, select, delete, exists, literal, func, distinct
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import UserGifTag, Gif, Tag
+from app.schemas import GIF_ID_MAX_LENGTH, TAG_MAX_LENGTH
+from app.crud import UsersCRUD
+from app.services.user_services import invalidate_user_library
+from app.database import stick_to_primary
+from app.query_log import traced
+
+
+_import_metadata = MetaData()
+
+# Временная таблица для загрузки библиотеки через COPY. Удаляется при завершении транзакции.
+import_links = Table(
+    'import_links',
+    _import_metadata,
+    Column('tg_gif_id', String(GIF_ID_MAX_LENGTH), nullable=False),
+    Column('tag', String(TAG_MAX_LENGTH)),
+    prefixes=['TEMPORARY'],
+    postgresql_on_commit='DROP',
+)
+# Те же строки, но с уже известными ID гифок и тегов
+import_link_ids = Table(
+    'import_link_ids',
+    _import_metadata,
+    Column('gif_id', Integer, nullable=False),
+    Column('tag_id', Integer),
+    prefixes=['TEMPORARY'],
+    postgresql_on_commit='DROP',
+)
+
+
+async def _library_links(
+        library: Iterable[tuple[str, Sequence[str]]] | AsyncIterable[tuple[str, Sequence[str]]],
+) -> AsyncIterator[tuple[str, str | None]]:
+    """
+    Разворачивает записи (tg_gif_id, tags) в строки (tg_gif_id, tag) для временной таблицы.
+
+    Гифка без тегов даёт одну строку с `tag = None`, чтобы её старые теги тоже были удалены.
+
+    :raises ValueError: если идентификатор гифки или тег пустой либо слишком длинный.
+    """
+    if not isinstance(library, AsyncIterable):
+        library = _async_iter(library)
+
+    number = 0
+    async for tg_gif_id, tags in library:
+        number += 1
+        if not tg_gif_id or len(tg_gif_id) > GIF_ID_MAX_LENGTH:
+            raise ValueError(f"Запись {number}: некорректный tg_gif_id {tg_gif_id!r}.")
+        if not tags:
+            yield tg_gif_id, None
+            continue
+        for tag in tags:
+            if not tag or len(tag) > TAG_MAX_LENGTH:
+                raise ValueError(f"Запись {number}: некорректный тег {tag!r}.")
+            yield tg_gif_id, tag
+
+
+async def _async_iter(items: Iterable):
+    """Асинхронный итератор по обычному итерируемому объекту."""
+    for item in items:
+        yield item
+
+
+async def _decode_utf8(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """
+    Декодирует тело запроса из UTF-8 по частям (символ может быть разрезан между частями).
+
+    :raises ValueError: если тело не в кодировке UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        async for chunk in chunks:
+            if text := decoder.decode(chunk):
+                yield text
+        if text := decoder.decode(b'', final=True):
+            yield text
+    except UnicodeDecodeError:
+        raise ValueError("Тело запроса должно быть в кодировке UTF-8.")
+
+
+async def _record_blocks(chunks: AsyncIterable[bytes], quoted: bool) -> AsyncIterator[str]:
+    """
+    Текст тела запроса блоками из целых записей: каждый блок, кроме последнего, заканчивается
+    переводом строки `\n`. В памяти одновременно находится одна часть тела и незаконченная запись.
+
+    Записи разделяются только `\n` (с `\r` перед ним или без): в отличие от `str.splitlines()`,
+    символы вроде `\x0b`, `\x1c` и `\u2028` внутри значений запись не разрывают.
+
+    :param quoted: CSV — перевод строки внутри поля в кавычках не заканчивает запись
+                   (граница — перевод строки при чётном количестве кавычек перед ним).
+    """
+    buffer = []
+    in_quotes = False
+    async for text in _decode_utf8(chunks):
+        if quoted:
+            end = 0
+            position = 0
+            while (newline := text.find('\n', position)) != -1:
+                in_quotes ^= text.count('"', position, newline) % 2 == 1
+                position = newline + 1
+                if not in_quotes:
+                    end = position
+            in_quotes ^= text.count('"', position) % 2 == 1
+        else:
+            end = text.rfind('\n') + 1
+
+        if end:
+            buffer.append(text[:end])
+            yield ''.join(buffer)
+            buffer = [text[end:]]
+        else:
+            buffer.append(text)
+
+    if tail := ''.join(buffer):
+        yield tail
+
+
+async def parse_ndjson_library(chunks: AsyncIterable[bytes]) -> AsyncIterator[tuple[str, list[str]]]:
+    """
+    Разбирает библиотеку в формате JSON Lines: по одному объекту
+    `{"tg_gif_id": "...", "tags": ["...", ...]}` на строку. Пустые строки пропускаются.
+
+    :param chunks: тело запроса в UTF-8 по частям (например `request.stream()`); разбирается по мере поступления.
+    :raises ValueError: если тело не в UTF-8 или строка не является объектом нужного вида.
+    """
+    number = 0
+    async for block in _record_blocks(chunks, quoted=False):
+        lines = block.split('\n')
+        if block.endswith('\n'):
+            lines.pop()
+        for line in lines:
+            number += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                tg_gif_id, tags = record['tg_gif_id'], record.get('tags', [])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise ValueError(f"Строка {number}: ожидается объект с полями tg_gif_id и tags.")
+            if not isinstance(tg_gif_id, str) or not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+                raise ValueError(f"Строка {number}: tg_gif_id должен быть строкой, tags — списком строк.")
+            yield tg_gif_id, tags
+
+
+async def parse_csv_library(chunks: AsyncIterable[bytes]) -> AsyncIterator[tuple[str, list[str]]]:
+    """
+    Разбирает библиотеку в формате CSV: `tg_gif_id,tag1,tag2,...` — гифка и её теги в одной строке.
+
+    Первая строка считается заголовком, если её первая ячейка — `tg_gif_id`. Пустые строки пропускаются.
+    Поля в кавычках могут содержать запятые и переводы строк.
+
+    :param chunks: тело запроса в UTF-8 по частям (например `request.stream()`); разбирается по мере поступления.
+    :raises ValueError: если тело не в UTF-8.
+    """
+    number = 0
+    async for block in _record_blocks(chunks, quoted=True):
+        for row in csv.reader(io.StringIO(block, newline='')):
+            number += 1
+            if not row or number == 1 and row[0] == 'tg_gif_id':
+                continue
+            yield row[0], [tag for tag in row[1:] if tag]
+
+
+@traced
+async def import_user_library(
+        async_session: AsyncSession,
+        tg_user_id: int,
+        library: Iterable[tuple[str, Sequence[str]]] | AsyncIterable[tuple[str, Sequence[str]]],
+):
+    """
+    Импортирует библиотеку гифок пользователя одной транзакцией.
+
+    Для каждой гифки из `library` результат такой же, как у `set_new_user_tags_on_gif`:
+    у гифки остаются ровно переданные теги, недостающие пользователи, гифки и теги создаются.
+    Гифки, которых нет в `library`, не затрагиваются. Повторяющиеся гифки объединяются.
+
+    Записи загружаются во временную таблицу через COPY (`copy_records_to_table` asyncpg),
+    после чего `users`/`gifs`/`tags`/`user_gif_tags` обновляются несколькими
+    множественными запросами, число которых не зависит от размера библиотеки.
+
+    :param async_session: Объект асинхронной сессии SQLAlchemy.
+    :param tg_user_id: Telegram ID пользователя.
+    :param library: записи (tg_gif_id, tags) — список или асинхронный итератор, например
+                    `parse_ndjson_library` / `parse_csv_library`: записи загружаются по мере разбора.
+    :return: словарь {'gifs', 'links', 'seconds', 'rows_per_second'}, где `gifs` — количество
+             гифок в импорте, `links` — количество загруженных строк (гифка, тег).
+    :raises ValueError: если данные библиотеки некорректны (транзакция откатывается).
+    """
+    start = time.perf_counter()
+    links_count = 0
+
+    async def count_links(links):
+        nonlocal links_count
+        async for link in links:
+            links_count += 1
+            yield link
+
+    try:
+        connection = await async_session.connection()
+        await connection.run_sync(import_links.create)
+        raw_connection = (await connection.get_raw_connection()).driver_connection
+        await raw_connection.copy_records_to_table(
+            import_links.name,
+            records=count_links(_library_links(library)),
+            columns=[column.name for column in import_links.columns],
+        )
+        # Для временных таблиц статистика автоматически не собирается
+        await connection.exec_driver_sql(f'ANALYZE {import_links.name}')
+
+        user = await UsersCRUD(async_session).create_user(tg_user_id)
+
+        await async_session.execute(
+            insert(Gif)
+            .from_select([Gif.tg_gif_id], select(import_links.c.tg_gif_id).distinct())
+            .on_conflict_do_nothing(index_elements=[Gif.tg_gif_id])
+        )
+        await async_session.execute(
+            insert(Tag)
+            .from_select([Tag.tag], select(import_links.c.tag).where(import_links.c.tag.is_not(None)).distinct())
+            .on_conflict_do_nothing(index_elements=[Tag.tag])
+        )
+
+        await connection.run_sync(import_link_ids.create)
+        await async_session.execute(
+            insert(import_link_ids)
+            .from_select(
+                [import_link_ids.c.gif_id, import_link_ids.c.tag_id],
+                select(Gif.id, Tag.id)
+                .select_from(import_links)
+                .join(Gif, Gif.tg_gif_id == import_links.c.tg_gif_id)
+                .join(Tag, Tag.tag == import_links.c.tag, isouter=True)
+                .distinct(),
+            )
+        )
+        await connection.exec_driver_sql(f'ANALYZE {import_link_ids.name}')
+
+        # Удаляем у импортируемых гифок связи с тегами, которых нет в импорте
+        kept = (
+            select(literal(1))
+            .select_from(import_link_ids)
+            .where(import_link_ids.c.gif_id == UserGifTag.gif_id, import_link_ids.c.tag_id == UserGifTag.tag_id)
+        )
+        await async_session.execute(
+            delete(UserGifTag)
+            .where(
+                UserGifTag.user_id == user.id,
+                UserGifTag.gif_id.in_(select(import_link_ids.c.gif_id)),
+                ~exists(kept),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+        await async_session.execute(
+            insert(UserGifTag)
+            .from_select(
+                [UserGifTag.user_id, UserGifTag.gif_id, UserGifTag.tag_id],
+                select(literal(user.id), import_link_ids.c.gif_id, import_link_ids.c.tag_id)
+                .where(import_link_ids.c.tag_id.is_not(None))
+                # Вставка в порядке первичного ключа заметно быстрее на больших объёмах
+                .order_by(import_link_ids.c.gif_id, import_link_ids.c.tag_id),
+            )
+            .on_conflict_do_nothing()
+        )
+
+        gifs_count = (await async_session.execute(
+            select(func.count(distinct(import_link_ids.c.gif_id)))
+        )).scalar_one()
+
+        await async_session.commit()
+    except Exception:
+        await async_session.rollback()
+        raise
+
+    invalidate_user_library(tg_user_id)
+    stick_to_primary(tg_user_id)
+
+    seconds = time.perf_counter() - start
+    return {
+        'gifs': gifs_count,
+        'links': links_count,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(links_count / seconds) if seconds else links_count,
+    }
@@ -1,17 +1,476 @@
-import asyncio
-from sqlalchemy import select
+from sqlalchemy import select, func, Select, bindparam, BigInteger, String
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models import UserGifTag, User, Gif, Tag
+from app.models import UserGifTag, UserGif, User, Gif, Tag
 from app.crud import UsersCRUD, UserGifTagCRUD, TagsCRUD, GifsCRUD
-from typing import Sequence
+from app.utils import LRUCache, TagIndex, GifIndex, SingleFlight, GroupCommit
+from app.database import AsyncSessionLocal, stick_to_primary
+from app import config
+from typing import Sequence, AsyncIterator, Iterable
+import sys
+import asyncio
+import logging
+from app.query_log import traced
+from app.metrics import GROUP_COMMIT_FALLBACKS
+
+
+STREAM_BATCH_SIZE = 1000
+FOREIGN_KEY_VIOLATION = '23503'
+
+logger = logging.getLogger(__name__)
+
+
+def _tags_weight(tg_user_id: int, entry: tuple[int | None, frozenset[str]]) -> int:
+    """Примерный объём памяти, занимаемый записью кэша тегов, в байтах."""
+    _, tags = entry
+    return sys.getsizeof(tg_user_id) + sys.getsizeof(tags) + sum(sys.getsizeof(tag) for tag in tags)
+
+
+def _version_matches(cached_version: int | None, library_version: int | None) -> bool:
+    """
+    Можно ли отдать запись кэша, построенную по версии библиотеки `cached_version`.
+
+    Если вызывающий код не передал текущую версию (`library_version` is None), запись считается
+    актуальной до истечения TTL; иначе версии должны совпадать.
+    """
+    return library_version is None or cached_version == library_version
+
+
+# Кэш результатов `get_all_user_tags` по Telegram ID пользователя: (версия библиотеки, теги).
+# Сбрасывается после каждой фиксации изменений тегов пользователя.
+user_tags_cache = LRUCache(
+    max_weight=config.TAGS_CACHE_MAX_BYTES,
+    ttl=config.TAGS_CACHE_TTL,
+    weigher=_tags_weight,
+)
+
+# Индексы подсказок тегов (`suggest_user_tags`) по Telegram ID пользователя: (версия библиотеки, индекс).
+# Строятся из тех же тегов, что и `user_tags_cache`, и сбрасываются вместе с ним.
+tag_index_cache = LRUCache(
+    max_weight=config.TAG_SUGGEST_CACHE_MAX_BYTES,
+    ttl=config.TAGS_CACHE_TTL,
+    weigher=lambda tg_user_id, entry: entry[1].size_bytes(),
+)
+
+
+# Объединение одинаковых одновременных чтений (SINGLE_FLIGHT_ENABLED) по Telegram ID пользователя:
+# `get_user_gifs_with_tags` и промахи кэша `get_all_user_tags`
+gifs_flight = SingleFlight()
+tags_flight = SingleFlight()
+
+
+def invalidate_user_tags(tg_user_id: int) -> None:
+    """
+    Сбрасывает закэшированные теги пользователя и построенный по ним индекс подсказок.
+    Выполняющиеся объединённые чтения пользователя отвязываются: они начаты до изменения.
+    """
+    user_tags_cache.invalidate(tg_user_id)
+    tag_index_cache.invalidate(tg_user_id)
+    gifs_flight.forget(tg_user_id)
+    tags_flight.forget(tg_user_id)
+
+
+# Индексы гифок (`GifIndex`) по Telegram ID пользователя, используются при GIF_INDEX_ENABLED.
+# Изменения тегов гифки применяются к индексу на месте, импорт библиотеки сбрасывает его.
+# Вес записи считается при загрузке индекса и не пересчитывается при изменениях.
+gif_index_cache = LRUCache(
+    max_weight=config.GIF_INDEX_CACHE_MAX_BYTES,
+    ttl=config.TAGS_CACHE_TTL,
+    weigher=lambda tg_user_id, index: index.size_bytes(),
+)
+
+# Фоновые загрузки индексов гифок по Telegram ID пользователя. Если библиотека пользователя
+# изменилась во время загрузки, загрузка попадает в `_stale_gif_index_loads` и её результат не кэшируется.
+_gif_index_loads: dict[int, asyncio.Task] = {}
+_stale_gif_index_loads: set[int] = set()
+
+
+def _update_gif_index(tg_user_id: int, apply, library_version: int | None) -> None:
+    """
+    Применяет зафиксированное изменение библиотеки пользователя к его индексу гифок, если индекс загружен.
+
+    Транзакция увеличивает версию библиотеки ровно на 1 (см. триггер `users_bump_library_version`),
+    поэтому изменение применяется на месте, только если новая версия на 1 больше версии индекса.
+    Иначе индекс пропустил изменения другого процесса и сбрасывается.
+
+    :param apply: функция, изменяющая `GifIndex`.
+    :param library_version: версия библиотеки после изменения (см. `_indexed_library_version`).
+    """
+    if tg_user_id in _gif_index_loads:
+        _stale_gif_index_loads.add(tg_user_id)
+    index = gif_index_cache.get(tg_user_id, count=False)
+    if index is None:
+        return
+
+    if library_version is None or index.version is None or library_version != index.version + 1:
+        gif_index_cache.invalidate(tg_user_id)
+        return
+    apply(index)
+    index.version = library_version
+
+
+async def _indexed_library_version(async_session: AsyncSession, tg_user_id: int, user_id: int) -> int | None:
+    """
+    Версия библиотеки с учётом изменений текущей (ещё не зафиксированной) транзакции.
+
+    Нужна только для обновления загруженного индекса гифок, поэтому без индекса запрос не выполняется.
+    Строку `users` до конца транзакции держит блокировка из триггера версии, так что запись
+    другого процесса не может оказаться между прочитанной версией и фиксацией.
+    """
+    if tg_user_id not in gif_index_cache:
+        return None
+    return (await async_session.execute(
+        select(User.library_version).where(User.id == user_id)
+    )).scalar_one_or_none()
+
+
+def invalidate_user_library(tg_user_id: int) -> None:
+    """Сбрасывает все данные пользователя в памяти процесса: теги, индекс подсказок и индекс гифок."""
+    invalidate_user_tags(tg_user_id)
+    if tg_user_id in _gif_index_loads:
+        _stale_gif_index_loads.add(tg_user_id)
+    gif_index_cache.invalidate(tg_user_id)
+
+
+@traced
+async def get_library_version(async_session: AsyncSession, tg_user_id: int) -> tuple[int, int] | None:
+    """
+    Возвращает внутренний ID пользователя и версию его библиотеки одним запросом по индексу `users.tg_id`.
+
+    Версия (`users.library_version`) увеличивается в каждой транзакции, изменившей теги гифок
+    пользователя, и используется для ETag ответов и проверки кэшей процесса.
+
+    :param async_session: Объект асинхронной сессии SQLAlchemy.
+    :param tg_user_id: Telegram ID пользователя.
+    :return: (user_id, library_version) или None, если пользователь не найден.
+    """
+    row = (await async_session.execute(
+        select(User.id, User.library_version).where(User.tg_id == tg_user_id)
+    )).first()
+    return (row.id, row.library_version) if row is not None else None
+
+
+async def _resolve_user_id(
+        async_session: AsyncSession,
+        user_id: int | None = None,
+        tg_user_id: int | None = None,
+) -> int | None:
+    """
+    Возвращает внутренний ID пользователя.
+
+    Если `user_id` не указан, он определяется по `tg_user_id` через кэш идентификаторов `UsersCRUD`.
+    Фильтр по известному `user_id` позволяет планировщику использовать первичный ключ
+    `user_gif_tags` (user_id, gif_id, tag_id) вместо соединения с `users` по `tg_id`.
+
+    :return: внутренний ID пользователя или None, если пользователь не найден.
+    """
+    if user_id is not None:
+        return user_id
+    return (await UsersCRUD(async_session).resolve_ids([tg_user_id])).get(tg_user_id)
+
+
+def _user_gifs_stmt(
+        user_id: int,
+        tg_gifs_id: Sequence[str] | str = None,
+        tags: Sequence[str] | str = None,
+        after_gif_id: int | None = None,
+        limit: int | None = None,
+) -> tuple[Select, Select | None]:
+    """
+    Строит запрос строк (user_id, gif_id, tg_id, tg_gif_id, tag) для гифок пользователя.
+
+    Возвращает пару запросов:
+      - все строки пользователя с учётом фильтра `tg_gifs_id`, упорядоченные по ID гифки;
+      - тот же запрос, ограниченный гифками, прошедшими фильтры `tags`, `after_gif_id` и `limit`,
+        или None, если эти фильтры не заданы.
+
+    Отбор гифок (все теги, keyset-страница) выполняется подзапросом на стороне БД,
+    чтобы не тянуть всю библиотеку пользователя ради нескольких гифок.
+    Параметры совпадают с `get_user_gifs_with_tags`, `limit` ограничивает количество гифок,
+    `user_id` — внутренний ID пользователя (см. `_resolve_user_id`).
+    """
+    if isinstance(tg_gifs_id, str):
+        tg_gifs_id = (tg_gifs_id,)
+
+    if isinstance(tags, str):
+        tags = (tags,)
+
+    stmt = (
+        select(
+            UserGifTag.user_id,
+            UserGifTag.gif_id,
+            User.tg_id,
+            Gif.tg_gif_id,
+            Tag.tag,
+        )
+        .select_from(UserGifTag)
+        .join(User, UserGifTag.user_id == User.id)
+        .join(Gif, UserGifTag.gif_id == Gif.id)
+        .join(Tag, UserGifTag.tag_id == Tag.id)
+        .where(UserGifTag.user_id == user_id)
+        .order_by(UserGifTag.gif_id)
+    )
+
+    if tg_gifs_id:
+        stmt = stmt.where(Gif.tg_gif_id.in_(tg_gifs_id))
+
+    if not tags and limit is None and after_gif_id is None:
+        return stmt, None
+
+    page_gifs = (
+        select(UserGifTag.gif_id)
+        .select_from(UserGifTag)
+        .where(UserGifTag.user_id == user_id)
+        .group_by(UserGifTag.gif_id)
+        .order_by(UserGifTag.gif_id)
+    )
+
+    if tags:
+        tags_set = set(tags)
+        page_gifs = (
+            page_gifs
+            .join(Tag, UserGifTag.tag_id == Tag.id)
+            .where(Tag.tag.in_(tags_set))
+            .having(func.count() == len(tags_set))
+        )
+    if tg_gifs_id:
+        page_gifs = page_gifs.join(Gif, UserGifTag.gif_id == Gif.id).where(Gif.tg_gif_id.in_(tg_gifs_id))
+    if after_gif_id is not None:
+        page_gifs = page_gifs.where(UserGifTag.gif_id > after_gif_id)
+    if limit is not None:
+        page_gifs = page_gifs.limit(limit)
+
+    return stmt, stmt.where(UserGifTag.gif_id.in_(page_gifs))
+
+
+async def _fetch_gifs_normalized(
+        async_session: AsyncSession,
+        user_id: int,
+        tg_gifs_id: Sequence[str] | str = None,
+        tags: Sequence[str] | str = None,
+        after_gif_id: int | None = None,
+        limit: int | None = None,
+) -> tuple[int, list[dict]] | None:
+    """
+    Гифки пользователя из `user_gif_tags` (соединение с `users`, `gifs` и `tags`, строка на тег).
+
+    Параметры совпадают с `_user_gifs_stmt`.
+
+    :return: (Telegram ID пользователя, список гифок {'id', 'tg_gif_id', 'tags'}) или None,
+             если у пользователя нет гифок.
+    """
+    stmt, page_gifs = _user_gifs_stmt(
+        user_id=user_id,
+        tg_gifs_id=tg_gifs_id,
+        tags=tags,
+        after_gif_id=after_gif_id,
+        limit=limit,
+    )
+
+    if page_gifs is not None:
+        result = await async_session.execute(page_gifs)
+        rows = result.all()
+
+        if not rows:
+            # Ни одна гифка не подошла, но пользователь с гифками может существовать:
+            # в этом случае возвращаем его данные с пустым списком гифок.
+            result = await async_session.execute(stmt.limit(1))
+            first = result.first()
+            if first is None:
+                return None
+
+            return first.tg_id, []
+    else:
+        result = await async_session.execute(stmt)
+        rows = result.all()
+
+    if not rows:
+        return None
+
+    gifs_map: dict[int, dict] = {}
+
+    for row in rows:
+        gif = gifs_map.setdefault(
+            row.gif_id,
+            {
+                'id': row.gif_id,
+                'tg_gif_id': row.tg_gif_id,
+                'tags': [],
+            }
+        )
+        gif['tags'].append(row.tag)
 
+    return rows[0].tg_id, list(gifs_map.values())
 
+
+def _user_gifs_projection_stmt(
+        user_id: int,
+        tg_gifs_id: Sequence[str] | str = None,
+        tags: Sequence[str] | str = None,
+        after_gif_id: int | None = None,
+        limit: int | None = None,
+) -> Select:
+    """
+    Строит запрос строк (gif_id, tg_id, tg_gif_id, tags) для гифок пользователя по проекции `user_gifs`.
+
+    Одна строка на гифку, упорядочены по ID гифки. Отбор гифок со всеми тегами —
+    `tags @> ARRAY[...]` (GIN-индекс `ix_user_gifs_tags`), keyset-страница — по первичному ключу
+    (user_id, gif_id). Параметры совпадают с `_user_gifs_stmt`.
+    """
+    if isinstance(tg_gifs_id, str):
+        tg_gifs_id = (tg_gifs_id,)
+
+    if isinstance(tags, str):
+        tags = (tags,)
+
+    stmt = (
+        select(
+            UserGif.gif_id,
+            User.tg_id,
+            UserGif.tg_gif_id,
+            UserGif.tags,
+        )
+        .select_from(UserGif)
+        .join(User, UserGif.user_id == User.id)
+        .where(UserGif.user_id == user_id)
+        .order_by(UserGif.gif_id)
+    )
+
+    if tg_gifs_id:
+        stmt = stmt.where(UserGif.tg_gif_id.in_(tg_gifs_id))
+    if tags:
+        stmt = stmt.where(UserGif.tags.contains(sorted(set(tags))))
+    if after_gif_id is not None:
+        stmt = stmt.where(UserGif.gif_id > after_gif_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    return stmt
+
+
+async def _fetch_gifs_projection(
+        async_session: AsyncSession,
+        user_id: int,
+        tg_gifs_id: Sequence[str] | str = None,
+        tags: Sequence[str] | str = None,
+        after_gif_id: int | None = None,
+        limit: int | None = None,
+) -> tuple[int, list[dict]] | None:
+    """
+    Гифки пользователя из проекции `user_gifs` (строка на гифку, теги уже собраны в массив).
+
+    Результат тот же, что у `_fetch_gifs_normalized`.
+    """
+    result = await async_session.execute(_user_gifs_projection_stmt(
+        user_id=user_id,
+        tg_gifs_id=tg_gifs_id,
+        tags=tags,
+        after_gif_id=after_gif_id,
+        limit=limit,
+    ))
+    rows = result.all()
+
+    if not rows:
+        if not tags and after_gif_id is None and limit is None:
+            return None
+        # Как и в _fetch_gifs_normalized: пользователь с гифками получает пустую страницу
+        result = await async_session.execute(_user_gifs_projection_stmt(user_id=user_id, limit=1))
+        first = result.first()
+        if first is None:
+            return None
+        return first.tg_id, []
+
+    return rows[0].tg_id, [
+        {
+            'id': row.gif_id,
+            'tg_gif_id': row.tg_gif_id,
+            'tags': list(row.tags),
+        }
+        for row in rows
+    ]
+
+
+async def _load_gif_index(tg_user_id: int, user_id: int) -> None:
+    """
+    Загружает библиотеку пользователя в `GifIndex` в отдельной сессии и кладёт индекс в `gif_index_cache`.
+    Выполняется фоновой задачей, по завершении которой вызывается `_gif_index_load_done`.
+    """
+    fetch = _fetch_gifs_projection if config.SEARCH_BACKEND == 'projection' else _fetch_gifs_normalized
+    async with AsyncSessionLocal() as async_session:
+        # Версия читается до данных: данные не старше версии, а более новые данные с прежней версией
+        # приведут лишь к лишней перезагрузке индекса
+        version = await get_library_version(async_session, tg_user_id)
+        found = await fetch(async_session, user_id=user_id) if version is not None else None
+    if found is not None and tg_user_id not in _stale_gif_index_loads:
+        index = GifIndex((gif['id'], gif['tg_gif_id'], gif['tags']) for gif in found[1])
+        index.version = version[1]
+        gif_index_cache.set(tg_user_id, index)
+
+
+def _gif_index_load_done(tg_user_id: int, task: asyncio.Task) -> None:
+    """
+    Завершение фоновой загрузки индекса гифок: ошибка записывается в журнал (результат задачи никто не ждёт),
+    а загрузка снимается с учёта, даже если задача была отменена до начала выполнения.
+    """
+    if _gif_index_loads.get(tg_user_id) is task:
+        del _gif_index_loads[tg_user_id]
+        _stale_gif_index_loads.discard(tg_user_id)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error('Не удалось загрузить индекс гифок пользователя %s', tg_user_id, exc_info=task.exception())
+
+
+def _search_gif_index(
+        tg_user_id: int,
+        user_id: int,
+        tg_gifs_id: Sequence[str] | str = None,
+        tags: Sequence[str] | str = None,
+        after_gif_id: int | None = None,
+        limit: int | None = None,
+        library_version: int | None = None,
+) -> tuple[int, list[dict]] | None:
+    """
+    Гифки пользователя из индекса в памяти процесса, результат тот же, что у `_fetch_gifs_normalized`.
+
+    При промахе (или если индекс построен по другой версии библиотеки, чем `library_version`)
+    запускает фоновую загрузку индекса и возвращает None: запрос, вызвавший загрузку,
+    и запросы, пришедшие до её окончания, выполняются в БД.
+
+    Пустой индекс (пользователь удалил все гифки) — не промах и повторно не загружается. Для него тоже
+    возвращается None: у `_fetch_gifs_normalized` библиотека без гифок отличается от пустого результата
+    поиска, и такой запрос выполняется в БД.
+    """
+    index = gif_index_cache.get(tg_user_id)
+    if index is not None and not _version_matches(index.version, library_version):
+        gif_index_cache.invalidate(tg_user_id)
+        index = None
+    if index is None:
+        if tg_user_id not in _gif_index_loads:
+            task = asyncio.create_task(_load_gif_index(tg_user_id, user_id))
+            _gif_index_loads[tg_user_id] = task
+            task.add_done_callback(lambda task: _gif_index_load_done(tg_user_id, task))
+        return None
+    if not len(index):
+        return None
+
+    if isinstance(tg_gifs_id, str):
+        tg_gifs_id = (tg_gifs_id,)
+    if isinstance(tags, str):
+        tags = (tags,)
+
+    return tg_user_id, index.search(tags=tags, tg_gifs_id=tg_gifs_id, after_gif_id=after_gif_id, limit=limit)
+
+
+@traced
 async def get_user_gifs_with_tags(
         async_session: AsyncSession,
         user_id: int | None = None,
         tg_user_id: int | None = None,
         tg_gifs_id: Sequence[str] | str = None,
         tags: Sequence[str] | str = None,
+        after_gif_id: int | None = None,
+        limit: int | None = None,
+        library_version: int | None = None,
 ):
     """
     Возвращает гифки пользователя с их тегами в виде вложенного словаря.
@@ -33,7 +492,9 @@ async def get_user_gifs_with_tags(
             },
 
             ...
-        ]
+        ],
+
+        'next_gif_id': ID последней гифки страницы, если есть следующая страница, иначе None
     }
 
     Таблицы `users`, `gifs`, `tags` и `user_gif_tags` связываются через JOIN.
@@ -43,89 +504,258 @@ async def get_user_gifs_with_tags(
       - `tg_gifs_id` (Telegram ID гифок, возвращаются только указанные гифки),
       - `tags` (возвращаются только гифки, содержащие все теги).
 
+    Гифки упорядочены по внутреннему ID. Для постраничной выдачи используется keyset-пагинация:
+    `limit` ограничивает количество гифок на странице, а `after_gif_id` (значение `next_gif_id`
+    предыдущей страницы) задаёт, после какой гифки начинать. Каждая страница выбирается
+    ограниченным запросом, поэтому время ответа не зависит от глубины пролистывания.
+
     Если указаны одновременно `user_id` и `tg_user_id`, приоритет имеет `user_id`.
 
+    Источник данных задаётся настройкой `SEARCH_BACKEND`: `normalized` — соединение `user_gif_tags`
+    с `gifs` и `tags`, `projection` — таблица `user_gifs` с массивом тегов на гифку
+    (поиск по тегам через `tags @> ARRAY[...]`). Результат у обоих вариантов одинаковый,
+    кроме порядка тегов внутри гифки.
+
+    При `GIF_INDEX_ENABLED` запросы по `tg_user_id` обслуживаются из индекса гифок в памяти процесса
+    (`GifIndex`: пересечение битовых масок тегов), если индекс пользователя уже загружен;
+    иначе запрос выполняется в БД, а индекс загружается в фоне. Если передана текущая `library_version`
+    (см. `get_library_version`), индекс другой версии не используется.
+
+    При `SINGLE_FLIGHT_ENABLED` одновременные вызовы по `tg_user_id` с одинаковыми фильтрами
+    выполняют один запрос (`gifs_flight`) и получают общий результат, поэтому изменять его нельзя.
+
     :param async_session: Объект асинхронной сессии SQLAlchemy.
     :param user_id: внутренний ID пользователя (опционально).
     :param tg_user_id: Telegram ID пользователя (опционально).
     :param tg_gifs_id: один или несколько Telegram ID гифок для фильтрации (опционально).
     :param tags: один или несколько тегов для фильтрации гифок (опционально).
+    :param after_gif_id: вернуть только гифки с ID больше указанного (опционально).
+    :param limit: максимальное количество гифок в ответе (опционально).
+    :param library_version: текущая версия библиотеки пользователя для проверки индекса гифок (опционально).
     :return: словарь с данными пользователя, гифок и тегов в формате, описанном выше,
              или None, если пользователь не найден.
     """
+    filters = {
+        'tg_gifs_id': tg_gifs_id,
+        'tags': tags,
+        'after_gif_id': after_gif_id,
+        'limit': limit,
+        'library_version': library_version,
+    }
+    load = lambda: _get_user_gifs_with_tags(async_session, user_id=user_id, tg_user_id=tg_user_id, **filters)
+    if not config.SINGLE_FLIGHT_ENABLED or user_id is not None or tg_user_id is None:
+        return await load()
+
+    # Порядок и повторы гифок и тегов на результат не влияют
+    key = (
+        async_session.bind,
+        _flight_argument(tg_gifs_id),
+        _flight_argument(tags),
+        after_gif_id,
+        limit,
+        library_version,
+    )
+    return await gifs_flight.do(tg_user_id, key, load)
+
+
+def _flight_argument(values: Sequence[str] | str | None) -> frozenset[str] | None:
+    """Фильтр гифок или тегов в виде, пригодном для ключа single-flight."""
+    if isinstance(values, str):
+        values = (values,)
+    return frozenset(values) if values else None
+
+
+async def _get_user_gifs_with_tags(
+        async_session: AsyncSession,
+        user_id: int | None = None,
+        tg_user_id: int | None = None,
+        tg_gifs_id: Sequence[str] | str = None,
+        tags: Sequence[str] | str = None,
+        after_gif_id: int | None = None,
+        limit: int | None = None,
+        library_version: int | None = None,
+) -> dict | None:
+    """Выполняет `get_user_gifs_with_tags` без объединения одновременных вызовов."""
     if user_id is None and tg_user_id is None:
         return None
 
-    if isinstance(tg_gifs_id, str):
-        tg_gifs_id = (tg_gifs_id,)
+    # Индекс гифок хранится по Telegram ID, поэтому используется только для запросов по tg_user_id
+    use_index = config.GIF_INDEX_ENABLED and user_id is None
+    user_id = await _resolve_user_id(async_session, user_id=user_id, tg_user_id=tg_user_id)
+    if user_id is None:
+        return None
 
-    if isinstance(tags, str):
-        tags = (tags,)
+    filters = {
+        'tg_gifs_id': tg_gifs_id,
+        'tags': tags,
+        'after_gif_id': after_gif_id,
+        'limit': limit + 1 if limit is not None else None,
+    }
+    found = _search_gif_index(tg_user_id, user_id, library_version=library_version, **filters) if use_index else None
+    if found is None:
+        fetch = _fetch_gifs_projection if config.SEARCH_BACKEND == 'projection' else _fetch_gifs_normalized
+        found = await fetch(async_session, user_id=user_id, **filters)
+    if found is None:
+        return None
+    tg_id, gifs_data = found
 
-    stmt = (
-        select(
-            UserGifTag.user_id,
-            UserGifTag.gif_id,
-            User.tg_id,
-            Gif.tg_gif_id,
-            Tag.tag,
-        )
-        .select_from(UserGifTag)
-        .join(User, UserGifTag.user_id == User.id)
-        .join(Gif, UserGifTag.gif_id == Gif.id)
-        .join(Tag, UserGifTag.tag_id == Tag.id)
+    next_gif_id = None
+    if limit is not None and len(gifs_data) > limit:
+        gifs_data = gifs_data[:limit]
+        next_gif_id = gifs_data[-1]['id']
+
+    return {
+        'id': user_id,
+        'tg_user_id': tg_id,
+        'gifs_data': gifs_data,
+        'next_gif_id': next_gif_id,
+    }
+
+
+# Запрос пакетного чтения строится один раз: пары передаются двумя массивами,
+# поэтому текст запроса не зависит от их количества и подготавливается asyncpg один раз
+_batch_request = (
+    func.unnest(
+        bindparam('tg_user_ids', type_=ARRAY(BigInteger)),
+        bindparam('tg_gif_ids', type_=ARRAY(String)),
+    )
+    .table_valued('tg_user_id', 'tg_gif_id', with_ordinality='position')
+    .render_derived(name='request')
+)
+_batch_stmt = (
+    select(
+        _batch_request.c.position,
+        UserGifTag.gif_id,
+        func.array_agg(Tag.tag).label('tags'),
     )
+    .select_from(_batch_request)
+    .join(User, User.tg_id == _batch_request.c.tg_user_id)
+    .join(Gif, Gif.tg_gif_id == _batch_request.c.tg_gif_id)
+    .join(UserGifTag, (UserGifTag.user_id == User.id) & (UserGifTag.gif_id == Gif.id))
+    .join(Tag, UserGifTag.tag_id == Tag.id)
+    .group_by(_batch_request.c.position, UserGifTag.gif_id)
+)
 
-    if user_id is not None:
-        stmt = stmt.where(UserGifTag.user_id == user_id)
-    else:
-        stmt = stmt.where(User.tg_id == tg_user_id)
 
-    if tg_gifs_id:
-        stmt = stmt.where(Gif.tg_gif_id.in_(tg_gifs_id))
+@traced
+async def get_user_gifs_batch(
+        async_session: AsyncSession,
+        pairs: Sequence[tuple[int, str]],
+) -> list[dict | None]:
+    """
+    Возвращает гифки с тегами для набора пар (Telegram ID пользователя, Telegram ID гифки) одним запросом.
 
-    result = await async_session.execute(stmt)
-    rows = result.all()
+    Пары передаются в БД двумя массивами и разворачиваются через `unnest(...) WITH ORDINALITY`,
+    соединение с `users`, `gifs`, `user_gif_tags` и `tags` и `array_agg` тегов выполняются
+    на стороне БД. Вместо отдельного `get_user_gifs_with_tags` на каждую гифку — один round-trip.
 
-    if not rows:
-        return None
+    Результат выровнен по `pairs`: i-й элемент — {'id', 'tg_gif_id', 'tags'} для i-й пары
+    или None, если у пользователя нет такой гифки (или нет самого пользователя / гифки).
+    Повторяющиеся пары допускаются.
 
-    first = rows[0]
-    resolved_user_id = user_id if user_id is not None else first.user_id
+    :param async_session: Объект асинхронной сессии SQLAlchemy.
+    :param pairs: пары (tg_user_id, tg_gif_id).
+    :return: список той же длины, что и `pairs`.
+    """
+    if not pairs:
+        return []
 
-    gifs_map: dict[int, dict] = {}
+    tg_user_ids, tg_gif_ids = zip(*pairs)
+    result = await async_session.execute(_batch_stmt, {
+        'tg_user_ids': list(tg_user_ids),
+        'tg_gif_ids': list(tg_gif_ids),
+    })
 
-    for row in rows:
-        gif = gifs_map.setdefault(
-            row.gif_id,
-            {
+    gifs: list[dict | None] = [None] * len(pairs)
+    for row in result:
+        gifs[row.position - 1] = {
+            'id': row.gif_id,
+            'tg_gif_id': tg_gif_ids[row.position - 1],
+            'tags': row.tags,
+        }
+    return gifs
+
+
+@traced
+async def stream_user_gifs_with_tags(
+        async_session: AsyncSession,
+        user_id: int | None = None,
+        tg_user_id: int | None = None,
+        tags: Sequence[str] | str = None,
+        after_gif_id: int | None = None,
+        limit: int | None = None,
+        batch_size: int = STREAM_BATCH_SIZE,
+) -> AsyncIterator[dict]:
+    """
+    Потоковый вариант `get_user_gifs_with_tags`: отдаёт гифки пользователя по одной.
+
+    Строки читаются через серверный курсор (`AsyncSession.stream`) порциями по `batch_size`
+    и группируются по гифке по мере поступления, поэтому потребление памяти не зависит
+    от размера библиотеки. Каждый элемент имеет вид {'id', 'tg_gif_id', 'tags'}.
+
+    Если пользователь не найден или у него нет подходящих гифок, не отдаётся ничего.
+    Источник данных выбирается настройкой `SEARCH_BACKEND`, как в `get_user_gifs_with_tags`.
+
+    :param async_session: Объект асинхронной сессии SQLAlchemy.
+    :param user_id: внутренний ID пользователя (опционально).
+    :param tg_user_id: Telegram ID пользователя (опционально).
+    :param tags: один или несколько тегов для фильтрации гифок (опционально).
+    :param after_gif_id: вернуть только гифки с ID больше указанного (опционально).
+    :param limit: максимальное количество гифок (опционально).
+    :param batch_size: количество строк, получаемых из курсора за один раз.
+    """
+    if user_id is None and tg_user_id is None:
+        return
+
+    user_id = await _resolve_user_id(async_session, user_id=user_id, tg_user_id=tg_user_id)
+    if user_id is None:
+        return
+
+    if config.SEARCH_BACKEND == 'projection':
+        stmt = _user_gifs_projection_stmt(user_id=user_id, tags=tags, after_gif_id=after_gif_id, limit=limit)
+        result = await async_session.stream(stmt.execution_options(yield_per=batch_size))
+        async for row in result:
+            yield {
                 'id': row.gif_id,
                 'tg_gif_id': row.tg_gif_id,
-                'tags': [],
+                'tags': list(row.tags),
             }
-        )
-        gif['tags'].append(row.tag)
+        return
 
-    gifs_data = list(gifs_map.values())
+    stmt, page_gifs = _user_gifs_stmt(
+        user_id=user_id,
+        tags=tags,
+        after_gif_id=after_gif_id,
+        limit=limit,
+    )
+    if page_gifs is not None:
+        stmt = page_gifs
 
-    if tags:
-        tags_set = set(tags)
-        gifs_data = [
-            gif for gif in gifs_data
-            if tags_set.issubset(set(gif['tags']))
-        ]
+    result = await async_session.stream(stmt.execution_options(yield_per=batch_size))
 
-    return {
-        'id': resolved_user_id,
-        'tg_user_id': first.tg_id,
-        'gifs_data': gifs_data,
-    }
+    gif = None
+    async for row in result:
+        # Строки упорядочены по ID гифки, поэтому гифка готова, как только пришла строка следующей
+        if gif is None or gif['id'] != row.gif_id:
+            if gif is not None:
+                yield gif
+            gif = {
+                'id': row.gif_id,
+                'tg_gif_id': row.tg_gif_id,
+                'tags': [],
+            }
+        gif['tags'].append(row.tag)
+
+    if gif is not None:
+        yield gif
 
 
+@traced
 async def get_all_user_tags(
         async_session: AsyncSession,
         user_id: int | None = None,
         tg_user_id: int | None = None,
+        library_version: int | None = None,
 ):
     """
     Возвращает все уникальные теги, связанные с GIF пользователя.
@@ -135,36 +765,109 @@ async def get_all_user_tags(
 
     Если указаны одновременно `user_id` и `tg_user_id`, приоритет имеет `user_id`.
 
+    Результаты запросов по `tg_user_id` кэшируются в `user_tags_cache` (LRU с TTL, в памяти процесса),
+    кэш пользователя сбрасывается после фиксации изменений его тегов. Если передана текущая
+    `library_version` (см. `get_library_version`), запись кэша другой версии не используется:
+    так изменения, сделанные другими процессами, видны сразу, а не через TTL.
+
+    При `SINGLE_FLIGHT_ENABLED` одновременные промахи кэша по одному `tg_user_id` (и той же
+    `library_version`) выполняют один запрос к БД (`tags_flight`).
+
     :param async_session: Объект асинхронной сессии SQLAlchemy.
     :param user_id: внутренний ID пользователя (опционально).
     :param tg_user_id: Telegram ID пользователя (опционально).
+    :param library_version: текущая версия библиотеки пользователя (опционально).
     :return: множество уникальных тегов (`set[str]`) или None, если пользователь не найден.
     """
     if user_id is None and tg_user_id is None:
         return None
 
+    if user_id is None:
+        cached = user_tags_cache.get(tg_user_id)
+        if cached is not None and _version_matches(cached[0], library_version):
+            return set(cached[1])
+
+    load = lambda: _load_user_tags(async_session, user_id, tg_user_id, library_version)
+    if config.SINGLE_FLIGHT_ENABLED and user_id is None:
+        tags = await tags_flight.do(tg_user_id, (async_session.bind, library_version), load)
+    else:
+        tags = await load()
+    return set(tags) if tags is not None else None
+
+
+async def _load_user_tags(
+        async_session: AsyncSession,
+        user_id: int | None,
+        tg_user_id: int | None,
+        library_version: int | None,
+) -> frozenset[str] | None:
+    """Запрос тегов пользователя для `get_all_user_tags`; результат по `tg_user_id` сохраняется в `user_tags_cache`."""
+    use_cache = user_id is None
+    user_id = await _resolve_user_id(async_session, user_id=user_id, tg_user_id=tg_user_id)
+    if user_id is None:
+        return None
+
     stmt = (
         select(Tag.tag)
+        .distinct()
         .select_from(UserGifTag)
-        .join(User, UserGifTag.user_id == User.id)
-        .join(Gif, UserGifTag.gif_id == Gif.id)
         .join(Tag, UserGifTag.tag_id == Tag.id)
+        .where(UserGifTag.user_id == user_id)
     )
 
-    if user_id is not None:
-        stmt = stmt.where(UserGifTag.user_id == user_id)
-    else:
-        stmt = stmt.where(User.tg_id == tg_user_id)
-
     result = await async_session.execute(stmt)
-    tags = result.scalars().all()
+    tags = frozenset(result.scalars().all())
 
     if not tags:
         return None
 
-    return set(tags)
+    if use_cache:
+        user_tags_cache.set(tg_user_id, (library_version, tags))
+
+    return tags
+
+
+@traced
+async def suggest_user_tags(
+        async_session: AsyncSession,
+        tg_user_id: int,
+        query: str,
+        limit: int = 10,
+        library_version: int | None = None,
+) -> list[str] | None:
+    """
+    Подсказывает теги пользователя по введённой строке.
+
+    Сначала идут теги, начинающиеся с `query` (без учёта регистра), затем теги,
+    похожие на `query` по триграммам (похожесть не ниже `TAG_SUGGEST_SIMILARITY_THRESHOLD`,
+    та же метрика, что у `similarity()` из `pg_trgm`).
 
+    Поиск выполняется по индексу `TagIndex`, построенному в памяти процесса из тегов пользователя
+    (`get_all_user_tags`) и закэшированному в `tag_index_cache`, поэтому запрос к БД нужен
+    только при первом обращении и после изменения тегов пользователя (или смены `library_version`,
+    как в `get_all_user_tags`).
 
+    :param async_session: Объект асинхронной сессии SQLAlchemy.
+    :param tg_user_id: Telegram ID пользователя.
+    :param query: введённая пользователем строка.
+    :param limit: максимальное количество подсказок.
+    :param library_version: текущая версия библиотеки пользователя (опционально).
+    :return: список тегов или None, если у пользователя нет тегов.
+    """
+    cached = tag_index_cache.get(tg_user_id)
+    if cached is not None and _version_matches(cached[0], library_version):
+        index = cached[1]
+    else:
+        tags = await get_all_user_tags(async_session, tg_user_id=tg_user_id, library_version=library_version)
+        if not tags:
+            return None
+        index = TagIndex(tags)
+        tag_index_cache.set(tg_user_id, (library_version, index))
+
+    return index.suggest(query, limit=limit, threshold=config.TAG_SUGGEST_SIMILARITY_THRESHOLD)
+
+
+@traced
 async def set_new_user_tags_on_gif(
         async_session: AsyncSession,
         tg_user_id: int,
@@ -185,47 +888,285 @@ async def set_new_user_tags_on_gif(
     :param tg_gif_id: Telegram ID гифки.
     :param tags: один тег или список тегов, которые будут связаны с гифкой.
     :return: None (изменения фиксируются в базе данных через session).
+
+    Замена тегов выполняется постоянным числом запросов независимо от количества тегов:
+    чтение текущих тегов, многострочное создание недостающих тегов, одна многострочная
+    вставка связей и один DELETE лишних связей. ID пользователя, гифки и тегов берутся
+    из кэша идентификаторов CRUD-классов, поэтому при попадании в кэш запросы на их
+    получение не выполняются. Если переданный набор тегов совпадает с сохранённым,
+    запись в базу не выполняется.
+
+    Если закэшированный ID указывает на уже удалённую запись (нарушение внешнего ключа),
+    соответствия сбрасываются и операция повторяется один раз.
+
+    При `GROUP_COMMIT_ENABLED` замена ставится в очередь `tag_writes` и применяется вместе
+    с другими заменами, пришедшими в течение `GROUP_COMMIT_WINDOW_MS`, одной транзакцией
+    (см. `_apply_tag_updates`); `async_session` в этом случае не используется. Функция возвращает
+    управление после фиксации транзакции или выбрасывает исключение, если эта замена не применена.
+    """
+    if isinstance(tags, str):
+        tags = [tags]
+    tags = set(tags)
+
+    if config.GROUP_COMMIT_ENABLED:
+        await tag_writes.submit((tg_user_id, tg_gif_id, frozenset(tags)))
+        return
+
+    for attempt in range(2):
+        try:
+            replaced = await _replace_user_gif_tags(async_session, tg_user_id, tg_gif_id, tags)
+            if replaced is None:
+                return
+            user_id, gif_id = replaced
+            library_version = await _indexed_library_version(async_session, tg_user_id, user_id)
+            await async_session.commit()
+            break
+        except IntegrityError as e:
+            await async_session.rollback()
+            if attempt or getattr(e.orig, 'sqlstate', None) != FOREIGN_KEY_VIOLATION:
+                raise
+            _forget_ids(async_session, [tg_user_id], [tg_gif_id], tags)
+        except Exception:
+            await async_session.rollback()
+            raise
+
+    invalidate_user_tags(tg_user_id)
+    stick_to_primary(tg_user_id)
+    _update_gif_index(tg_user_id, lambda index: index.set_gif(gif_id, tg_gif_id, tags), library_version)
+
+
+def _forget_ids(
+        async_session: AsyncSession,
+        tg_user_ids: Iterable[int],
+        tg_gif_ids: Iterable[str],
+        tags: Iterable[str],
+) -> None:
+    """Сбрасывает соответствия идентификаторов, которые могли указывать на удалённые другими процессами записи."""
+    UsersCRUD(async_session).forget_ids(tg_user_ids)
+    GifsCRUD(async_session).forget_ids(tg_gif_ids)
+    TagsCRUD(async_session).forget_ids(tags)
+
+
+# Замена тегов одной гифки пользователя, поставленная в очередь group commit: (tg_user_id, tg_gif_id, теги)
+TagUpdate = tuple[int, str, frozenset[str]]
+# Применённая замена: (tg_user_id, user_id, gif_id, tg_gif_id, теги)
+_AppliedTagUpdate = tuple[int, int, int, str, frozenset[str]]
+
+
+async def _apply_tag_updates(updates: list[TagUpdate]) -> list[BaseException | None]:
+    """
+    Применяет пакет замен тегов (group commit) одной транзакцией в собственной сессии.
+
+    Сначала пакет применяется набором запросов, число которых не зависит от размера пакета
+    (`_replace_tags_batch`). Если это не удалось (например, закэшированный ID указывает на удалённую
+    запись или одна из замен некорректна), транзакция откатывается и замены применяются по одной,
+    каждая в своей точке сохранения (`_replace_tags_one_by_one`): ошибка одной замены
+    не мешает остальным.
+
+    :return: для каждой замены None, если она применена, или исключение.
+    """
+    async with AsyncSessionLocal() as async_session:
+        try:
+            applied = await _replace_tags_batch(async_session, updates)
+            results = [None] * len(updates)
+        except Exception:
+            await async_session.rollback()
+            GROUP_COMMIT_FALLBACKS.inc()
+            _forget_ids(
+                async_session,
+                [tg_user_id for tg_user_id, _, _ in updates],
+                [tg_gif_id for _, tg_gif_id, _ in updates],
+                set().union(*(tags for _, _, tags in updates)),
+            )
+            applied, results = await _replace_tags_one_by_one(async_session, updates)
+
+        versions = {}
+        for tg_user_id, user_id, _, _, _ in applied:
+            if user_id not in versions:
+                versions[user_id] = await _indexed_library_version(async_session, tg_user_id, user_id)
+        try:
+            await async_session.commit()
+        except Exception as e:
+            await async_session.rollback()
+            return [e] * len(updates)
+
+    applied_by_user: dict[int, list[_AppliedTagUpdate]] = {}
+    for update in applied:
+        applied_by_user.setdefault(update[0], []).append(update)
+    for tg_user_id, user_updates in applied_by_user.items():
+        invalidate_user_tags(tg_user_id)
+        stick_to_primary(tg_user_id)
+
+        def apply(index: GifIndex, user_updates=user_updates) -> None:
+            for _, _, gif_id, tg_gif_id, tags in user_updates:
+                index.set_gif(gif_id, tg_gif_id, tags)
+
+        _update_gif_index(tg_user_id, apply, versions[user_updates[0][1]])
+    return results
+
+
+async def _replace_tags_batch(async_session: AsyncSession, updates: list[TagUpdate]) -> list[_AppliedTagUpdate]:
+    """
+    Заменяет теги гифок пакета без фиксации транзакции: создание недостающих пользователей, гифок
+    и тегов, блокировки пересчёта `user_gifs` всех пользователей пакета (`_lock_batch_users`),
+    одна вставка связей и одно удаление лишних связей для всего пакета.
+
+    Из нескольких замен одной гифки пользователя действует последняя (замена тегов идемпотентна,
+    поэтому результат тот же, что при применении по порядку). Пользователь и гифка создаются
+    только для непустых наборов тегов, как в `_replace_user_gif_tags`.
+
+    :return: замены, изменившие связи, в порядке поступления.
+    """
+    latest: dict[tuple[int, str], frozenset[str]] = {}
+    for tg_user_id, tg_gif_id, tags in updates:
+        latest.pop((tg_user_id, tg_gif_id), None)
+        latest[(tg_user_id, tg_gif_id)] = tags
+
+    gifs_crud = GifsCRUD(async_session)
+    create = [key for key, tags in latest.items() if tags]
+    user_ids = await _lock_batch_users(
+        async_session,
+        [tg_user_id for tg_user_id, _ in latest],
+        create=[tg_user_id for tg_user_id, _ in create],
+    )
+    gif_ids = await gifs_crud.resolve_ids([tg_gif_id for _, tg_gif_id in create], create=True)
+    gif_ids |= await gifs_crud.resolve_ids([tg_gif_id for _, tg_gif_id in latest if tg_gif_id not in gif_ids])
+    tag_ids = await TagsCRUD(async_session).resolve_ids(set().union(*latest.values()), create=True)
+
+    resolved = {
+        key: (user_ids[key[0]], gif_ids[key[1]])
+        for key in latest
+        if key[0] in user_ids and key[1] in gif_ids
+    }
+    # Одинаковый порядок вставки в конкурирующих транзакциях, как в resolve_ids
+    links = sorted(
+        (user_id, gif_id, tag_ids[tag])
+        for key, (user_id, gif_id) in resolved.items()
+        for tag in latest[key]
+    )
+    user_gif_tag_crud = UserGifTagCRUD(async_session)
+    changed = await user_gif_tag_crud.create_links(links)
+    changed |= await user_gif_tag_crud.delete_links_except(sorted(resolved.values()), links)
+
+    return [
+        (tg_user_id, *resolved[(tg_user_id, tg_gif_id)], tg_gif_id, tags)
+        for (tg_user_id, tg_gif_id), tags in latest.items()
+        if resolved.get((tg_user_id, tg_gif_id)) in changed
+    ]
+
+
+async def _lock_batch_users(
+        async_session: AsyncSession,
+        tg_user_ids: Iterable[int],
+        create: Iterable[int],
+) -> dict[int, int]:
+    """
+    Находит пользователей пакета (пользователей `create` создаёт) и до изменения связей берёт
+    блокировки пересчёта `user_gifs` для всех них сразу (`UserGifTagCRUD.lock_users`): пакет меняет
+    связи нескольких пользователей несколькими запросами, и без этого два пакета могли бы
+    заблокировать друг друга.
+
+    :return: словарь {tg_user_id: user_id} найденных и созданных пользователей.
+    """
+    users_crud = UsersCRUD(async_session)
+    user_ids = await users_crud.resolve_ids(create, create=True)
+    user_ids |= await users_crud.resolve_ids([tg_user_id for tg_user_id in tg_user_ids if tg_user_id not in user_ids])
+    await UserGifTagCRUD(async_session).lock_users(user_ids.values())
+    return user_ids
+
+
+async def _replace_tags_one_by_one(
+        async_session: AsyncSession,
+        updates: list[TagUpdate],
+) -> tuple[list[_AppliedTagUpdate], list[BaseException | None]]:
+    """
+    Заменяет теги гифок пакета по одной, в порядке поступления, каждую в своей точке сохранения (SAVEPOINT).
+    Блокировки пересчёта `user_gifs` берутся заранее для всех пользователей пакета (`_lock_batch_users`).
+    Нарушение внешнего ключа из-за устаревшего кэша идентификаторов повторяется один раз, как в
+    `set_new_user_tags_on_gif`.
+
+    :return: применённые замены, изменившие связи, и результат каждой замены (None или исключение).
+    """
+    await _lock_batch_users(
+        async_session,
+        [tg_user_id for tg_user_id, _, _ in updates],
+        create=[tg_user_id for tg_user_id, _, tags in updates if tags],
+    )
+
+    applied = []
+    results = []
+    for tg_user_id, tg_gif_id, tags in updates:
+        error = None
+        for attempt in range(2):
+            try:
+                async with async_session.begin_nested():
+                    replaced = await _replace_user_gif_tags(async_session, tg_user_id, tg_gif_id, set(tags))
+                if replaced is not None:
+                    applied.append((tg_user_id, *replaced, tg_gif_id, tags))
+                error = None
+                break
+            except IntegrityError as e:
+                error = e
+                if attempt or getattr(e.orig, 'sqlstate', None) != FOREIGN_KEY_VIOLATION:
+                    break
+                _forget_ids(async_session, [tg_user_id], [tg_gif_id], tags)
+            except Exception as e:
+                error = e
+                break
+        results.append(error)
+    return applied, results
+
+
+# Очередь group commit для set_new_user_tags_on_gif (GROUP_COMMIT_ENABLED)
+tag_writes = GroupCommit(
+    apply_batch=_apply_tag_updates,
+    window=config.GROUP_COMMIT_WINDOW_MS / 1000,
+    max_batch=config.GROUP_COMMIT_MAX_BATCH,
+)
+
+
+async def _replace_user_gif_tags(
+        async_session: AsyncSession,
+        tg_user_id: int,
+        tg_gif_id: str,
+        tags: set[str],
+) -> tuple[int, int] | None:
+    """
+    Заменяет теги гифки пользователя без фиксации транзакции.
+
+    :return: внутренние ID пользователя и гифки или None, если набор тегов не изменился и ничего не записывалось.
     """
-    
     user_gif_tag_crud = UserGifTagCRUD(async_session)
     users_crud = UsersCRUD(async_session)
     tags_crud = TagsCRUD(async_session)
     gifs_crud = GifsCRUD(async_session)
-    if isinstance(tags, (str, tuple)):
-        tags = [tags]
 
-    old_data = await get_user_gifs_with_tags(async_session, tg_user_id=tg_user_id, tg_gifs_id=tg_gif_id)
+    user_id = (await users_crud.resolve_ids([tg_user_id])).get(tg_user_id)
+    gif_id = (await gifs_crud.resolve_ids([tg_gif_id])).get(tg_gif_id)
 
-    # TODO: Можно оптимизировать
-    # Удаляем старые ненужные теги
-    try:
-        if old_data and old_data['gifs_data']:
-            for old_tag in old_data['gifs_data'][0]['tags']:
-                if not old_tag in tags:
-                    tag_id = (await tags_crud.get_instances(columns=Tag.id, filters={Tag.tag: old_tag}))[0][0]
-                    await user_gif_tag_crud.delete_instances(filters={
-                        UserGifTag.user_id: old_data['id'],
-                        UserGifTag.gif_id: old_data['gifs_data'][0]['id'],
-                        UserGifTag.tag_id: tag_id,
-                    })
-                else:
-                    tags.remove(old_tag)
-
-        user = await users_crud.create_user(tg_user_id)
-        gif = await gifs_crud.create_gif(tg_gif_id)
-        tags = await asyncio.gather(
-            *(tags_crud.create_tag(tag) for tag in tags)
-        )
-    
-        for tag in tags:
-            await user_gif_tag_crud.create_user_gif_tag(user_id=user.id, gif_id=gif.id, tag_id=tag.id)
-            
-        await async_session.commit()
-    except Exception:
-        await async_session.rollback()
-        raise
+    current_tags = set()
+    if user_id is not None and gif_id is not None:
+        current_tags = set((await async_session.execute(
+            select(Tag.tag)
+            .select_from(UserGifTag)
+            .join(Tag, UserGifTag.tag_id == Tag.id)
+            .where(UserGifTag.user_id == user_id, UserGifTag.gif_id == gif_id)
+        )).scalars().all())
+    if current_tags == tags:
+        return None
+
+    if user_id is None:
+        user_id = (await users_crud.resolve_ids([tg_user_id], create=True))[tg_user_id]
+    if gif_id is None:
+        gif_id = (await gifs_crud.resolve_ids([tg_gif_id], create=True))[tg_gif_id]
+    tag_ids = list((await tags_crud.resolve_ids(tags, create=True)).values())
+
+    await user_gif_tag_crud.create_user_gif_tags(user_id=user_id, gif_id=gif_id, tag_ids=tag_ids)
+    await user_gif_tag_crud.delete_user_gif_tags_except(user_id=user_id, gif_id=gif_id, keep_tag_ids=tag_ids)
+    return user_id, gif_id
 
 
+@traced
 async def delete_user_gif_tags(
         async_session: AsyncSession,
         tg_user_id: int,
@@ -237,24 +1178,67 @@ async def delete_user_gif_tags(
     user_gif_tag_crud = UserGifTagCRUD(async_session)
     
     if not gif_id_type or gif_id_type == 'tg':
-        try:
-            gif_id = (await gifs_crud.get_instances(columns=Gif.id, filters={Gif.tg_gif_id: gif_id}))[0][0]
-        except IndexError:
+        gif_id = (await gifs_crud.resolve_ids([gif_id])).get(gif_id)
+        if gif_id is None:
             return None
     elif gif_id_type == 'db':
         gif_id = int(gif_id)
-    
-    users_id = (await users_crud.get_instances(columns=User.id, filters={User.tg_id: tg_user_id}))[0][0]
+
+    users_id = (await users_crud.resolve_ids([tg_user_id])).get(tg_user_id)
+    if users_id is None:
+        return None
     
     try:
         result = await user_gif_tag_crud.delete_instances(filters={
             UserGifTag.user_id: users_id,
             UserGifTag.gif_id: gif_id,
         })
+        library_version = await _indexed_library_version(async_session, tg_user_id, users_id) if result else None
         await async_session.commit()
-    
+        if result:
+            invalidate_user_tags(tg_user_id)
+            stick_to_primary(tg_user_id)
+            _update_gif_index(tg_user_id, lambda index: index.remove_gif(gif_id), library_version)
+
         return result
     
     except Exception:
         await async_session.rollback()
         raise
+
+
+# Telegram ID, которого не бывает у пользователей (и у синтетических пользователей бенчмарков):
+# запросы прогрева ничего не находят, поэтому не заполняют кэши процесса
+_WARMUP_TG_USER_ID = 0
+_WARMUP_USER_ID = 0
+# Формы запросов поиска, которые строят обработчики: вся библиотека (и загрузка индекса гифок),
+# страница, страница после курсора, поиск по тегу с лимитом и без, одна гифка
+_WARMUP_SEARCHES = (
+    {},
+    {'limit': 1},
+    {'after_gif_id': 0, 'limit': 1},
+    {'tags': ('-',)},
+    {'tags': ('-',), 'limit': 1},
+    {'tg_gifs_id': '-'},
+)
+
+
+async def prepare_statements(async_session: AsyncSession) -> None:
+    """
+    Выполняет горячие запросы сервиса для несуществующего пользователя, чтобы подготовить их заранее.
+
+    asyncpg кэширует подготовленные запросы на соединении по тексту SQL, а SQLAlchemy кэширует
+    компиляцию запросов в движке. После прогрева соединения первые запросы пользователей на нём
+    не тратят время на компиляцию и лишний round-trip на PREPARE. Запросы строятся теми же
+    функциями, что и при обработке запросов, с учётом `SEARCH_BACKEND`.
+
+    :param async_session: сессия поверх прогреваемого соединения.
+    """
+    await get_library_version(async_session, _WARMUP_TG_USER_ID)
+    await UsersCRUD(async_session).resolve_ids([_WARMUP_TG_USER_ID])
+    await get_all_user_tags(async_session, user_id=_WARMUP_USER_ID)
+    await get_user_gifs_batch(async_session, [(_WARMUP_TG_USER_ID, '-')])
+
+    fetch = _fetch_gifs_projection if config.SEARCH_BACKEND == 'projection' else _fetch_gifs_normalized
+    for filters in _WARMUP_SEARCHES:
+        await fetch(async_session, user_id=_WARMUP_USER_ID, **filters)
@@ -1 +1,10 @@
-from .sqlalchemy_helpers import is_valid_column_for_model, get_orm_columns
\ No newline at end of file
+from .sqlalchemy_helpers import is_valid_column_for_model, get_orm_columns, precompile
+from .pagination import encode_cursor, decode_cursor
+from .cache import LRUCache
+from .tag_index import TagIndex, trigrams, similarity
+from .pool import InstrumentedAsyncQueuePool
+from .gif_index import GifIndex
+from .etag import library_etag, etag_matches, not_modified, etag_headers
+from .json_response import FastJSONResponse, json_dumps
+from .single_flight import SingleFlight
+from .group_commit import GroupCommit
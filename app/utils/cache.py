@@ -0,0 +1,139 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру кэш с вытеснением давно неиспользуемых записей (LRU) и временем жизни (TTL).
+
+    Размер ограничивается суммарным «весом» записей: по умолчанию каждая запись весит 1
+    (то есть ограничивается количество записей), а с `weigher` можно ограничить, например,
+    примерный объём занимаемой памяти.
+
+    Кэш рассчитан на использование из одного event loop и не содержит блокировок.
+    Он живёт в памяти процесса, поэтому при нескольких воркерах у каждого свой кэш,
+    а изменения, сделанные другими процессами, видны не позже чем через `ttl` секунд.
+
+    Пример использования:
+
+        cache = LRUCache(max_weight=1000, ttl=60)
+        cache.set('key', 'value')
+        cache.get('key')  # 'value'
+        cache.stats()     # {'hits': 1, 'misses': 0, ...}
+    """
+    def __init__(
+            self,
+            max_weight: int,
+            ttl: float | None = None,
+            weigher: Callable[[Hashable, Any], int] | None = None,
+    ):
+        """
+        :param max_weight: Максимальный суммарный вес записей.
+        :param ttl: Время жизни записи в секундах. Если None — записи не устаревают.
+        :param weigher: Функция (key, value) -> вес записи. Если None — вес каждой записи равен 1.
+        """
+        self.max_weight = max_weight
+        self.ttl = ttl
+        self.weigher = weigher
+        self._data: OrderedDict[Hashable, tuple[Any, float | None, int]] = OrderedDict()
+        self._weight = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    @property
+    def weight(self) -> int:
+        return self._weight
+
+    def get(self, key: Hashable, default: Any = None, *, count: bool = True) -> Any:
+        """
+        Возвращает значение по ключу и отмечает запись как недавно использованную.
+
+        :param key: Ключ записи.
+        :param default: Значение, возвращаемое при промахе.
+        :param count: Учитывать ли обращение в счётчиках попаданий и промахов.
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            value, expires_at, _ = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+
+            self._remove(key)
+            self.expirations += 1
+
+        if count:
+            self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Сохраняет значение и вытесняет давно неиспользуемые записи, если превышен бюджет.
+        Запись тяжелее всего бюджета не сохраняется.
+        """
+        weight = self.weigher(key, value) if self.weigher else 1
+        if key in self._data:
+            self._remove(key)
+        if weight > self.max_weight:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, expires_at, weight)
+        self._weight += weight
+
+        while self._weight > self.max_weight:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """
+        Удаляет запись по ключу.
+
+        :return: True, если запись была в кэше.
+        """
+        if key not in self._data:
+            return False
+
+        self._remove(key)
+        self.invalidations += 1
+        return True
+
+    def clear(self) -> None:
+        """Удаляет все записи, счётчики сохраняются."""
+        self.invalidations += len(self._data)
+        self._data.clear()
+        self._weight = 0
+
+    def stats(self) -> dict[str, int]:
+        """Возвращает текущие размер, вес и счётчики кэша."""
+        return {
+            'entries': len(self._data),
+            'weight': self._weight,
+            'max_weight': self.max_weight,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, weight = self._data.pop(key)
+        self._weight -= weight
+
+
+_MISSING = object()
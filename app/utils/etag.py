@@ -0,0 +1,52 @@
+from starlette.responses import Response
+
+
+# Ответы можно хранить только у клиента и нужно перепроверять перед каждым использованием
+CACHE_CONTROL = 'private, no-cache'
+
+
+def library_etag(user_id: int, library_version: int, variant: str = '') -> str:
+    """
+    Слабый ETag ответа по версии библиотеки пользователя (`users.library_version`).
+
+    В ETag входит и внутренний ID пользователя: у пользователя, удалённого и созданного заново,
+    версия начинается с нуля. `variant` различает представления одного URL (например, NDJSON).
+    Тег слабый: порядок тегов внутри гифки может отличаться между источниками данных.
+    """
+    suffix = f'-{variant}' if variant else ''
+    return f'W/"{user_id}-{library_version}{suffix}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Проверяет заголовок `If-None-Match` по правилам слабого сравнения (RFC 9110, 13.1.2):
+    список ETag через запятую или `*`, префикс `W/` не учитывается.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+
+    opaque = etag.removeprefix('W/')
+    return any(candidate.strip().removeprefix('W/') == opaque for candidate in if_none_match.split(','))
+
+
+def not_modified(if_none_match: str | None, etag: str, vary: str | None = None) -> Response | None:
+    """
+    Ответ 304 Not Modified, если клиент прислал актуальный ETag, иначе None.
+
+    :param if_none_match: значение заголовка `If-None-Match` запроса.
+    :param etag: текущий ETag ресурса.
+    :param vary: значение заголовка `Vary`, если представление зависит от заголовков запроса.
+    """
+    if not etag_matches(if_none_match, etag):
+        return None
+    return Response(status_code=304, headers=etag_headers(etag, vary))
+
+
+def etag_headers(etag: str, vary: str | None = None) -> dict[str, str]:
+    """Заголовки валидации кэша для ответов 200 и 304."""
+    headers = {'ETag': etag, 'Cache-Control': CACHE_CONTROL}
+    if vary:
+        headers['Vary'] = vary
+    return headers
@@ -0,0 +1,183 @@
+import sys
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Sequence
+
+
+class GifIndex:
+    """
+    Инвертированный индекс библиотеки одного пользователя для поиска гифок по тегам в памяти процесса.
+
+    Гифки нумеруются по возрастанию внутреннего ID (порядковый номер — позиция в отсортированном
+    списке ID), для каждого тега хранится битовая маска номеров гифок с этим тегом (Python int
+    как bitset). Порядок битов совпадает с порядком keyset-пагинации `get_user_gifs_with_tags`,
+    поэтому отбор гифок со всеми тегами — побитовое AND масок, а страница после `after_gif_id` —
+    сдвиг маски на номер первой гифки страницы.
+
+    Индекс изменяемый: `set_gif` и `remove_gif` применяют изменения тегов одной гифки без
+    перестроения. Удалённые гифки остаются «дырами» в нумерации (бит сброшен в маске `alive`),
+    гифка с ID меньше последнего перенумеровывает индекс.
+
+    Пример использования:
+
+        index = GifIndex([(1, 'tg-1', ['cat', 'funny']), (2, 'tg-2', ['cat'])])
+        index.search(tags=['cat', 'funny'])  # [{'id': 1, 'tg_gif_id': 'tg-1', 'tags': ['cat', 'funny']}]
+        index.set_gif(3, 'tg-3', ['funny'])
+        index.remove_gif(1)
+    """
+    def __init__(self, gifs: Iterable[tuple[int, str, Iterable[str]]]):
+        """
+        :param gifs: гифки пользователя — тройки (ID гифки, Telegram ID гифки, теги).
+        """
+        # Версия библиотеки пользователя, которой соответствует индекс; ведётся вызывающим кодом
+        self.version: int | None = None
+        self._build(sorted((gif_id, tg_gif_id, tuple(sorted(tags))) for gif_id, tg_gif_id, tags in gifs))
+
+    def __len__(self) -> int:
+        return len(self._by_tg_gif_id)
+
+    def _build(self, gifs: Sequence[tuple[int, str, tuple[str, ...]]]) -> None:
+        # Порядковый номер -> ID гифки (по возрастанию), Telegram ID и теги (None у удалённых)
+        self._gif_ids: list[int] = []
+        self._tg_gif_ids: list[str | None] = []
+        self._tags: list[tuple[str, ...] | None] = []
+        self._by_tg_gif_id: dict[str, int] = {}
+        self._postings: dict[str, int] = {}
+        self._alive = 0
+        for gif_id, tg_gif_id, tags in gifs:
+            self._gif_ids.append(gif_id)
+            self._tg_gif_ids.append(None)
+            self._tags.append(None)
+            self._assign(len(self._gif_ids) - 1, tg_gif_id, tags)
+
+    def _assign(self, ordinal: int, tg_gif_id: str, tags: tuple[str, ...]) -> None:
+        bit = 1 << ordinal
+        for tag in tags:
+            self._postings[tag] = self._postings.get(tag, 0) | bit
+        self._alive |= bit
+        self._tg_gif_ids[ordinal] = tg_gif_id
+        self._tags[ordinal] = tags
+        self._by_tg_gif_id[tg_gif_id] = ordinal
+
+    def _clear(self, ordinal: int) -> None:
+        mask = ~(1 << ordinal)
+        for tag in self._tags[ordinal]:
+            posting = self._postings[tag] & mask
+            if posting:
+                self._postings[tag] = posting
+            else:
+                del self._postings[tag]
+        self._alive &= mask
+        del self._by_tg_gif_id[self._tg_gif_ids[ordinal]]
+        self._tg_gif_ids[ordinal] = None
+        self._tags[ordinal] = None
+
+    def _ordinal(self, gif_id: int) -> int | None:
+        ordinal = bisect_left(self._gif_ids, gif_id)
+        if ordinal < len(self._gif_ids) and self._gif_ids[ordinal] == gif_id:
+            return ordinal
+        return None
+
+    def _live_gifs(self) -> list[tuple[int, str, tuple[str, ...]]]:
+        return [
+            (gif_id, tg_gif_id, tags)
+            for gif_id, tg_gif_id, tags in zip(self._gif_ids, self._tg_gif_ids, self._tags)
+            if tags is not None
+        ]
+
+    def set_gif(self, gif_id: int, tg_gif_id: str, tags: Iterable[str]) -> None:
+        """Заменяет теги гифки (добавляет гифку, если её нет). Пустой набор тегов удаляет гифку."""
+        tags = tuple(sorted(set(tags)))
+        if not tags:
+            self.remove_gif(gif_id)
+            return
+
+        ordinal = self._ordinal(gif_id)
+        if ordinal is None and (not self._gif_ids or gif_id > self._gif_ids[-1]):
+            self._gif_ids.append(gif_id)
+            self._tg_gif_ids.append(None)
+            self._tags.append(None)
+            ordinal = len(self._gif_ids) - 1
+        elif ordinal is None:
+            # Гифка в середине нумерации: проще перенумеровать, чем сдвигать все маски
+            self._build(sorted([*self._live_gifs(), (gif_id, tg_gif_id, tags)]))
+            return
+        elif self._tags[ordinal] is not None:
+            self._clear(ordinal)
+
+        self._assign(ordinal, tg_gif_id, tags)
+
+    def remove_gif(self, gif_id: int) -> bool:
+        """
+        Удаляет гифку из индекса.
+
+        :return: True, если гифка была в индексе.
+        """
+        ordinal = self._ordinal(gif_id)
+        if ordinal is None or self._tags[ordinal] is None:
+            return False
+
+        self._clear(ordinal)
+        # Когда удалённых больше половины, нумерация уплотняется
+        if len(self._by_tg_gif_id) * 2 < len(self._gif_ids):
+            self._build(self._live_gifs())
+        return True
+
+    def search(
+            self,
+            tags: Sequence[str] | None = None,
+            tg_gifs_id: Sequence[str] | None = None,
+            after_gif_id: int | None = None,
+            limit: int | None = None,
+    ) -> list[dict]:
+        """
+        Гифки, у которых есть все `tags`, в порядке возрастания ID — как `get_user_gifs_with_tags`.
+
+        :param tags: теги, которые должны быть у гифки (опционально).
+        :param tg_gifs_id: вернуть только гифки с указанными Telegram ID (опционально).
+        :param after_gif_id: вернуть только гифки с ID больше указанного (опционально).
+        :param limit: максимальное количество гифок (опционально).
+        :return: список {'id', 'tg_gif_id', 'tags'}.
+        """
+        bits = self._alive
+        for tag in set(tags or ()):
+            bits &= self._postings.get(tag, 0)
+            if not bits:
+                return []
+
+        if tg_gifs_id:
+            selected = 0
+            for tg_gif_id in tg_gifs_id:
+                ordinal = self._by_tg_gif_id.get(tg_gif_id)
+                if ordinal is not None:
+                    selected |= 1 << ordinal
+            bits &= selected
+
+        start = bisect_right(self._gif_ids, after_gif_id) if after_gif_id is not None else 0
+        bits >>= start
+
+        # Перебор установленных битов через двоичную запись: str.find работает на C
+        # и не создаёт промежуточных int на каждый бит
+        binary = bin(bits)[:1:-1]
+        result = []
+        position = binary.find('1')
+        while position != -1 and (limit is None or len(result) < limit):
+            ordinal = start + position
+            result.append({
+                'id': self._gif_ids[ordinal],
+                'tg_gif_id': self._tg_gif_ids[ordinal],
+                'tags': list(self._tags[ordinal]),
+            })
+            position = binary.find('1', position + 1)
+        return result
+
+    def size_bytes(self) -> int:
+        """Примерный объём памяти, занимаемый индексом, в байтах (строки гифок и тегов считаются целиком)."""
+        size = sys.getsizeof(self._gif_ids) + sys.getsizeof(self._tg_gif_ids) + sys.getsizeof(self._tags)
+        size += sys.getsizeof(self._by_tg_gif_id) + sys.getsizeof(self._postings) + sys.getsizeof(self._alive)
+        size += len(self._gif_ids) * sys.getsizeof(2 ** 31)
+        for tg_gif_id, tags in zip(self._tg_gif_ids, self._tags):
+            if tags is not None:
+                size += sys.getsizeof(tg_gif_id) + sys.getsizeof(tags)
+        for tag, posting in self._postings.items():
+            size += sys.getsizeof(tag) + sys.getsizeof(posting)
+        return size
@@ -0,0 +1,105 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Sequence
+
+
+class GroupCommit:
+    """
+    Группировка одновременных записей (group commit): элементы, поступившие в течение окна `window`,
+    передаются одним пакетом в `apply_batch`, которая применяет их одной транзакцией.
+
+    Пакеты применяются по одному в порядке поступления элементов, поэтому изменения одного ключа,
+    пришедшие в разные пакеты, применяются в том же порядке. Порядок внутри пакета сохраняется.
+
+    `apply_batch(items)` возвращает список той же длины: None для успешно применённого элемента
+    или исключение, которое получит его вызывающий код. Исключение из самой `apply_batch`
+    получают все элементы пакета.
+
+    Отмена вызывающего кода не отменяет запись: элемент уже поставлен в очередь.
+    Рассчитан на использование из одного event loop и не содержит блокировок.
+
+    Пример использования:
+
+        writes = GroupCommit(apply_batch=save_many, window=0.003, max_batch=500)
+        await writes.submit(item)  # исключение, если элемент не применён
+        await writes.drain()       # при остановке приложения
+    """
+    def __init__(
+            self,
+            apply_batch: Callable[[list[Any]], Awaitable[Sequence[BaseException | None]]],
+            window: float,
+            max_batch: int,
+    ):
+        """
+        :param apply_batch: функция, применяющая пакет элементов.
+        :param window: сколько секунд ждать остальные элементы после первого элемента пакета.
+        :param max_batch: максимальное количество элементов в пакете.
+        """
+        self.apply_batch = apply_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._worker: asyncio.Task | None = None
+
+        self.batches = 0
+        self.items = 0
+        self.failures = 0
+
+    async def submit(self, item: Any) -> None:
+        """Ставит элемент в очередь и ждёт, пока пакет с ним будет применён."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        await asyncio.shield(future)
+
+    async def drain(self) -> None:
+        """Дожидается применения всех элементов, поставленных в очередь."""
+        while self._worker is not None and not self._worker.done():
+            await asyncio.shield(self._worker)
+
+    async def _run(self) -> None:
+        # Окно отсчитывается от первого элемента; элементы, пришедшие за время применения пакета,
+        # уже подождали и применяются следующим пакетом сразу
+        batch = []
+        try:
+            await asyncio.sleep(self.window)
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                await self._apply([item for item, _ in batch], [future for _, future in batch])
+        except asyncio.CancelledError:
+            # Воркер остановлен (например, вместе с event loop): вызывающий код не должен ждать вечно
+            for _, future in (*batch, *self._pending):
+                if not future.done():
+                    future.set_exception(RuntimeError("Group commit worker was cancelled"))
+                    future.exception()
+            self._pending.clear()
+            raise
+
+    async def _apply(self, items: list[Any], futures: list[asyncio.Future]) -> None:
+        self.batches += 1
+        self.items += len(items)
+        try:
+            results = await self.apply_batch(items)
+        except Exception as e:
+            results = [e] * len(items)
+
+        for future, error in zip(futures, results):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                self.failures += 1
+                future.set_exception(error)
+                # Исключение забирается сразу, чтобы не было предупреждения, если вызывающий код отменён
+                future.exception()
+
+    def stats(self) -> dict[str, int]:
+        """Возвращает счётчики пакетов, элементов и ошибок и размер очереди."""
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'failures': self.failures,
+            'pending': len(self._pending),
+        }
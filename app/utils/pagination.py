@@ -0,0 +1,33 @@
+import base64
+import binascii
+import json
+
+
+def encode_cursor(gif_id: int) -> str:
+    """
+    Кодирует позицию keyset-пагинации в непрозрачную для клиента строку.
+
+    :param gif_id: внутренний ID последней гифки на странице.
+    :return: курсор в виде base64url-строки без выравнивания.
+    """
+    raw = json.dumps({'gif_id': gif_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Декодирует курсор, полученный из `encode_cursor`.
+
+    :param cursor: курсор, переданный клиентом.
+    :return: внутренний ID гифки, после которой начинается страница.
+    :raises ValueError: если курсор повреждён или сформирован не сервером.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        gif_id = json.loads(raw)['gif_id']
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise ValueError(f"Некорректный курсор: {cursor!r}")
+
+    if not isinstance(gif_id, int) or isinstance(gif_id, bool):
+        raise ValueError(f"Некорректный курсор: {cursor!r}")
+    return gif_id
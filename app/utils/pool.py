@@ -0,0 +1,78 @@
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """
+    `AsyncAdaptedQueuePool` со счётчиками ожидания соединений.
+
+    Замеряется время получения соединения из пула (`connect`): ожидание свободного
+    соединения, открытие нового при необходимости и pre-ping. По этим данным видно,
+    упираются ли запросы в размер пула.
+
+    Пул используется из одного event loop, поэтому счётчики изменяются без блокировок.
+
+    Пример использования:
+
+        engine = create_async_engine(url, poolclass=InstrumentedAsyncQueuePool, pool_size=10)
+        engine.pool.stats()  # {'checked_out': 0, 'waiting': 0, ...}
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def recreate(self) -> 'InstrumentedAsyncQueuePool':
+        # Пул пересоздаётся при `engine.dispose()`; счётчики переносятся, чтобы не обнулялись метрики
+        pool = super().recreate()
+        pool.checkouts = self.checkouts
+        pool.timeouts = self.timeouts
+        pool.wait_seconds_total = self.wait_seconds_total
+        pool.wait_seconds_max = self.wait_seconds_max
+        return pool
+
+    def connect(self):
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+            elapsed = time.perf_counter() - start
+            self.wait_seconds_total += elapsed
+            self.wait_seconds_max = max(self.wait_seconds_max, elapsed)
+
+        self.checkouts += 1
+        return connection
+
+    def stats(self) -> dict:
+        """
+        Возвращает текущее состояние пула и накопленные счётчики:
+
+        - `pool_size`, `max_overflow`: настроенные размер пула и допустимое превышение;
+        - `checked_out`: соединения, выданные запросам;
+        - `checked_in`: свободные соединения в пуле;
+        - `overflow`: соединения сверх `pool_size` (отрицательное значение — пул ещё не заполнен);
+        - `waiting`: запросы, ожидающие соединение прямо сейчас;
+        - `checkouts`, `timeouts`: количество выданных соединений и отказов по `pool_timeout`;
+        - `wait_seconds_total`, `wait_seconds_max`: суммарное и максимальное время получения соединения.
+        """
+        return {
+            'pool_size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': self.overflow(),
+            'waiting': self.waiting,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_seconds_total': self.wait_seconds_total,
+            'wait_seconds_max': self.wait_seconds_max,
+        }
@@ -0,0 +1,91 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных вызовов (single-flight): пока выполняется вызов с ключом `key`,
+    остальные вызовы с тем же ключом не выполняют его повторно, а ждут его результат.
+
+    Ключи сгруппированы (например, по пользователю): `forget(group)` отвязывает выполняющиеся вызовы
+    группы, и следующие вызовы запускаются заново. Так после изменения данных новые чтения
+    не получают результат запроса, начатого до изменения.
+
+    Результат (или исключение) получают все ожидающие вызовы, поэтому изменять результат нельзя.
+    Если отменён сам выполняющий вызов (например, клиент разорвал соединение), ожидающие
+    не отменяются, а один из них выполняет вызов заново.
+
+    Рассчитан на использование из одного event loop и не содержит блокировок.
+
+    Пример использования:
+
+        flight = SingleFlight()
+        result = await flight.do(tg_user_id, ('tags',), lambda: load_tags(session, tg_user_id))
+        flight.stats()  # {'executions': 1, 'coalesced': 0, 'in_flight': 0}
+    """
+    def __init__(self):
+        self._calls: dict[Hashable, dict[Hashable, asyncio.Future]] = {}
+
+        self.executions = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return sum(len(calls) for calls in self._calls.values())
+
+    async def do(self, group: Hashable, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет `fn()` или дожидается результата уже выполняющегося вызова с тем же ключом.
+
+        :param group: группа ключа, по которой вызовы сбрасываются в `forget`.
+        :param key: ключ вызова внутри группы; должен включать всё, от чего зависит результат.
+        :param fn: функция без аргументов, возвращающая корутину вызова.
+        """
+        while True:
+            future = self._calls.get(group, {}).get(key)
+            if future is None:
+                break
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Отменён выполнявший вызов, а не ожидающий: выполняем вызов сами
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+            self.coalesced += 1
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        # Исключение забирается сразу, чтобы не было предупреждения, если вызов никто не ждал
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        calls = self._calls.setdefault(group, {})
+        calls[key] = future
+        self.executions += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            # После forget здесь может быть уже другой вызов с тем же ключом
+            if calls.get(key) is future:
+                del calls[key]
+                if not calls and self._calls.get(group) is calls:
+                    del self._calls[group]
+
+    def forget(self, group: Hashable) -> None:
+        """Отвязывает выполняющиеся вызовы группы: они завершатся, но новые вызовы их не дождутся."""
+        self._calls.pop(group, None)
+
+    def stats(self) -> dict[str, int]:
+        """Возвращает счётчики выполненных и объединённых вызовов и количество выполняющихся."""
+        return {
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'in_flight': len(self),
+        }
@@ -1,8 +1,15 @@
-from sqlalchemy import inspect
+from sqlalchemy import inspect, text, bindparam, column, TextClause
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlalchemy.sql import Executable
+from sqlalchemy.sql.expression import TextualSelect, SelectBase
 from app.models import Base
 
 
+# Диалект для `precompile`: именованные параметры (`:name`) — формат параметров `text()`
+_NAMED_PARAMS_DIALECT = postgresql.dialect(paramstyle='named')
+
+
 def is_valid_column_for_model(column: InstrumentedAttribute, model: type[Base]) -> bool:
     """
     Проверяет, что переданный ключ является колонкой (атрибутом модели),
@@ -23,3 +30,32 @@ def get_orm_columns(model: type[Base]) -> tuple[InstrumentedAttribute]:
     :return: список колонок модели в формате [Model.col1, Model.col2, ...].
     """
     return tuple(getattr(model, column.key) for column in inspect(model).columns)
+
+
+def precompile(stmt: Executable) -> TextClause | TextualSelect:
+    """
+    Компилирует запрос в текст SQL один раз и возвращает его как `text()` с теми же параметрами
+    и колонками результата.
+
+    Нужно для запросов, которые SQLAlchemy не кэширует: у PostgreSQL-конструкций `insert()`
+    (с `ON CONFLICT`) нет ключа кэша, поэтому они компилируются заново при каждом выполнении.
+    `text()` кэшируется, так что каждое выполнение результата попадает в кэш компиляции.
+
+    Значения передаются только при выполнении, поэтому параметры запроса должны быть заданы
+    через `bindparam`. Параметр-массив задаётся без типа и явно приводится к нему
+    (`cast(bindparam('ids'), ARRAY(Integer))`): у типизированного массива диалект дописывает
+    к параметру `::тип`, который `text()` не разбирает, а без приведения PostgreSQL не выведет тип.
+
+    :param stmt: запрос без значений, подставленных в текст.
+    :return: запрос `text()`; для SELECT и запросов с RETURNING — с колонками результата (`TextualSelect`).
+    """
+    compiled = stmt.compile(dialect=_NAMED_PARAMS_DIALECT)
+    result = text(compiled.string).bindparams(*(
+        bindparam(name, bind.value, type_=bind.type, required=bind.required)
+        for name, bind in compiled.binds.items()
+    ))
+    columns = stmt.selected_columns if isinstance(stmt, SelectBase) else compiled.effective_returning
+    if not columns:
+        return result
+    # Колонки без таблицы: колонки CTE с PostgreSQL-insert() лишили бы и этот запрос ключа кэша
+    return result.columns(*(column(col.name, col.type) for col in columns))
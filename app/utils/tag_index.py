@@ -0,0 +1,166 @@
+import re
+import sys
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+from typing import Iterable
+
+
+# Порог похожести по умолчанию, как `pg_trgm.similarity_threshold`
+DEFAULT_SIMILARITY_THRESHOLD = 0.3
+
+_WORD_SEPARATOR = re.compile(r'[\W_]+')
+
+
+@lru_cache(maxsize=65536)
+def trigrams(text: str) -> frozenset[str]:
+    """
+    Возвращает множество триграмм строки по правилам расширения `pg_trgm`.
+
+    Результат кэшируется: теги общие для всех пользователей, поэтому при перестроении
+    индекса после изменения тегов триграммы заново считаются только для новых тегов.
+
+    Строка приводится к нижнему регистру и разбивается на слова по символам, не являющимся
+    буквами или цифрами. Каждое слово дополняется двумя пробелами в начале и одним в конце,
+    после чего из него берутся все подстроки длиной 3.
+
+    :param text: исходная строка.
+    :return: множество триграмм.
+    """
+    result = set()
+    for word in _WORD_SEPARATOR.split(text.lower()):
+        if not word:
+            continue
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(result)
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    Похожесть двух строк по триграммам, как функция `similarity()` из `pg_trgm`:
+    количество общих триграмм, делённое на количество триграмм в объединении.
+    """
+    a_trigrams, b_trigrams = trigrams(a), trigrams(b)
+    union = len(a_trigrams | b_trigrams)
+    return len(a_trigrams & b_trigrams) / union if union else 0.0
+
+
+class TagIndex:
+    """
+    Индекс тегов одного пользователя для подсказок при вводе.
+
+    Содержит два представления тегов:
+      - отсортированный список тегов в нижнем регистре — поиск по префиксу бинарным поиском;
+      - инвертированный индекс «триграмма -> номера тегов» — нечёткий поиск по похожести,
+        при котором сравниваются только теги, имеющие с запросом хотя бы одну общую триграмму.
+
+    Индекс неизменяемый: при изменении тегов пользователя строится новый.
+
+    Пример использования:
+
+        index = TagIndex(['cat', 'cats', 'dog'])
+        index.suggest('ca')   # ['cat', 'cats']
+        index.suggest('dgo')  # ['dog'] — по похожести
+    """
+    def __init__(self, tags: Iterable[str]):
+        """
+        :param tags: теги пользователя.
+        """
+        self.tags: tuple[str, ...] = tuple(sorted(set(tags), key=lambda tag: (tag.lower(), tag)))
+        self._folded: list[str] = [tag.lower() for tag in self.tags]
+        self._trigram_counts: list[int] = []
+        postings: dict[str, list[int]] = defaultdict(list)
+
+        for position, tag in enumerate(self.tags):
+            tag_trigrams = trigrams(tag)
+            self._trigram_counts.append(len(tag_trigrams))
+            for trigram in tag_trigrams:
+                postings[trigram].append(position)
+        self._postings: dict[str, list[int]] = dict(postings)
+
+        # Оценка считается один раз при построении: индекс не меняется.
+        # Позиции в списках — небольшие int, которые Python переиспользует, поэтому считаются только ссылки.
+        self._size_bytes = (
+            sum(sys.getsizeof(tag) * 2 for tag in self.tags)
+            + sys.getsizeof(self._postings)
+            + len(self._postings) * (sys.getsizeof('abc') + sys.getsizeof([]))
+            + sum(self._trigram_counts) * 8
+            + len(self.tags) * 3 * 8
+        )
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def size_bytes(self) -> int:
+        """Примерный объём памяти, занимаемый индексом, в байтах."""
+        return self._size_bytes
+
+    def prefix(self, query: str, limit: int) -> list[str]:
+        """
+        Возвращает до `limit` тегов, начинающихся с `query` (без учёта регистра), в алфавитном порядке.
+        """
+        query = query.lower()
+        result = []
+        position = bisect_left(self._folded, query)
+        while position < len(self._folded) and len(result) < limit and self._folded[position].startswith(query):
+            result.append(self.tags[position])
+            position += 1
+        return result
+
+    def similar(
+            self,
+            query: str,
+            limit: int,
+            threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+    ) -> list[tuple[str, float]]:
+        """
+        Возвращает до `limit` пар (тег, похожесть) с похожестью не ниже `threshold`,
+        упорядоченных по убыванию похожести, затем по алфавиту.
+        """
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            return []
+
+        shared: dict[int, int] = defaultdict(int)
+        for trigram in query_trigrams:
+            for position in self._postings.get(trigram, ()):
+                shared[position] += 1
+
+        scored = []
+        for position, common in shared.items():
+            score = common / (len(query_trigrams) + self._trigram_counts[position] - common)
+            if score >= threshold:
+                scored.append((-score, self._folded[position], position))
+
+        scored.sort()
+        return [(self.tags[position], -score) for score, _, position in scored[:limit]]
+
+    def suggest(
+            self,
+            query: str,
+            limit: int = 10,
+            threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+    ) -> list[str]:
+        """
+        Подсказки для введённой строки: сначала теги с таким префиксом,
+        затем остальные теги, похожие на запрос по триграммам.
+
+        :param query: введённая пользователем строка.
+        :param limit: максимальное количество подсказок.
+        :param threshold: минимальная похожесть для нечёткого совпадения.
+        :return: список тегов длиной не больше `limit`.
+        """
+        query = query.strip()
+        if not query or limit <= 0:
+            return []
+
+        result = self.prefix(query, limit)
+        if len(result) < limit:
+            seen = set(result)
+            for tag, _ in self.similar(query, limit + len(result), threshold):
+                if tag not in seen:
+                    result.append(tag)
+                    if len(result) == limit:
+                        break
+        return result
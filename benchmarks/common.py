@@ -0,0 +1,177 @@
+"""
+Общие утилиты для бенчмарков: наполнение локальной БД синтетическими данными и замеры времени.
+
+Все синтетические данные помечаются префиксом `BENCH_GIF_PREFIX` у гифок и отрицательными
+Telegram ID у пользователей, поэтому их можно безопасно удалить из рабочей локальной базы
+функцией `cleanup`.
+"""
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+
+BENCH_GIF_PREFIX = 'bench-'
+BENCH_TAG_PREFIX = 'bench-tag-'
+
+
+async def get_asyncpg_connection(conn: AsyncConnection):
+    """
+    Возвращает «сырое» asyncpg-соединение, лежащее под SQLAlchemy-соединением.
+    Нужно для COPY, который SQLAlchemy не поддерживает.
+    """
+    raw = await conn.get_raw_connection()
+    return raw.driver_connection
+
+
+async def seed_library(
+        conn: AsyncConnection,
+        tg_user_id: int,
+        gifs_count: int,
+        tags_per_gif: int = 3,
+        vocabulary_size: int = 50,
+        seed: int = 0,
+        vocabulary: list[str] | None = None,
+) -> None:
+    """
+    Создаёт пользователя с библиотекой из `gifs_count` гифок, у каждой `tags_per_gif` тегов
+    из словаря размером `vocabulary_size`. Данные загружаются через COPY.
+
+    Вместо словаря `bench-tag-<N>` можно передать свой `vocabulary`; такие теги
+    нужно передать и в `cleanup`, если они не начинаются с `BENCH_TAG_PREFIX`.
+    """
+    rnd = random.Random(seed)
+    if vocabulary is None:
+        vocabulary = [f'{BENCH_TAG_PREFIX}{i}' for i in range(vocabulary_size)]
+
+    user_id = (await conn.execute(
+        text('INSERT INTO users (tg_id) VALUES (:tg_id) '
+             'ON CONFLICT (tg_id) DO UPDATE SET tg_id = excluded.tg_id RETURNING id'),
+        {'tg_id': tg_user_id},
+    )).scalar_one()
+    await conn.execute(
+        text('INSERT INTO tags (tag) SELECT unnest(CAST(:tags AS varchar[])) ON CONFLICT DO NOTHING'),
+        {'tags': vocabulary},
+    )
+    tag_ids = dict((await conn.execute(
+        text('SELECT tag, id FROM tags WHERE tag = ANY(CAST(:tags AS varchar[]))'),
+        {'tags': vocabulary},
+    )).all())
+
+    raw = await get_asyncpg_connection(conn)
+    first_gif_id = await raw.fetchval('SELECT COALESCE(MAX(id), 0) + 1 FROM gifs')
+    gif_ids = range(first_gif_id, first_gif_id + gifs_count)
+    await raw.copy_records_to_table(
+        'gifs',
+        records=((gif_id, f'{BENCH_GIF_PREFIX}{tg_user_id}-{gif_id}') for gif_id in gif_ids),
+        columns=('id', 'tg_gif_id'),
+    )
+    await raw.execute("SELECT setval(pg_get_serial_sequence('gifs', 'id'), (SELECT MAX(id) FROM gifs))")
+    await raw.copy_records_to_table(
+        'user_gif_tags',
+        records=(
+            (user_id, gif_id, tag_ids[tag])
+            for gif_id in gif_ids
+            for tag in rnd.sample(vocabulary, tags_per_gif)
+        ),
+        columns=('user_id', 'gif_id', 'tag_id'),
+    )
+
+
+async def cleanup(conn: AsyncConnection, tags: list[str] | None = None) -> None:
+    """
+    Удаляет все синтетические данные бенчмарков.
+
+    :param tags: дополнительные теги без префикса `BENCH_TAG_PREFIX`, созданные бенчмарком.
+                 Удаляются только те из них, которые больше ни с чем не связаны.
+    """
+    await conn.execute(text('DELETE FROM users WHERE tg_id < 0'))
+    await conn.execute(text('DELETE FROM gifs WHERE tg_gif_id LIKE :prefix'), {'prefix': f'{BENCH_GIF_PREFIX}%'})
+    await conn.execute(text('DELETE FROM tags WHERE tag LIKE :prefix'), {'prefix': f'{BENCH_TAG_PREFIX}%'})
+    if tags:
+        await conn.execute(
+            text('DELETE FROM tags WHERE tag = ANY(CAST(:tags AS varchar[])) '
+                 'AND NOT EXISTS (SELECT 1 FROM user_gif_tags WHERE user_gif_tags.tag_id = tags.id)'),
+            {'tags': tags},
+        )
+
+
+async def measure(
+        fn: Callable[[], Awaitable],
+        repeat: int = 20,
+        warmup: int = 2,
+        setup: Callable[[], Awaitable] | None = None,
+) -> dict[str, float]:
+    """
+    Выполняет `fn` `warmup + repeat` раз и возвращает статистику по времени выполнения в миллисекундах.
+
+    :param setup: подготовка перед каждым вызовом `fn` (например, сброс кэша), в замер не входит.
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            await setup()
+        await fn()
+
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            await setup()
+        start = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return summarize(timings)
+
+
+def summarize(timings: list[float]) -> dict[str, float]:
+    """Перцентили и минимум по списку длительностей в миллисекундах."""
+    if not timings:
+        return {}
+    timings = sorted(timings)
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'p99_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 3),
+        'min_ms': round(timings[0], 3),
+    }
+
+
+def git_sha() -> str | None:
+    """Текущий коммит репозитория (с пометкой `-dirty` при незакоммиченных изменениях)."""
+    try:
+        sha = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{sha}-dirty' if dirty.stdout.strip() else sha
+
+
+def write_results(path: str | None, benchmark: str, parameters: dict, results) -> dict:
+    """
+    Сохраняет результаты бенчмарка в JSON вместе с коммитом и временем запуска,
+    чтобы прогоны на разных коммитах можно было сравнивать. Без `path` печатает их в stdout.
+    """
+    payload = {
+        'benchmark': benchmark,
+        'git_sha': git_sha(),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'parameters': parameters,
+        'results': results,
+    }
+    text_payload = json.dumps(payload, indent=2, ensure_ascii=False)
+    if path:
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text_payload + '\n')
+    else:
+        print(text_payload)
+    return payload
@@ -0,0 +1,133 @@
+"""
+Микробенчмарк накладных расходов Python в методах `_BaseCRUD`: процессорное время на вызов.
+
+Каждый метод вызывается на одном соединении внутри транзакции, которая в конце откатывается,
+поэтому данные базы не меняются. Время — `time.process_time`, то есть CPU процесса (построение
+и компиляция запроса, обработка результата, протокол asyncpg), без ожидания ответа PostgreSQL.
+
+Дополнительно считается, сколько выполнений попало в кэш компиляции SQLAlchemy и сколько
+разных текстов SQL отправлено: asyncpg кэширует подготовленные запросы по тексту, поэтому
+текст, зависящий от количества значений, каждый раз подготавливается заново.
+
+    uv run python -m benchmarks.crud_overhead --repeat 2000 --output results/crud_overhead.json
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud import UsersCRUD, GifsCRUD, UserGifTagCRUD
+from app.database import get_engine, dispose_engine
+from app.models import User, UserGifTag
+from benchmarks.common import summarize, write_results, BENCH_GIF_PREFIX
+
+
+BENCH_TG_USER_ID = -900001
+
+
+def make_scenarios(session: AsyncSession, rnd: random.Random) -> dict:
+    """Сценарии: (подготовка без замера или None, замеряемый вызов)."""
+    gif_keys = [f'{BENCH_GIF_PREFIX}crud-{i}' for i in range(50)]
+    state = {}
+
+    async def forget():
+        UsersCRUD(session).forget_ids()
+        GifsCRUD(session).forget_ids()
+
+    async def create_user():
+        row = await UsersCRUD(session).create_user(BENCH_TG_USER_ID)
+        state['user_id'] = row.id
+
+    async def resolve_one():
+        await UsersCRUD(session).resolve_ids([BENCH_TG_USER_ID])
+
+    async def resolve_many_create():
+        await GifsCRUD(session).resolve_ids(rnd.sample(gif_keys, rnd.randint(1, 20)), create=True)
+
+    async def get_instances():
+        await UsersCRUD(session).get_instances(filters={User.tg_id: BENCH_TG_USER_ID})
+
+    async def update_instance():
+        await UsersCRUD(session).update_instance(state['user_id'], {User.library_version: 0})
+
+    async def delete_instances():
+        await UserGifTagCRUD(session).delete_instances(filters={
+            UserGifTag.user_id: state['user_id'],
+            UserGifTag.gif_id: 0,
+        })
+
+    async def delete_gif_by_pk():
+        await GifsCRUD(session).delete_instances(0)
+
+    return {
+        'create_instance': (None, create_user),
+        'resolve_ids_one_key_miss': (forget, resolve_one),
+        'resolve_ids_1_20_keys_create_miss': (forget, resolve_many_create),
+        'get_instances_filter': (None, get_instances),
+        'update_instance_pk': (None, update_instance),
+        'delete_instances_filters': (None, delete_instances),
+        'delete_instances_pk': (None, delete_gif_by_pk),
+    }
+
+
+async def main(repeat: int, output: str | None) -> None:
+    engine = get_engine()
+    executions = Counter()
+    statements = set()
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        executions[str(context.cache_hit)] += 1
+        statements.add(statement)
+
+    results = {}
+    try:
+        async with engine.connect() as conn:
+            transaction = await conn.begin()
+            try:
+                session = AsyncSession(bind=conn)
+                scenarios = make_scenarios(session, random.Random(0))
+                for name, (setup, fn) in scenarios.items():
+                    for _ in range(20):
+                        if setup is not None:
+                            await setup()
+                        await fn()
+
+                    executions.clear()
+                    statements.clear()
+                    event.listen(engine.sync_engine, 'before_cursor_execute', on_execute)
+                    timings = []
+                    for _ in range(repeat):
+                        if setup is not None:
+                            await setup()
+                        start = time.process_time()
+                        await fn()
+                        timings.append((time.process_time() - start) * 1000)
+                    event.remove(engine.sync_engine, 'before_cursor_execute', on_execute)
+
+                    results[name] = {
+                        **summarize(timings),
+                        'mean_ms': round(sum(timings) / len(timings), 4),
+                        'compiled_cache': dict(executions),
+                        'distinct_sql': len(statements),
+                    }
+                    print(f"{name:<36} p50={results[name]['p50_ms']:.3f} ms CPU, "
+                          f"mean={results[name]['mean_ms']:.4f} ms, cache={dict(executions)}, "
+                          f"distinct SQL={len(statements)}")
+            finally:
+                await transaction.rollback()
+    finally:
+        await dispose_engine()
+
+    write_results(output, 'crud_overhead', {'repeat': repeat}, results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--output', help='файл для результатов в формате JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+    asyncio.run(main(args.repeat, args.output))
@@ -0,0 +1,175 @@
+"""
+Генератор синтетического набора данных для бенчмарков и нагрузочного теста.
+
+Распределения приближены к реальному боту:
+    - размер библиотеки пользователя подчиняется степенному закону (распределение Парето):
+      у большинства пользователей десятки гифок, у единиц — десятки тысяч;
+    - популярность тегов подчиняется закону Ципфа: несколько тегов встречаются почти везде,
+      длинный хвост — редко;
+    - часть гифок общая: популярные гифки сохраняют многие пользователи.
+
+Пользователи получают отрицательные Telegram ID, гифки и теги — префиксы `BENCH_GIF_PREFIX`
+и `BENCH_TAG_PREFIX`, поэтому набор удаляется функцией `cleanup` из `benchmarks/common.py`.
+Данные загружаются через COPY.
+
+Запуск (нужна локальная БД с применёнными миграциями и заполненный `.env`):
+
+    uv run python -m benchmarks.dataset --users 2000 --seed 1
+    uv run python -m benchmarks.dataset --cleanup
+"""
+import argparse
+import asyncio
+import itertools
+import random
+from dataclasses import dataclass, asdict
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.database import get_engine, dispose_engine
+from benchmarks.common import get_asyncpg_connection, cleanup, BENCH_GIF_PREFIX, BENCH_TAG_PREFIX
+
+
+@dataclass
+class DatasetConfig:
+    users: int = 1000
+    # Показатель степени распределения Парето: чем меньше, тем тяжелее хвост больших библиотек
+    alpha: float = 1.2
+    min_gifs: int = 5
+    max_gifs: int = 50_000
+    vocabulary_size: int = 2_000
+    # Показатель закона Ципфа для популярности тегов
+    zipf_exponent: float = 1.1
+    min_tags_per_gif: int = 1
+    max_tags_per_gif: int = 6
+    # Доля гифок библиотеки, взятых из общего пула популярных гифок
+    shared_ratio: float = 0.2
+    shared_pool_size: int = 10_000
+    seed: int = 0
+
+
+def library_sizes(config: DatasetConfig, rnd: random.Random) -> list[int]:
+    """Размеры библиотек пользователей по распределению Парето, ограниченные `max_gifs`."""
+    return [
+        min(config.max_gifs, int(config.min_gifs * rnd.paretovariate(config.alpha)))
+        for _ in range(config.users)
+    ]
+
+
+def zipf_weights(size: int, exponent: float) -> list[float]:
+    """Накопленные веса закона Ципфа для `random.choices(cum_weights=...)`."""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+async def generate_dataset(conn: AsyncConnection, config: DatasetConfig) -> dict:
+    """
+    Заполняет БД набором данных по `config` и возвращает сводку (количество строк, размеры библиотек).
+
+    Предыдущие синтетические данные удаляются.
+    """
+    rnd = random.Random(config.seed)
+    await cleanup(conn)
+    raw = await get_asyncpg_connection(conn)
+
+    vocabulary = [f'{BENCH_TAG_PREFIX}{i}' for i in range(config.vocabulary_size)]
+    tag_weights = zipf_weights(config.vocabulary_size, config.zipf_exponent)
+    await raw.execute('INSERT INTO tags (tag) SELECT unnest($1::varchar[]) ON CONFLICT DO NOTHING', vocabulary)
+    tag_ids = dict(await raw.fetch('SELECT tag, id FROM tags WHERE tag = ANY($1::varchar[])', vocabulary))
+    vocabulary_ids = [tag_ids[tag] for tag in vocabulary]
+
+    tg_ids = [-(i + 1) for i in range(config.users)]
+    user_ids = [row['id'] for row in await raw.fetch(
+        'INSERT INTO users (tg_id) SELECT unnest($1::bigint[]) RETURNING id', tg_ids,
+    )]
+
+    next_gif_id = await raw.fetchval('SELECT COALESCE(MAX(id), 0) + 1 FROM gifs')
+    shared_gifs = range(next_gif_id, next_gif_id + config.shared_pool_size)
+    shared_weights = zipf_weights(config.shared_pool_size, config.zipf_exponent)
+    next_gif_id += config.shared_pool_size
+
+    sizes = library_sizes(config, rnd)
+    gif_rows = [(gif_id, f'{BENCH_GIF_PREFIX}shared-{gif_id}') for gif_id in shared_gifs]
+    link_rows = []
+    for user_id, size in zip(user_ids, sizes):
+        shared = set(rnd.choices(shared_gifs, cum_weights=shared_weights, k=int(size * config.shared_ratio)))
+        own = range(next_gif_id, next_gif_id + size - len(shared))
+        next_gif_id += len(own)
+        gif_rows.extend((gif_id, f'{BENCH_GIF_PREFIX}{user_id}-{gif_id}') for gif_id in own)
+
+        for gif_id in itertools.chain(shared, own):
+            tags_count = rnd.randint(config.min_tags_per_gif, config.max_tags_per_gif)
+            tags = set(rnd.choices(vocabulary_ids, cum_weights=tag_weights, k=tags_count))
+            link_rows.extend((user_id, gif_id, tag_id) for tag_id in tags)
+
+    await raw.copy_records_to_table('gifs', records=gif_rows, columns=('id', 'tg_gif_id'))
+    await raw.execute("SELECT setval(pg_get_serial_sequence('gifs', 'id'), (SELECT MAX(id) FROM gifs))")
+    await raw.copy_records_to_table('user_gif_tags', records=link_rows, columns=('user_id', 'gif_id', 'tag_id'))
+    await conn.execute(text('ANALYZE'))
+
+    sorted_sizes = sorted(sizes)
+    return {
+        'config': asdict(config),
+        'users': len(user_ids),
+        'gifs': len(gif_rows),
+        'links': len(link_rows),
+        'library_size': {
+            'p50': sorted_sizes[len(sorted_sizes) // 2],
+            'p99': sorted_sizes[min(len(sorted_sizes) - 1, int(len(sorted_sizes) * 0.99))],
+            'max': sorted_sizes[-1],
+        },
+    }
+
+
+async def dataset_users(conn: AsyncConnection) -> list[tuple[int, int]]:
+    """Пользователи синтетического набора: список (Telegram ID, размер библиотеки) по возрастанию размера."""
+    rows = await conn.execute(text(
+        'SELECT users.tg_id, count(DISTINCT user_gif_tags.gif_id) AS gifs '
+        'FROM users JOIN user_gif_tags ON user_gif_tags.user_id = users.id '
+        'WHERE users.tg_id < 0 GROUP BY users.tg_id ORDER BY gifs, users.tg_id'
+    ))
+    return [(row.tg_id, row.gifs) for row in rows]
+
+
+def pick_users_by_size(users: list[tuple[int, int]], quantiles=(0.5, 0.9, 0.99, 1.0)) -> dict[str, tuple[int, int]]:
+    """Пользователи с размером библиотеки на заданных квантилях: {'p50': (tg_id, gifs), ...}."""
+    picked = {}
+    for quantile in quantiles:
+        name = 'max' if quantile == 1.0 else f'p{int(quantile * 100)}'
+        picked[name] = users[min(len(users) - 1, int(len(users) * quantile))]
+    return picked
+
+
+async def main(config: DatasetConfig, only_cleanup: bool) -> None:
+    try:
+        async with get_engine().begin() as conn:
+            if only_cleanup:
+                await cleanup(conn)
+                print('Синтетические данные удалены')
+                return
+            summary = await generate_dataset(conn, config)
+    finally:
+        await dispose_engine()
+
+    print(f"{summary['users']} пользователей, {summary['gifs']} гифок, {summary['links']} связей; "
+          f"библиотека p50 {summary['library_size']['p50']}, p99 {summary['library_size']['p99']}, "
+          f"max {summary['library_size']['max']}")
+
+
+if __name__ == '__main__':
+    defaults = DatasetConfig()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=defaults.users)
+    parser.add_argument('--alpha', type=float, default=defaults.alpha, help='показатель распределения Парето')
+    parser.add_argument('--min-gifs', type=int, default=defaults.min_gifs)
+    parser.add_argument('--max-gifs', type=int, default=defaults.max_gifs)
+    parser.add_argument('--vocabulary-size', type=int, default=defaults.vocabulary_size)
+    parser.add_argument('--zipf-exponent', type=float, default=defaults.zipf_exponent)
+    parser.add_argument('--min-tags-per-gif', type=int, default=defaults.min_tags_per_gif)
+    parser.add_argument('--max-tags-per-gif', type=int, default=defaults.max_tags_per_gif)
+    parser.add_argument('--shared-ratio', type=float, default=defaults.shared_ratio)
+    parser.add_argument('--shared-pool-size', type=int, default=defaults.shared_pool_size)
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    parser.add_argument('--cleanup', action='store_true', help='только удалить синтетические данные')
+    args = parser.parse_args()
+    only_cleanup = args.__dict__.pop('cleanup')
+    asyncio.run(main(DatasetConfig(**vars(args)), only_cleanup))
@@ -0,0 +1,154 @@
+"""
+Отчёт о планах выполнения запросов сервисов из `app/services/user_services.py`.
+
+Скрипт наполняет локальную БД синтетическими данными, вызывает каждую функцию сервиса,
+перехватывает реально отправленные ею SQL-запросы с параметрами и выполняет для каждого
+`EXPLAIN (ANALYZE, BUFFERS)` в транзакции, которая затем откатывается. Так выбор индексов
+проверяется на тех запросах, которые выполняет приложение, а не на их ручных копиях.
+
+Последовательное чтение `user_gif_tags` (Seq Scan) помечается в отчёте отдельно.
+
+Запуск (нужна локальная БД с применёнными миграциями и заполненный `.env`):
+
+    uv run python -m benchmarks.explain_queries --gifs 50000 --output explain.md
+"""
+import argparse
+import asyncio
+from contextlib import contextmanager
+from typing import AsyncIterator
+
+from sqlalchemy import event, text
+
+from app.database import get_engine, dispose_engine, AsyncSessionLocal
+from app.crud import UsersCRUD, GifsCRUD, TagsCRUD
+from app.services import (
+    get_user_gifs_with_tags,
+    stream_user_gifs_with_tags,
+    get_all_user_tags,
+    set_new_user_tags_on_gif,
+    delete_user_gif_tags,
+)
+from app.services.user_services import user_tags_cache
+from benchmarks.common import seed_library, cleanup, BENCH_TAG_PREFIX, BENCH_GIF_PREFIX
+
+
+TG_USER_ID = -1
+
+
+@contextmanager
+def capture_statements():
+    """Собирает все SQL-запросы (текст и параметры), выполненные внутри блока."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(get_engine().sync_engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(get_engine().sync_engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def forget_identities():
+    """Сбрасывает кэши, чтобы в отчёт попали и запросы, которые обычно обслуживаются из кэша."""
+    user_tags_cache.clear()
+    for crud in (UsersCRUD, GifsCRUD, TagsCRUD):
+        crud.identity_map.clear()
+
+
+async def collect(gif_in_library: str) -> AsyncIterator[tuple[str, list[tuple[str, tuple]]]]:
+    """
+    Вызывает функции сервиса по очереди и отдаёт пары (сценарий, [(запрос, параметры), ...]).
+
+    Следующий сценарий запускается только после обработки предыдущего, поэтому запросы
+    можно разбирать на тех же данных, на которых они выполнялись (например, до удаления тегов).
+    """
+    search_tags = [f'{BENCH_TAG_PREFIX}0', f'{BENCH_TAG_PREFIX}1']
+    scenarios = {
+        'get_user_gifs_with_tags: вся библиотека':
+            lambda s: get_user_gifs_with_tags(s, tg_user_id=TG_USER_ID),
+        'get_user_gifs_with_tags: поиск по двум тегам':
+            lambda s: get_user_gifs_with_tags(s, tg_user_id=TG_USER_ID, tags=search_tags),
+        'get_user_gifs_with_tags: страница из 50 гифок':
+            lambda s: get_user_gifs_with_tags(s, tg_user_id=TG_USER_ID, limit=50, after_gif_id=0),
+        'get_user_gifs_with_tags: одна гифка':
+            lambda s: get_user_gifs_with_tags(s, tg_user_id=TG_USER_ID, tg_gifs_id=gif_in_library),
+        'stream_user_gifs_with_tags: поиск по двум тегам':
+            lambda s: _drain(stream_user_gifs_with_tags(s, tg_user_id=TG_USER_ID, tags=search_tags)),
+        'get_all_user_tags':
+            lambda s: get_all_user_tags(s, tg_user_id=TG_USER_ID),
+        'set_new_user_tags_on_gif':
+            lambda s: set_new_user_tags_on_gif(s, TG_USER_ID, gif_in_library, [f'{BENCH_TAG_PREFIX}new', *search_tags]),
+        'delete_user_gif_tags':
+            lambda s: delete_user_gif_tags(s, TG_USER_ID, gif_in_library),
+    }
+
+    async with AsyncSessionLocal() as session:
+        for name, scenario in scenarios.items():
+            forget_identities()
+            with capture_statements() as statements:
+                await scenario(session)
+            # Сценарий не должен держать открытую транзакцию, пока его запросы разбираются
+            await session.commit()
+            yield name, statements
+
+
+async def _drain(iterator):
+    async for _ in iterator:
+        pass
+
+
+async def explain(statement: str, parameters) -> str:
+    """Выполняет EXPLAIN (ANALYZE, BUFFERS) запроса в откатываемой транзакции."""
+    async with get_engine().connect() as conn:
+        transaction = await conn.begin()
+        try:
+            result = await conn.exec_driver_sql(f'EXPLAIN (ANALYZE, BUFFERS) {statement}', parameters)
+            return '\n'.join(row[0] for row in result)
+        finally:
+            await transaction.rollback()
+
+
+async def main(gifs: int, other_users: int, output: str | None) -> None:
+    async with get_engine().begin() as conn:
+        await cleanup(conn)
+        await seed_library(conn, tg_user_id=TG_USER_ID, gifs_count=gifs)
+        # Другие пользователи нужны, чтобы статистика таблиц была похожа на рабочую
+        for i in range(other_users):
+            await seed_library(conn, tg_user_id=TG_USER_ID - i - 1, gifs_count=max(gifs // 10, 1), seed=i + 1)
+        await conn.execute(text('ANALYZE'))
+        gif_in_library = (await conn.execute(
+            text('SELECT tg_gif_id FROM gifs WHERE tg_gif_id LIKE :prefix ORDER BY id LIMIT 1'),
+            {'prefix': f'{BENCH_GIF_PREFIX}{TG_USER_ID}-%'},
+        )).scalar_one()
+
+    lines = [f'# EXPLAIN (ANALYZE, BUFFERS): {gifs} гифок у пользователя, ещё {other_users} пользователей\n']
+    try:
+        async for name, statements in collect(gif_in_library):
+            for statement, parameters in statements:
+                if not statement.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')):
+                    continue
+                plan = await explain(statement, parameters)
+                warning = ' — **Seq Scan по user_gif_tags**' if 'Seq Scan on user_gif_tags' in plan else ''
+                lines.append(f'## {name}{warning}\n\n```sql\n{statement.strip()}\n```\n\n```\n{plan}\n```\n')
+    finally:
+        async with get_engine().begin() as conn:
+            await cleanup(conn)
+        await dispose_engine()
+
+    report = '\n'.join(lines)
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gifs', type=int, default=50_000, help='размер библиотеки исследуемого пользователя')
+    parser.add_argument('--other-users', type=int, default=20, help='количество других пользователей')
+    parser.add_argument('--output', help='файл для отчёта в формате Markdown (по умолчанию stdout)')
+    args = parser.parse_args()
+    asyncio.run(main(args.gifs, args.other_users, args.output))
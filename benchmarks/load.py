@@ -0,0 +1,285 @@
+"""
+Нагрузочный тест HTTP API на синтетическом наборе данных.
+
+`concurrency` клиентов с keep-alive соединениями в течение `duration` секунд отправляют запросы
+в пропорциях, близких к трафику бота (см. `DEFAULT_MIX`): в основном поиск и чтение тегов,
+меньше — изменение и удаление тегов гифок. Для каждой операции считаются количество запросов,
+коды ответов и перцентили времени ответа, для всего теста — пропускная способность.
+
+HTTP-клиент минимальный (HTTP/1.1 поверх asyncio streams), чтобы не добавлять зависимостей
+и не тратить время клиента на лишнюю работу.
+
+С `--conditional` клиенты, как бот, запоминают ETag ответов на GET и повторяют запросы
+с `If-None-Match`: неизменившиеся ресурсы отвечают 304 без выполнения запроса к данным.
+
+Сначала нужно сгенерировать набор данных и запустить API:
+
+    uv run python -m benchmarks.dataset --users 2000
+    uv run uvicorn app.main:app --workers 4
+    uv run python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 32 --duration 30 \\
+        --output results/load.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit, urlencode, quote
+
+from sqlalchemy import text
+
+from app.database import get_engine, dispose_engine
+from benchmarks.common import summarize, write_results, BENCH_GIF_PREFIX, BENCH_TAG_PREFIX
+from benchmarks.dataset import dataset_users
+
+
+DEFAULT_MIX = {
+    'search_page': 35,
+    'search_tag': 20,
+    'search_all': 5,
+    'get_gif': 15,
+    'tags': 10,
+    'suggest': 5,
+    'put_gif': 7,
+    'delete_gif': 3,
+}
+SAMPLE_GIFS = 5000
+
+
+class HttpConnection:
+    """Одно keep-alive соединение HTTP/1.1: последовательные запросы, ответы с Content-Length или chunked."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def request(
+            self,
+            method: str,
+            path: str,
+            body: bytes | None = None,
+            headers: dict[str, str] | None = None,
+    ) -> tuple[int, dict[str, str], bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        head = f'{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+        for name, value in (headers or {}).items():
+            head += f'{name}: {value}\r\n'
+        if body is not None:
+            head += f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+        self.writer.write(head.encode() + b'\r\n' + (body or b''))
+
+        try:
+            status, response_headers = await self._read_head()
+            if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+                payload = await self._read_chunked()
+            else:
+                payload = await self.reader.readexactly(int(response_headers.get('content-length', 0)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await self.close()
+            raise
+
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, response_headers, payload
+
+    async def _read_head(self) -> tuple[int, dict[str, str]]:
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by server')
+        status = int(status_line.split(b' ', 2)[1])
+        headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
+
+    async def _read_chunked(self) -> bytes:
+        chunks = []
+        while True:
+            size = int((await self.reader.readline()).split(b';', 1)[0], 16)
+            if size == 0:
+                await self.reader.readline()
+                return b''.join(chunks)
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readline()
+
+
+class Workload:
+    """Выбор следующего запроса по пропорциям операций и данным синтетического набора."""
+
+    def __init__(self, users: list[int], gifs: list[tuple[int, str, list[str]]], mix: dict[str, int], seed: int):
+        self.rnd = random.Random(seed)
+        self.users = users
+        self.gifs = gifs
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        # Гифки, созданные тестом: их и удаляет операция delete_gif
+        self.created: list[tuple[int, str]] = []
+        self.counter = 0
+
+    def next_request(self) -> tuple[str, str, str, bytes | None]:
+        """Возвращает (операция, метод, путь, тело)."""
+        operation = self.rnd.choices(self.operations, self.weights)[0]
+        tg_user_id, tg_gif_id, tags = self.rnd.choice(self.gifs)
+
+        if operation == 'search_page':
+            return operation, 'GET', '/search?' + urlencode({'tg_user_id': tg_user_id, 'limit': 50}), None
+        if operation == 'search_tag':
+            query = urlencode({'tg_user_id': tg_user_id, 'tags': self.rnd.choice(tags), 'limit': 50})
+            return operation, 'GET', '/search?' + query, None
+        if operation == 'search_all':
+            return operation, 'GET', '/search?' + urlencode({'tg_user_id': tg_user_id}), None
+        if operation == 'get_gif':
+            return operation, 'GET', f'/user/{tg_user_id}/gif/{quote(tg_gif_id)}', None
+        if operation == 'tags':
+            return operation, 'GET', f'/user/{tg_user_id}/tags', None
+        if operation == 'suggest':
+            prefix = self.rnd.choice(tags)[:len(BENCH_TAG_PREFIX) + 1]
+            return operation, 'GET', f'/user/{tg_user_id}/tags/suggest?' + urlencode({'q': prefix}), None
+        if operation == 'delete_gif' and self.created:
+            tg_user_id, tg_gif_id = self.created.pop(self.rnd.randrange(len(self.created)))
+            return operation, 'DELETE', f'/user/{tg_user_id}/gif/{quote(tg_gif_id)}', None
+
+        # put_gif (и delete_gif, пока удалять нечего): новая гифка или новые теги существующей
+        if self.rnd.random() < 0.5:
+            self.counter += 1
+            tg_user_id = self.rnd.choice(self.users)
+            tg_gif_id = f'{BENCH_GIF_PREFIX}load-{id(self)}-{self.counter}'
+            self.created.append((tg_user_id, tg_gif_id))
+        new_tags = [*tags[:2], f'{BENCH_TAG_PREFIX}{self.rnd.randrange(100)}']
+        body = json.dumps({'tags': new_tags}).encode()
+        return 'put_gif', 'PUT', f'/user/{tg_user_id}/gif/{quote(tg_gif_id)}', body
+
+
+async def load_workload_data(seed: int) -> tuple[list[int], list[tuple[int, str, list[str]]]]:
+    """Пользователи и случайная выборка гифок (с тегами) синтетического набора."""
+    async with get_engine().connect() as conn:
+        users = [tg_user_id for tg_user_id, _ in await dataset_users(conn)]
+        await conn.execute(text('SELECT setseed(:seed)'), {'seed': (seed % 1000) / 1000})
+        rows = (await conn.execute(text(
+            'SELECT users.tg_id, gifs.tg_gif_id, array_agg(tags.tag) AS tags '
+            'FROM user_gif_tags '
+            'JOIN users ON users.id = user_gif_tags.user_id '
+            'JOIN gifs ON gifs.id = user_gif_tags.gif_id '
+            'JOIN tags ON tags.id = user_gif_tags.tag_id '
+            'WHERE users.tg_id < 0 '
+            'GROUP BY users.tg_id, gifs.tg_gif_id ORDER BY random() LIMIT :limit'
+        ), {'limit': SAMPLE_GIFS})).all()
+    await dispose_engine()
+    return users, [(row.tg_id, row.tg_gif_id, list(row.tags)) for row in rows]
+
+
+async def run_load(
+        url: str,
+        concurrency: int,
+        duration: float,
+        warmup: float,
+        mix: dict[str, int],
+        seed: int,
+        conditional: bool = False,
+) -> dict:
+    users, gifs = await load_workload_data(seed)
+    if not gifs:
+        raise SystemExit('Нет синтетических данных: сначала запустите python -m benchmarks.dataset')
+
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    timings: dict[str, list[float]] = defaultdict(list)
+    statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    errors: dict[str, int] = defaultdict(int)
+
+    start = time.perf_counter()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    async def client(number: int):
+        connection = HttpConnection(host, port)
+        workload = Workload(users, gifs, mix, seed + number)
+        # ETag последних ответов на GET по пути запроса
+        etags: dict[str, str] = {}
+        try:
+            while (now := time.perf_counter()) < deadline:
+                operation, method, path, body = workload.next_request()
+                headers = {'If-None-Match': etags[path]} if conditional and path in etags else None
+                try:
+                    status, response_headers, _ = await connection.request(method, path, body, headers)
+                except (OSError, asyncio.IncompleteReadError):
+                    if now >= measure_from:
+                        errors[operation] += 1
+                    continue
+                if conditional and method == 'GET' and 'etag' in response_headers:
+                    etags[path] = response_headers['etag']
+                if now >= measure_from:
+                    timings[operation].append((time.perf_counter() - now) * 1000)
+                    statuses[operation][status] += 1
+        finally:
+            await connection.close()
+
+    await asyncio.gather(*(client(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - measure_from
+
+    total = sum(len(values) for values in timings.values())
+    return {
+        'requests': total,
+        'errors': sum(errors.values()),
+        'throughput_rps': round(total / elapsed, 1),
+        'latency': summarize([value for values in timings.values() for value in values]),
+        'operations': {
+            operation: {
+                'requests': len(timings[operation]),
+                'errors': errors[operation],
+                'statuses': dict(statuses[operation]),
+                **summarize(timings[operation]),
+            }
+            for operation in mix if timings[operation] or errors[operation]
+        },
+    }
+
+
+async def main(args) -> None:
+    mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+    results = await run_load(
+        args.url, args.concurrency, args.duration, args.warmup, mix, args.seed, conditional=args.conditional,
+    )
+
+    print(f"{results['requests']} запросов, {results['throughput_rps']} rps, ошибок {results['errors']}; "
+          f"p50 {results['latency']['p50_ms']} ms, p95 {results['latency']['p95_ms']} ms, "
+          f"p99 {results['latency']['p99_ms']} ms")
+    for operation, stats in results['operations'].items():
+        print(f"  {operation:<12} {stats['requests']:>7}  p50 {stats['p50_ms']:>8.2f}  p95 {stats['p95_ms']:>8.2f}  "
+              f"p99 {stats['p99_ms']:>8.2f} ms  {stats['statuses']}")
+
+    parameters = {
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'mix': mix,
+        'seed': args.seed,
+        'conditional': args.conditional,
+    }
+    write_results(args.output, 'load', parameters, results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='длительность замера в секундах')
+    parser.add_argument('--warmup', type=float, default=3, help='прогрев перед замером в секундах')
+    parser.add_argument('--mix', help='пропорции операций в JSON, например {"search_page": 1, "tags": 1}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--conditional', action='store_true', help='повторять GET с If-None-Match')
+    parser.add_argument('--output', help='файл для результатов в формате JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,80 @@
+"""
+Бенчмарк поиска гифок по тегам (`get_user_gifs_with_tags`) в зависимости от размера библиотеки.
+
+Сравниваются два варианта:
+    - sql: текущая реализация, отбор гифок со всеми тегами выполняется в PostgreSQL;
+    - python: прежняя реализация, вся библиотека загружается и фильтруется в Python.
+
+Запуск (нужна локальная БД с применёнными миграциями и заполненный `.env`):
+
+    uv run python -m benchmarks.search_latency --sizes 100 1000 10000 50000
+"""
+import argparse
+import asyncio
+import json
+
+from sqlalchemy import select, text
+
+from app.database import get_engine, dispose_engine, AsyncSessionLocal
+from app.models import UserGifTag, User, Gif, Tag
+from app.services import get_user_gifs_with_tags
+from benchmarks.common import seed_library, cleanup, measure, BENCH_TAG_PREFIX
+
+
+SEARCH_TAGS = [f'{BENCH_TAG_PREFIX}0', f'{BENCH_TAG_PREFIX}1']
+
+
+async def python_side_search(async_session, tg_user_id: int, tags: list[str]):
+    """Прежний вариант поиска: все строки пользователя, фильтрация по тегам в Python."""
+    stmt = (
+        select(UserGifTag.user_id, UserGifTag.gif_id, User.tg_id, Gif.tg_gif_id, Tag.tag)
+        .select_from(UserGifTag)
+        .join(User, UserGifTag.user_id == User.id)
+        .join(Gif, UserGifTag.gif_id == Gif.id)
+        .join(Tag, UserGifTag.tag_id == Tag.id)
+        .where(User.tg_id == tg_user_id)
+    )
+    rows = (await async_session.execute(stmt)).all()
+    gifs_map: dict[int, dict] = {}
+    for row in rows:
+        gifs_map.setdefault(row.gif_id, {'id': row.gif_id, 'tg_gif_id': row.tg_gif_id, 'tags': []})['tags'].append(row.tag)
+    tags_set = set(tags)
+    return [gif for gif in gifs_map.values() if tags_set.issubset(gif['tags'])]
+
+
+async def main(sizes: list[int], repeat: int) -> None:
+    results = []
+    async with get_engine().begin() as conn:
+        await cleanup(conn)
+        for i, size in enumerate(sizes):
+            await seed_library(conn, tg_user_id=-(i + 1), gifs_count=size, seed=i)
+        await conn.execute(text('ANALYZE'))
+
+    try:
+        async with AsyncSessionLocal() as session:
+            for i, size in enumerate(sizes):
+                tg_user_id = -(i + 1)
+                found = len((await get_user_gifs_with_tags(session, tg_user_id=tg_user_id, tags=SEARCH_TAGS))['gifs_data'])
+                sql = await measure(
+                    lambda: get_user_gifs_with_tags(session, tg_user_id=tg_user_id, tags=SEARCH_TAGS), repeat=repeat,
+                )
+                python = await measure(
+                    lambda: python_side_search(session, tg_user_id=tg_user_id, tags=SEARCH_TAGS), repeat=repeat,
+                )
+                results.append({'library_size': size, 'found': found, 'sql': sql, 'python': python})
+                print(f'{size:>8} gifs, {found:>6} found: '
+                      f'sql p50 {sql["p50_ms"]:>9.2f} ms | python p50 {python["p50_ms"]:>9.2f} ms')
+    finally:
+        async with get_engine().begin() as conn:
+            await cleanup(conn)
+        await dispose_engine()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1_000, 10_000, 50_000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.repeat))
@@ -0,0 +1,130 @@
+"""
+Бенчмарк сериализации ответа поиска: процессорное время на запрос в зависимости от размера ответа.
+
+Сравниваются два варианта эндпоинта с одинаковой схемой OpenAPI (`response_model=SearchOut`):
+    - response_model: эндпоинт возвращает dict, FastAPI проверяет его по `SearchOut`
+      и сериализует заново (прежний путь);
+    - fast: эндпоинт возвращает `FastJSONResponse`, данные сериализуются сразу в байты.
+
+Эндпоинты вызываются напрямую через ASGI, без сети и без БД: данные ответа готовятся заранее,
+поэтому замер включает только маршрутизацию, проверку ответа и сериализацию.
+Время — `time.process_time`, то есть CPU процесса, а не время ожидания.
+
+    uv run python -m benchmarks.serialization --sizes 100 1000 10000 --output results/serialization.json
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from fastapi import FastAPI
+
+from app.schemas import SearchOut
+from app.utils import FastJSONResponse
+from benchmarks.common import summarize, write_results
+
+
+def make_payload(gifs_count: int, tags_per_gif: int = 3, seed: int = 0) -> dict:
+    """Ответ поиска в форме `SearchOut` с `gifs_count` гифками (теги частично не-ASCII, как у реальных пользователей)."""
+    rnd = random.Random(seed)
+    vocabulary = [f'tag{i}' for i in range(25)] + [f'тег{i}' for i in range(25)]
+    return {
+        'tg_user_id': 123456789,
+        'id': 1,
+        'gifs_data': [
+            {
+                'id': gif_id,
+                'tg_gif_id': f'CgACAgIAAxkBAAI{gif_id:012d}',
+                'tags': rnd.sample(vocabulary, tags_per_gif),
+            }
+            for gif_id in range(1, gifs_count + 1)
+        ],
+        'next_cursor': None,
+    }
+
+
+def make_app(payload: dict) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/response_model', response_model=SearchOut)
+    async def via_response_model():
+        return payload
+
+    @app.get('/fast', response_model=SearchOut)
+    async def via_fast_json():
+        return FastJSONResponse(payload)
+
+    return app
+
+
+async def call(app: FastAPI, path: str) -> int:
+    """Выполняет GET-запрос к ASGI-приложению и возвращает размер тела ответа."""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', b'bench')],
+        'client': ('127.0.0.1', 0),
+        'server': ('bench', 80),
+    }
+    body_size = 0
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal body_size
+        if message['type'] == 'http.response.start':
+            assert message['status'] == 200, message
+        elif message['type'] == 'http.response.body':
+            body_size += len(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return body_size
+
+
+async def measure_cpu(app: FastAPI, path: str, repeat: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        await call(app, path)
+
+    timings = []
+    body_size = 0
+    for _ in range(repeat):
+        start = time.process_time()
+        body_size = await call(app, path)
+        timings.append((time.process_time() - start) * 1000)
+    return {**summarize(timings), 'body_bytes': body_size}
+
+
+async def main(sizes: list[int], repeat: int, output: str | None) -> None:
+    results = []
+    for size in sizes:
+        app = make_app(make_payload(size))
+        # Меньше повторов для больших ответов, чтобы прогон не растягивался
+        size_repeat = max(5, repeat * 1000 // max(size, 1000))
+        row = {'gifs': size}
+        for variant, path in (('response_model', '/response_model'), ('fast', '/fast')):
+            row[variant] = await measure_cpu(app, path, size_repeat)
+        row['speedup_p50'] = round(row['response_model']['p50_ms'] / row['fast']['p50_ms'], 2)
+        results.append(row)
+        print(
+            f"{size:>6} gifs: response_model p50={row['response_model']['p50_ms']:.3f} ms CPU, "
+            f"fast p50={row['fast']['p50_ms']:.3f} ms CPU, x{row['speedup_p50']}"
+        )
+
+    write_results(output, 'serialization', {'sizes': sizes, 'repeat': repeat}, results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--output', help='файл для результатов в формате JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.repeat, args.output))
@@ -0,0 +1,170 @@
+"""
+Микробенчмарки функций сервисов (`app/services`) на синтетическом наборе данных.
+
+Для пользователей с размером библиотеки на квантилях p50/p90/p99/max замеряется каждая
+функция сервиса; варианты cold выполняются со сброшенными кэшами процесса.
+Записывающие сценарии меняют теги одной гифки пользователя и возвращают их обратно.
+
+Сначала нужно сгенерировать набор данных:
+
+    uv run python -m benchmarks.dataset --users 2000
+    uv run python -m benchmarks.services --repeat 50 --output results/services.json
+
+Источник данных для поиска задаётся, как и в приложении, переменной `SEARCH_BACKEND`:
+
+    SEARCH_BACKEND=projection uv run python -m benchmarks.services --output results/services-projection.json
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import text
+
+from app import config
+from app.crud import UsersCRUD, GifsCRUD, TagsCRUD
+from app.database import get_engine, dispose_engine, AsyncSessionLocal
+from app.services import (
+    get_user_gifs_with_tags,
+    get_user_gifs_batch,
+    stream_user_gifs_with_tags,
+    get_all_user_tags,
+    suggest_user_tags,
+    set_new_user_tags_on_gif,
+    delete_user_gif_tags,
+    import_user_library,
+)
+from app.services.user_services import user_tags_cache, tag_index_cache, gif_index_cache, _gif_index_loads
+from benchmarks.common import measure, write_results, BENCH_GIF_PREFIX, BENCH_TAG_PREFIX
+from benchmarks.dataset import dataset_users, pick_users_by_size
+
+
+# Самый популярный тег набора данных (ранг 1 по закону Ципфа)
+POPULAR_TAG = f'{BENCH_TAG_PREFIX}0'
+IMPORT_TG_USER_ID = -10_000_000
+IMPORT_SIZE = 1000
+# Размер пакета для get_user_gifs_batch (страница гифок в боте)
+BATCH_SIZE = 50
+
+
+async def clear_caches():
+    """Сбрасывает кэши процесса: теги, индексы подсказок и гифок, соответствия идентификаторов."""
+    # Фоновая загрузка индекса гифок, запущенная предыдущим замером, не должна попасть в следующий
+    await asyncio.gather(*_gif_index_loads.values())
+    user_tags_cache.clear()
+    tag_index_cache.clear()
+    gif_index_cache.clear()
+    for crud in (UsersCRUD, GifsCRUD, TagsCRUD):
+        crud.identity_map.clear()
+
+
+async def _drain(iterator) -> int:
+    count = 0
+    async for _ in iterator:
+        count += 1
+    return count
+
+
+async def bench_user(session, tg_user_id: int, repeat: int) -> dict:
+    """Замеры всех функций сервисов для одного пользователя."""
+    library = await get_user_gifs_with_tags(session, tg_user_id=tg_user_id)
+    gif = library['gifs_data'][0]
+    original_tags = gif['tags']
+    batch = [(tg_user_id, item['tg_gif_id']) for item in library['gifs_data'][:BATCH_SIZE]]
+    changed_tags = [*original_tags, f'{BENCH_TAG_PREFIX}1', f'{BENCH_TAG_PREFIX}bench-write']
+
+    async def write():
+        await set_new_user_tags_on_gif(session, tg_user_id, gif['tg_gif_id'], changed_tags)
+        await set_new_user_tags_on_gif(session, tg_user_id, gif['tg_gif_id'], original_tags)
+
+    async def delete():
+        await delete_user_gif_tags(session, tg_user_id, gif['tg_gif_id'])
+
+    async def restore():
+        await set_new_user_tags_on_gif(session, tg_user_id, gif['tg_gif_id'], original_tags)
+
+    scenarios = {
+        'get_user_gifs_with_tags': (lambda: get_user_gifs_with_tags(session, tg_user_id=tg_user_id), None),
+        'get_user_gifs_with_tags:cold': (lambda: get_user_gifs_with_tags(session, tg_user_id=tg_user_id), clear_caches),
+        'get_user_gifs_with_tags:tag': (
+            lambda: get_user_gifs_with_tags(session, tg_user_id=tg_user_id, tags=[POPULAR_TAG]), None,
+        ),
+        'get_user_gifs_with_tags:page50': (
+            lambda: get_user_gifs_with_tags(session, tg_user_id=tg_user_id, limit=50), None,
+        ),
+        'get_user_gifs_with_tags:one_gif': (
+            lambda: get_user_gifs_with_tags(session, tg_user_id=tg_user_id, tg_gifs_id=gif['tg_gif_id']), None,
+        ),
+        f'get_user_gifs_batch:{BATCH_SIZE}': (lambda: get_user_gifs_batch(session, batch), None),
+        'stream_user_gifs_with_tags': (
+            lambda: _drain(stream_user_gifs_with_tags(session, tg_user_id=tg_user_id)), None,
+        ),
+        'get_all_user_tags': (lambda: get_all_user_tags(session, tg_user_id=tg_user_id), None),
+        'get_all_user_tags:cold': (lambda: get_all_user_tags(session, tg_user_id=tg_user_id), clear_caches),
+        'suggest_user_tags': (lambda: suggest_user_tags(session, tg_user_id, f'{BENCH_TAG_PREFIX}1'), None),
+        'suggest_user_tags:cold': (
+            lambda: suggest_user_tags(session, tg_user_id, f'{BENCH_TAG_PREFIX}1'), clear_caches,
+        ),
+        # Два изменения: на новые теги и обратно
+        'set_new_user_tags_on_gif:x2': (write, None),
+        'delete_user_gif_tags': (delete, restore),
+    }
+
+    results = {}
+    for name, (fn, setup) in scenarios.items():
+        results[name] = await measure(fn, repeat=repeat, setup=setup)
+    await restore()
+    return results
+
+
+async def bench_import(session, repeat: int) -> dict:
+    """Импорт библиотеки из `IMPORT_SIZE` гифок новому пользователю."""
+    library = [
+        (f'{BENCH_GIF_PREFIX}import-{i}', [POPULAR_TAG, f'{BENCH_TAG_PREFIX}{i % 50}'])
+        for i in range(IMPORT_SIZE)
+    ]
+
+    async def reset():
+        await session.execute(text('DELETE FROM users WHERE tg_id = :tg_id'), {'tg_id': IMPORT_TG_USER_ID})
+        await session.commit()
+        UsersCRUD.identity_map.clear()
+
+    result = await measure(lambda: import_user_library(session, IMPORT_TG_USER_ID, library), repeat=repeat, setup=reset)
+    await reset()
+    return {f'import_user_library:{IMPORT_SIZE}': result}
+
+
+async def main(repeat: int, output: str | None) -> None:
+    try:
+        async with get_engine().connect() as conn:
+            users = await dataset_users(conn)
+        if not users:
+            raise SystemExit('Нет синтетических данных: сначала запустите python -m benchmarks.dataset')
+
+        results = {}
+        async with AsyncSessionLocal() as session:
+            for quantile, (tg_user_id, gifs) in pick_users_by_size(users).items():
+                print(f'{quantile}: пользователь {tg_user_id}, {gifs} гифок')
+                results[quantile] = {'tg_user_id': tg_user_id, 'gifs': gifs, **await bench_user(session, tg_user_id, repeat)}
+            results['import'] = await bench_import(session, max(repeat // 10, 3))
+    finally:
+        await dispose_engine()
+
+    for quantile, scenarios in results.items():
+        for name, stats in scenarios.items():
+            if isinstance(stats, dict):
+                print(f'{quantile:>6} {name:<36} p50 {stats["p50_ms"]:>9.2f} ms  p99 {stats["p99_ms"]:>9.2f} ms')
+
+    parameters = {
+        'repeat': repeat,
+        'dataset_users': len(users),
+        'search_backend': config.SEARCH_BACKEND,
+        'gif_index': config.GIF_INDEX_ENABLED,
+    }
+    write_results(output, 'services', parameters, results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output', help='файл для результатов в формате JSON (по умолчанию stdout)')
+    args = parser.parse_args()
+    asyncio.run(main(args.repeat, args.output))
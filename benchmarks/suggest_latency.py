@@ -0,0 +1,95 @@
+"""
+Бенчмарк подсказок тегов (`suggest_user_tags`) в зависимости от количества тегов пользователя.
+
+Для каждого размера словаря замеряются:
+    - cold: первый запрос после изменения тегов (чтение тегов из БД и построение индекса);
+    - prefix: подсказка по началу тега из закэшированного индекса;
+    - fuzzy: подсказка по слову с опечаткой из закэшированного индекса.
+
+Запуск (нужна локальная БД с применёнными миграциями и заполненный `.env`):
+
+    uv run python -m benchmarks.suggest_latency --tags 100 1000 5000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import string
+
+from sqlalchemy import text
+
+from app.database import get_engine, dispose_engine, AsyncSessionLocal
+from app.services import suggest_user_tags
+from app.services.user_services import invalidate_user_tags
+from benchmarks.common import seed_library, cleanup, measure
+
+
+def make_words(count: int, rnd: random.Random) -> list[str]:
+    """Случайные «слова» длиной 4–12 букв."""
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(4, 12))))
+    return sorted(words)
+
+
+def with_typo(word: str, rnd: random.Random) -> str:
+    """Слово с переставленными соседними буквами."""
+    position = rnd.randrange(len(word) - 1)
+    return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+
+
+async def main(sizes: list[int], repeat: int) -> None:
+    rnd = random.Random(0)
+    words = {size: make_words(size, rnd) for size in sizes}
+    # Общий префикс сделал бы все теги похожими друг на друга, поэтому теги — просто слова
+    all_words = sorted(set().union(*words.values()))
+
+    async with get_engine().begin() as conn:
+        await cleanup(conn, tags=all_words)
+        for i, size in enumerate(sizes):
+            await seed_library(
+                conn,
+                tg_user_id=-(i + 1),
+                gifs_count=size,
+                vocabulary=words[size],
+                seed=i,
+            )
+        await conn.execute(text('ANALYZE'))
+
+    results = []
+    try:
+        async with AsyncSessionLocal() as session:
+            for i, size in enumerate(sizes):
+                tg_user_id = -(i + 1)
+                prefixes = itertools.cycle(word[:2] for word in rnd.sample(words[size], 50))
+                typos = itertools.cycle(with_typo(word, rnd) for word in rnd.sample(words[size], 50))
+
+                async def cold():
+                    invalidate_user_tags(tg_user_id)
+                    return await suggest_user_tags(session, tg_user_id, next(prefixes))
+
+                result = {
+                    'tags': size,
+                    'cold': await measure(cold, repeat=repeat),
+                    'prefix': await measure(lambda: suggest_user_tags(session, tg_user_id, next(prefixes)), repeat=repeat),
+                    'fuzzy': await measure(lambda: suggest_user_tags(session, tg_user_id, next(typos)), repeat=repeat),
+                }
+                results.append(result)
+                print(f'{size:>6} tags: cold p99 {result["cold"]["p99_ms"]:>8.2f} ms | '
+                      f'prefix p99 {result["prefix"]["p99_ms"]:>6.3f} ms | '
+                      f'fuzzy p99 {result["fuzzy"]["p99_ms"]:>6.3f} ms')
+    finally:
+        async with get_engine().begin() as conn:
+            await cleanup(conn, tags=all_words)
+        await dispose_engine()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tags', type=int, nargs='+', default=[100, 1_000, 5_000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.tags, args.repeat))
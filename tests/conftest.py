@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import NullPool
+from app import config
+from app.crud import UsersCRUD, GifsCRUD, TagsCRUD
+from app.database import get_database_url
+
+
+@pytest.fixture
+def anyio_backend():
+    # Асинхронные тесты (pytest.mark.anyio) запускаются в asyncio: asyncpg работает только с ним
+    return 'asyncio'
+
+
+@pytest.fixture
+async def db_engine():
+    """
+    Движок без пула для одного теста: у каждого теста свой event loop,
+    а соединения asyncpg нельзя переносить между циклами.
+    """
+    engine = create_async_engine(get_database_url(), poolclass=NullPool)
+    try:
+        yield engine
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture
+async def db_session(db_engine):
+    """
+    Сессия внутри транзакции, которая откатывается после теста: данные теста в БД не остаются.
+
+    `commit()` / `rollback()` сессии фиксируют и откатывают точку сохранения внутри этой транзакции,
+    поэтому сервисы, которые сами фиксируют изменения, можно вызывать с этой сессией.
+    Кэши идентификаторов после теста очищаются: в них могли попасть ID откаченных записей.
+    """
+    async with db_engine.connect() as conn:
+        transaction = await conn.begin()
+        try:
+            async with AsyncSession(bind=conn, join_transaction_mode='create_savepoint') as session:
+                yield session
+        finally:
+            await transaction.rollback()
+            for crud in (UsersCRUD, GifsCRUD, TagsCRUD):
+                crud.identity_map.clear()
+
+
+@pytest.fixture
+def no_group_commit(monkeypatch):
+    """Замена тегов выполняется в сессии теста, а не в очереди group commit с собственной сессией."""
+    monkeypatch.setattr(config, 'GROUP_COMMIT_ENABLED', False)
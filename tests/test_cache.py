@@ -0,0 +1,40 @@
+import time
+from app.utils import LRUCache
+
+
+def test_lru_eviction_by_weight():
+    cache = LRUCache(max_weight=3)
+    for key in 'abc':
+        cache.set(key, key.upper())
+    cache.get('a')
+    cache.set('d', 'D')
+
+    assert 'b' not in cache
+    assert cache.get('a') == 'A'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_weigher_limits_budget():
+    cache = LRUCache(max_weight=10, weigher=lambda key, value: len(value))
+    cache.set('a', 'x' * 6)
+    cache.set('b', 'x' * 6)
+    cache.set('huge', 'x' * 11)
+
+    assert 'a' not in cache
+    assert 'huge' not in cache
+    assert cache.weight == 6
+
+
+def test_ttl_and_counters():
+    cache = LRUCache(max_weight=10, ttl=0.01)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+    cache.set('b', 2)
+    assert cache.invalidate('b')
+    assert not cache.invalidate('b')
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations'], stats['invalidations']) == (1, 1, 1, 1)
@@ -0,0 +1,193 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import DBAPIError
+from app.crud import UsersCRUD, GifsCRUD, TagsCRUD, UserGifTagCRUD, _BaseCRUD
+from app.crud.base import _model_metadata, _resolve_statements, _chunks, MAX_BIND_PARAMS
+from app.main import app
+from app.services import set_new_user_tags_on_gif, get_user_gifs_with_tags, get_all_user_tags, delete_user_gif_tags
+from app.models import User, Gif, Tag
+
+
+def test_model_metadata_is_computed_once_per_model():
+    assert UsersCRUD._meta is _model_metadata(User)
+    assert UsersCRUD(None)._meta is _BaseCRUD(None, model=User)._meta
+    assert UsersCRUD._meta.pk_column is User.id
+    assert UsersCRUD._meta.unique_keys == {'id', 'tg_id'}
+    assert UsersCRUD._meta.conflict_update_column == 'tg_id'
+    # У связи все колонки — части первичного ключа, при конфликте обновляется первая колонка-внешний ключ
+    assert UserGifTagCRUD._meta.conflict_update_column == 'user_id'
+
+
+def test_hot_statements_are_cacheable_and_do_not_depend_on_values():
+    existing, existing_or_create = _resolve_statements(Gif, 'tg_gif_id')
+    assert existing._generate_cache_key() is not None
+    assert existing_or_create._generate_cache_key() is not None
+    assert 'unnest(CAST(:keys AS TEXT[]))' in str(existing_or_create)
+
+    crud = UsersCRUD(None)
+    stmt = crud._meta.statement(('create', ('tg_id',)), lambda: crud._build_create_statement(('tg_id',)))
+    assert stmt._generate_cache_key() is not None
+    assert str(stmt) == (
+        'INSERT INTO users (tg_id) VALUES (:values_tg_id) ON CONFLICT (tg_id) DO UPDATE SET tg_id = excluded.tg_id '
+        'RETURNING users.id, users.tg_id, users.library_version, users.library_version_xact'
+    )
+
+
+@pytest.mark.anyio
+async def test_crud_roundtrip(db_session):
+    users = UsersCRUD(db_session)
+    gifs = GifsCRUD(db_session)
+    created = await users.create_user(-454545)
+    again = await users.create_user(-454545)
+    ids = await gifs.resolve_ids(['test-crud-1', 'test-crud-2'], create=True)
+    gifs.forget_ids()
+    found = await gifs.resolve_ids(['test-crud-1', 'test-crud-2', 'test-crud-3'])
+    updated = await users.update_instance(None, {User.library_version: 7}, filters={User.tg_id: -454545})
+    selected = await users.get_instances(User.library_version, filters={User.id: [created.id]})
+    deleted = await gifs.delete_instances(filters={Gif.tg_gif_id: ['test-crud-1', 'test-crud-2']})
+
+    assert created == again
+    assert found == ids
+    assert updated.library_version == 7
+    assert selected == [(7,)]
+    assert deleted == 2
+
+
+@pytest.mark.anyio
+async def test_identity_map_keeps_only_committed_ids(db_session):
+    # commit() / rollback() сессии из фикстуры фиксируют и откатывают точку сохранения,
+    # для сессии это те же границы транзакции
+    keys = ['test-pending-1', 'test-pending-2', 'test-pending-3']
+    gifs = GifsCRUD(db_session)
+    await gifs.resolve_ids([keys[0]], create=True)
+    await db_session.rollback()
+    assert GifsCRUD.identity_map.get(keys[0]) is None
+
+    with pytest.raises(RuntimeError):
+        async with db_session.begin_nested():
+            await gifs.resolve_ids([keys[1]], create=True)
+            raise RuntimeError
+    ids = await gifs.resolve_ids([keys[2]], create=True)
+    assert GifsCRUD.identity_map.get(keys[2]) is None
+    await db_session.commit()
+    assert [GifsCRUD.identity_map.get(key) for key in keys] == [None, None, ids[keys[2]]]
+
+    # Чтение без вставок кэширует уже зафиксированные записи сразу
+    gifs.forget_ids()
+    await gifs.resolve_ids([keys[2]])
+    assert GifsCRUD.identity_map.get(keys[2]) == ids[keys[2]]
+
+
+@pytest.mark.anyio
+async def test_long_keys_are_not_truncated(db_session):
+    tags = TagsCRUD(db_session)
+    tag = 'test-long-' + 'x' * 90
+    await tags.resolve_ids([tag], create=True)
+    # Раньше ключ обрезался приведением к VARCHAR(100)[] и совпадал с существующим тегом
+    assert await tags.resolve_ids([tag + 'y']) == {}
+    with pytest.raises(DBAPIError, match='too long'):
+        async with db_session.begin_nested():
+            await tags.resolve_ids([tag + 'y'], create=True)
+
+
+def test_long_tags_and_gif_ids_are_rejected_by_api():
+    with TestClient(app) as client:
+        assert client.put('/user/1/gif/test-long', json={'tags': ['x' * 101]}).status_code == 422
+        assert client.put(f'/user/1/gif/{"x" * 256}', json={'tags': ['x']}).status_code == 422
+        assert client.get(f'/user/1/gif/{"x" * 256}').status_code == 422
+        assert client.delete(f'/user/1/gif/{"x" * 256}').status_code == 422
+
+
+def test_missing_gif_returns_data_not_found():
+    with TestClient(app) as client:
+        response = client.get('/user/-585858/gif/test-missing')
+    assert (response.status_code, response.json()) == (404, {'detail': 'Data not found'})
+
+
+def test_chunks_stay_under_bind_param_limit():
+    rows = list(range(100_000))
+    chunks = list(_chunks(rows, params_per_row=3, chunk_size=50_000))
+    assert max(len(chunk) for chunk in chunks) * 3 <= MAX_BIND_PARAMS
+    assert [row for chunk in chunks for row in chunk] == rows
+    assert [len(chunk) for chunk in _chunks(rows[:5], params_per_row=1, chunk_size=2)] == [2, 2, 1]
+
+
+@pytest.mark.anyio
+async def test_bulk_create_upsert_update(db_session):
+    users = UsersCRUD(db_session)
+    created = sorted(await users.create_instances(
+        [{User.tg_id: -464646}, {User.tg_id: -464647}, {User.tg_id: -464646}],
+    ), key=lambda row: -row.tg_id)
+    # Существующая запись возвращается без изменений, по одной строке в запросе
+    again = await users.create_instances([{User.tg_id: -464647}, {User.tg_id: -464648}], chunk_size=1)
+    upserted = sorted(await users.upsert_instances([
+        {User.tg_id: -464648, User.library_version: 3},
+        {User.tg_id: -464649, User.library_version: 4},
+    ]), key=lambda row: -row.tg_id)
+    updated = await users.update_instances([
+        {User.id: created[0].id, User.library_version: 5},
+        {User.id: created[1].id, User.library_version: 6},
+        {User.id: 0, User.library_version: 7},
+    ])
+    by_key = await users.update_instances(
+        [{User.tg_id: -464649, User.library_version: 8}], key_columns=[User.tg_id],
+    )
+    cached = await users.resolve_ids([-464646, -464649])
+
+    assert [row.tg_id for row in created] == [-464646, -464647]
+    assert sorted(row.tg_id for row in again) == [-464648, -464647]
+    assert [(row.tg_id, row.library_version) for row in upserted] == [(-464648, 3), (-464649, 4)]
+    assert sorted((row.tg_id, row.library_version) for row in updated) == [(-464647, 6), (-464646, 5)]
+    assert [(row.tg_id, row.library_version) for row in by_key] == [(-464649, 8)]
+    assert cached == {-464646: created[0].id, -464649: upserted[1].id}
+
+    # Больше строк, чем помещается параметров в один запрос
+    tags = [f'test-bulk-{i}' for i in range(20_000)]
+    tag_rows = await TagsCRUD(db_session).create_instances([{Tag.tag: tag} for tag in tags])
+    renamed = await TagsCRUD(db_session).update_instances(
+        [{Tag.id: row.id, Tag.tag: f'{row.tag}-renamed'} for row in tag_rows], chunk_size=50_000,
+    )
+    assert len(tag_rows) == 20_000
+    assert sum(row.tag.endswith('-renamed') for row in renamed) == 20_000
+
+
+@pytest.mark.anyio
+async def test_stream_instances_and_pk_ranges(db_session):
+    tags_crud = TagsCRUD(db_session)
+    tags = [f'test-stream-{i}' for i in range(2500)]
+    expected = {row.id for row in await tags_crud.create_instances([{Tag.tag: tag} for tag in tags])}
+
+    streamed = [row async for row in tags_crud.stream_instances(Tag.id, {Tag.tag: tags}, batch_size=100)]
+    ranges = await tags_crud.pk_ranges(4)
+    partitioned = [
+        [row.id async for row in tags_crud.stream_instances(Tag.id, {Tag.tag: tags}, pk_range=pk_range)]
+        for pk_range in ranges
+    ]
+
+    # Прерванная итерация закрывает курсор, и сессией можно пользоваться дальше
+    async for _ in tags_crud.stream_instances(filters={Tag.tag: tags}):
+        break
+    count = len(await tags_crud.get_instances(Tag.id, {Tag.tag: tags}))
+
+    assert {row.id for row in streamed} == expected
+    assert len(streamed) == 2500
+    assert len(ranges) == 4
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    assert sorted(id_ for part in partitioned for id_ in part) == sorted(expected)
+    assert count == 2500
+
+
+
+@pytest.mark.anyio
+async def test_services_do_not_load_orm_objects(db_session, no_group_commit):
+    # update_instance / delete_instances не синхронизируют ORM-объекты сессии (synchronize_session=False),
+    # поэтому сервисы не должны загружать объекты моделей, которые потом читали бы устаревшие значения
+    await set_new_user_tags_on_gif(db_session, -575757, 'test-sync', ['test-sync-a', 'test-sync-b'])
+    await set_new_user_tags_on_gif(db_session, -575757, 'test-sync', ['test-sync-b'])
+    assert await get_user_gifs_with_tags(db_session, tg_user_id=-575757, tags=['test-sync-b'])
+    assert await get_all_user_tags(db_session, tg_user_id=-575757) == {'test-sync-b'}
+    await delete_user_gif_tags(db_session, -575757, 'test-sync')
+    await UsersCRUD(db_session).update_instance(None, {User.library_version: 10}, filters={User.tg_id: -575757})
+    await TagsCRUD(db_session).delete_instances(filters={Tag.tag: ['test-sync-a', 'test-sync-b']})
+
+    assert len(db_session.sync_session.identity_map) == 0
@@ -1,15 +1,280 @@
-from app.database import SessionLocal
-from sqlalchemy import text
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.crud import UsersCRUD, GifsCRUD, TagsCRUD, UserGifTagCRUD
+from app.models import Gif, Tag
+from app.services import set_new_user_tags_on_gif
 
 
-def test_db_connect():
-    with SessionLocal() as session:
-        assert session.execute(text("SELECT 1")).scalar() == 1
+pytestmark = pytest.mark.anyio
 
 
-def test_db_tables_exist():
-    with SessionLocal() as session:
-        result = session.execute(
-            text("SELECT table_name FROM information_schema.tables WHERE table_schema='public'")
-        ).fetchall()
-    assert result == [('alembic_version',), ('gifs',), ('user_gif_tags',), ('tags',), ('users',)]
+async def _insert_test_data(
+        session,
+        tg_user_id: int,
+        gifs: list[str],
+        tags: list[str],
+) -> tuple[int, list[int], list[int]]:
+    """
+    Создаёт пользователя, гифки и теги для теста через сессию или соединение `session`.
+
+    :return: (user_id, ID гифок, ID тегов) в порядке аргументов.
+    """
+    user_id = (await session.execute(
+        text("INSERT INTO users (tg_id) VALUES (:tg_id) RETURNING id"), {'tg_id': tg_user_id},
+    )).scalar()
+    gif_ids = [
+        (await session.execute(text("INSERT INTO gifs (tg_gif_id) VALUES (:gif) RETURNING id"), {'gif': gif})).scalar()
+        for gif in gifs
+    ]
+    tag_ids = [
+        (await session.execute(text("INSERT INTO tags (tag) VALUES (:tag) RETURNING id"), {'tag': tag})).scalar()
+        for tag in tags
+    ]
+    return user_id, gif_ids, tag_ids
+
+
+async def test_db_connect(db_session):
+    assert (await db_session.execute(text("SELECT 1"))).all() == [(1,)]
+
+
+async def test_db_tables_exist(db_session):
+    result = await db_session.execute(
+        text("SELECT table_name FROM information_schema.tables WHERE table_schema='public'")
+    )
+    assert {row[0] for row in result} == {'alembic_version', 'gifs', 'user_gif_tags', 'user_gifs', 'tags', 'users'}
+
+
+async def test_user_gifs_projection_follows_user_gif_tags(db_session):
+    user_id, (gif_id,), tag_ids = await _insert_test_data(
+        db_session, -424242, ['test-projection'], ['test-projection-b', 'test-projection-a'],
+    )
+    projection = text("SELECT tg_gif_id, tags FROM user_gifs WHERE user_id = :user_id")
+
+    steps = []
+    await db_session.execute(
+        text("INSERT INTO user_gif_tags (user_id, gif_id, tag_id) VALUES (:user_id, :gif_id, :tag_id)"),
+        [{'user_id': user_id, 'gif_id': gif_id, 'tag_id': tag_id} for tag_id in tag_ids],
+    )
+    steps.append((await db_session.execute(projection, {'user_id': user_id})).all())
+    await db_session.execute(text("DELETE FROM user_gif_tags WHERE tag_id = :tag_id"), {'tag_id': tag_ids[0]})
+    steps.append((await db_session.execute(projection, {'user_id': user_id})).all())
+    await db_session.execute(text("DELETE FROM user_gif_tags WHERE user_id = :user_id"), {'user_id': user_id})
+    steps.append((await db_session.execute(projection, {'user_id': user_id})).all())
+
+    assert steps == [
+        [('test-projection', ['test-projection-a', 'test-projection-b'])],
+        [('test-projection', ['test-projection-a'])],
+        [],
+    ]
+
+
+async def test_library_version_bumps_once_per_transaction(db_engine):
+    # Версия зависит от границ настоящих транзакций, поэтому тест фиксирует их и удаляет свои данные сам
+    version = text("SELECT library_version FROM users WHERE id = :user_id")
+    link = text("INSERT INTO user_gif_tags (user_id, gif_id, tag_id) VALUES (:user_id, :gif_id, :tag_id)")
+    async with db_engine.connect() as conn:
+        user_id, (gif_id,), tag_ids = await _insert_test_data(
+            conn, -434343, ['test-version'], ['test-version-a', 'test-version-b'],
+        )
+        await conn.commit()
+
+        try:
+            versions = [(await conn.execute(version, {'user_id': user_id})).scalar()]
+            for tag_id in tag_ids:
+                await conn.execute(link, {'user_id': user_id, 'gif_id': gif_id, 'tag_id': tag_id})
+            await conn.execute(text("DELETE FROM user_gif_tags WHERE tag_id = :tag_id"), {'tag_id': tag_ids[0]})
+            await conn.commit()
+            versions.append((await conn.execute(version, {'user_id': user_id})).scalar())
+
+            await conn.execute(text("DELETE FROM user_gif_tags WHERE user_id = :user_id"), {'user_id': user_id})
+            await conn.commit()
+            versions.append((await conn.execute(version, {'user_id': user_id})).scalar())
+        finally:
+            await conn.rollback()
+            await conn.execute(text("DELETE FROM users WHERE id = :user_id"), {'user_id': user_id})
+            await conn.execute(text("DELETE FROM gifs WHERE id = :gif_id"), {'gif_id': gif_id})
+            await conn.execute(text("DELETE FROM tags WHERE id = ANY(:tag_ids)"), {'tag_ids': tag_ids})
+            await conn.commit()
+
+    assert versions == [0, 1, 2]
+
+
+async def test_library_version_bumps_after_user_upsert_in_same_transaction(db_session):
+    # Upsert пользователя (ON CONFLICT DO UPDATE), затем связи в той же транзакции, в том числе в SAVEPOINT
+    version = text("SELECT library_version FROM users WHERE id = :user_id")
+    link = text("INSERT INTO user_gif_tags (user_id, gif_id, tag_id) VALUES (:user_id, :gif_id, :tag_id)")
+    user_id, (gif_id,), tag_ids = await _insert_test_data(
+        db_session, -444444, ['test-upsert'], ['test-upsert-a', 'test-upsert-b'],
+    )
+
+    versions = [(await db_session.execute(version, {'user_id': user_id})).scalar()]
+    await db_session.execute(text(
+        "INSERT INTO users (tg_id) VALUES (-444444) ON CONFLICT (tg_id) DO UPDATE SET tg_id = excluded.tg_id"
+    ))
+    await db_session.execute(link, {'user_id': user_id, 'gif_id': gif_id, 'tag_id': tag_ids[0]})
+    versions.append((await db_session.execute(version, {'user_id': user_id})).scalar())
+    async with db_session.begin_nested():
+        await db_session.execute(link, {'user_id': user_id, 'gif_id': gif_id, 'tag_id': tag_ids[1]})
+    versions.append((await db_session.execute(version, {'user_id': user_id})).scalar())
+
+    assert versions == [0, 1, 1]
+
+
+async def test_lock_users_takes_slot_locks(db_session):
+    locks = text(
+        "SELECT objid FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid() "
+        "AND classid = hashtext('user_gifs')::oid ORDER BY objid"
+    )
+    # 1025 и 1 попадают в один слот: блокировка берётся по слоту, а не по пользователю
+    await UserGifTagCRUD(db_session).lock_users([1025, 2, 1])
+    assert (await db_session.execute(locks)).scalars().all() == [1, 2]
+
+
+async def test_batch_links_create_and_delete(db_session):
+    user_id, (first, second), (a, b) = await _insert_test_data(
+        db_session, -454545, ['test-batch-1', 'test-batch-2'], ['test-batch-a', 'test-batch-b'],
+    )
+    links = text("SELECT gif_id, tag_id FROM user_gif_tags WHERE user_id = :user_id ORDER BY gif_id, tag_id")
+
+    crud = UserGifTagCRUD(db_session)
+    created = await crud.create_links([(user_id, first, a), (user_id, first, b), (user_id, second, a)])
+    # first: {a, b} -> {b}; second: {a} -> {a} (без изменений)
+    keep = [(user_id, first, b), (user_id, second, a)]
+    recreated = await crud.create_links(keep)
+    deleted = await crud.delete_links_except([(user_id, first), (user_id, second)], keep)
+
+    assert created == {(user_id, first), (user_id, second)}
+    assert recreated == set()
+    assert deleted == {(user_id, first)}
+    assert (await db_session.execute(links, {'user_id': user_id})).all() == [(first, b), (second, a)]
+
+
+USER_GIFS = text(
+    "SELECT gif_id, tg_gif_id, tags FROM user_gifs JOIN users ON users.id = user_gifs.user_id "
+    "WHERE tg_id = :tg_id ORDER BY tg_gif_id"
+)
+
+
+async def test_set_new_user_tags_replaces_tag_set(db_session, no_group_commit):
+    await set_new_user_tags_on_gif(db_session, -464646, 'test-replace', ['test-replace-a', 'test-replace-b'])
+    await set_new_user_tags_on_gif(db_session, -464646, 'test-replace', ['test-replace-c', 'test-replace-b'])
+    # Один тег строкой и повторяющиеся теги
+    await set_new_user_tags_on_gif(db_session, -464646, 'test-replace-2', 'test-replace-a')
+    await set_new_user_tags_on_gif(db_session, -464646, 'test-replace-3', ['test-replace-a', 'test-replace-a'])
+
+    rows = (await db_session.execute(USER_GIFS, {'tg_id': -464646})).all()
+    assert [(tg_gif_id, tags) for _, tg_gif_id, tags in rows] == [
+        ('test-replace', ['test-replace-b', 'test-replace-c']),
+        ('test-replace-2', ['test-replace-a']),
+        ('test-replace-3', ['test-replace-a']),
+    ]
+
+
+async def test_set_new_user_tags_empty_list(db_session, no_group_commit):
+    await set_new_user_tags_on_gif(db_session, -474747, 'test-empty', ['test-empty-a'])
+    await set_new_user_tags_on_gif(db_session, -474747, 'test-empty', [])
+    assert (await db_session.execute(USER_GIFS, {'tg_id': -474747})).all() == []
+
+    # Пустой набор для неизвестных пользователя и гифки ничего не создаёт
+    await set_new_user_tags_on_gif(db_session, -484848, 'test-empty-new', [])
+    assert (await db_session.execute(text("SELECT count(*) FROM users WHERE tg_id = -484848"))).scalar() == 0
+    assert (await db_session.execute(text(
+        "SELECT count(*) FROM gifs WHERE tg_gif_id = 'test-empty-new'"
+    ))).scalar() == 0
+
+
+async def test_set_new_user_tags_retries_after_cached_row_deleted(db_session, no_group_commit):
+    await set_new_user_tags_on_gif(db_session, -494949, 'test-retry', ['test-retry-a'])
+    (old_gif_id, _, _), = (await db_session.execute(USER_GIFS, {'tg_id': -494949})).all()
+    assert GifsCRUD.identity_map.get('test-retry') == old_gif_id
+
+    # Запись удаляется в обход CRUD-классов: в кэше остаётся ID удалённой гифки
+    await db_session.execute(text("DELETE FROM user_gif_tags WHERE gif_id = :gif_id"), {'gif_id': old_gif_id})
+    await db_session.execute(text("DELETE FROM gifs WHERE id = :gif_id"), {'gif_id': old_gif_id})
+    await db_session.commit()
+
+    await set_new_user_tags_on_gif(db_session, -494949, 'test-retry', ['test-retry-b'])
+    (gif_id, tg_gif_id, tags), = (await db_session.execute(USER_GIFS, {'tg_id': -494949})).all()
+    assert gif_id != old_gif_id
+    assert (tg_gif_id, tags) == ('test-retry', ['test-retry-b'])
+    assert GifsCRUD.identity_map.get('test-retry') == gif_id
+
+
+async def test_set_new_user_tags_noop_writes_nothing(db_engine, no_group_commit):
+    # Версия библиотеки зависит от границ настоящих транзакций, поэтому тест фиксирует их и удаляет свои данные сам
+    version = text("SELECT library_version FROM users WHERE tg_id = -505050")
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.lstrip().split(None, 1)[0].upper())
+
+    async with AsyncSession(db_engine) as session:
+        try:
+            await set_new_user_tags_on_gif(session, -505050, 'test-noop', ['test-noop-a', 'test-noop-b'])
+            before = (await session.execute(version)).scalar()
+            await session.commit()
+
+            event.listen(db_engine.sync_engine, 'before_cursor_execute', record)
+            try:
+                await set_new_user_tags_on_gif(session, -505050, 'test-noop', ['test-noop-b', 'test-noop-a'])
+            finally:
+                event.remove(db_engine.sync_engine, 'before_cursor_execute', record)
+            after = (await session.execute(version)).scalar()
+        finally:
+            await session.rollback()
+            await session.execute(text(
+                "DELETE FROM user_gif_tags WHERE user_id IN (SELECT id FROM users WHERE tg_id = -505050)"
+            ))
+            await session.execute(text("DELETE FROM users WHERE tg_id = -505050"))
+            await session.execute(text("DELETE FROM gifs WHERE tg_gif_id = 'test-noop'"))
+            await session.execute(text("DELETE FROM tags WHERE tag LIKE 'test-noop-%'"))
+            await session.commit()
+            UsersCRUD(session).forget_ids([-505050])
+            GifsCRUD(session).forget_ids(['test-noop'])
+            TagsCRUD(session).forget_ids(['test-noop-a', 'test-noop-b'])
+
+    assert statements and set(statements) <= {'SELECT', 'BEGIN', 'ROLLBACK', 'COMMIT'}
+    assert after == before == 1
+
+
+async def test_library_version_bumps_on_gif_and_tag_renames(db_engine):
+    # Версия зависит от границ настоящих транзакций, поэтому тест фиксирует их и удаляет свои данные сам
+    versions = text("SELECT library_version FROM users WHERE id = ANY(:user_ids) ORDER BY tg_id DESC")
+    link = text("INSERT INTO user_gif_tags (user_id, gif_id, tag_id) VALUES (:user_id, :gif_id, :tag_id)")
+    async with AsyncSession(db_engine) as session:
+        owner, (gif_id,), (tag_id,) = await _insert_test_data(session, -464646, ['test-rename'], ['test-rename-a'])
+        other, (other_gif_id,), (other_tag_id,) = await _insert_test_data(
+            session, -464647, ['test-rename-other'], ['test-rename-other-a'],
+        )
+        user_ids = [owner, other]
+        await session.execute(link, {'user_id': owner, 'gif_id': gif_id, 'tag_id': tag_id})
+        await session.execute(link, {'user_id': other, 'gif_id': other_gif_id, 'tag_id': other_tag_id})
+        await session.commit()
+
+        try:
+            steps = [(await session.execute(versions, {'user_ids': user_ids})).scalars().all()]
+            await GifsCRUD(session).update_instance(gif_id, {Gif.tg_gif_id: 'test-rename-2'})
+            await session.commit()
+            steps.append((await session.execute(versions, {'user_ids': user_ids})).scalars().all())
+
+            # Гифка и тег в одной транзакции: версия увеличивается один раз
+            await GifsCRUD(session).update_instance(gif_id, {Gif.tg_gif_id: 'test-rename-3'})
+            await TagsCRUD(session).update_instances([{Tag.id: tag_id, Tag.tag: 'test-rename-b'}])
+            await session.commit()
+            steps.append((await session.execute(versions, {'user_ids': user_ids})).scalars().all())
+
+            # Значение не изменилось — версия тоже
+            await TagsCRUD(session).update_instance(tag_id, {Tag.tag: 'test-rename-b'})
+            await session.commit()
+            steps.append((await session.execute(versions, {'user_ids': user_ids})).scalars().all())
+        finally:
+            await session.rollback()
+            await session.execute(text("DELETE FROM users WHERE id = ANY(:user_ids)"), {'user_ids': user_ids})
+            await session.execute(text("DELETE FROM gifs WHERE id = ANY(:ids)"), {'ids': [gif_id, other_gif_id]})
+            await session.execute(text("DELETE FROM tags WHERE id = ANY(:ids)"), {'ids': [tag_id, other_tag_id]})
+            await session.commit()
+            for crud in (UsersCRUD, GifsCRUD, TagsCRUD):
+                crud(session).forget_ids()
+
+    assert steps == [[1, 1], [2, 1], [3, 1], [3, 1]]
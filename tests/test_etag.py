@@ -0,0 +1,29 @@
+from app.utils import library_etag, etag_matches, not_modified
+
+
+def test_library_etag_depends_on_user_version_and_variant():
+    assert library_etag(7, 3) == 'W/"7-3"'
+    assert library_etag(7, 3, 'ndjson') == 'W/"7-3-ndjson"'
+    assert len({library_etag(7, 3), library_etag(8, 3), library_etag(7, 4), library_etag(7, 3, 'ndjson')}) == 4
+
+
+def test_etag_matches_weak_comparison():
+    etag = library_etag(7, 3)
+
+    assert etag_matches(etag, etag)
+    assert etag_matches('"7-3"', etag)
+    assert etag_matches('W/"1-1", W/"7-3"', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('W/"7-2"', etag)
+
+
+def test_not_modified_response():
+    etag = library_etag(7, 3)
+
+    assert not_modified('W/"7-2"', etag) is None
+    response = not_modified(etag, etag, vary='Accept')
+    assert response.status_code == 304
+    assert response.headers['etag'] == etag
+    assert response.headers['vary'] == 'Accept'
+    assert response.body == b''
@@ -0,0 +1,74 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+from app import config
+from app.database import get_db
+from app.main import app
+from app.services import set_new_user_tags_on_gif
+
+
+pytestmark = pytest.mark.anyio
+
+ALICE, BOB, NOBODY = -545454, -545455, -545456
+
+
+@pytest.fixture
+async def client(db_session, no_group_commit):
+    """Клиент приложения в цикле теста; гифки читаются через сессию теста."""
+    await set_new_user_tags_on_gif(db_session, ALICE, 'test-batch-1', ['test-batch-x', 'test-batch-y'])
+    await set_new_user_tags_on_gif(db_session, ALICE, 'test-batch-2', ['test-batch-x'])
+    await set_new_user_tags_on_gif(db_session, BOB, 'test-batch-1', ['test-batch-z'])
+
+    app.dependency_overrides[get_db] = lambda: db_session
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://test') as http:
+            yield http
+    finally:
+        app.dependency_overrides.pop(get_db)
+
+
+async def _batch(client, pairs: list[tuple[int, str]]):
+    return await client.post('/user/gifs/batch', json={'items': [
+        {'tg_user_id': tg_user_id, 'tg_gif_id': tg_gif_id} for tg_user_id, tg_gif_id in pairs
+    ]})
+
+
+async def test_results_follow_input_order_across_users(client):
+    pairs = [
+        (BOB, 'test-batch-1'),
+        (ALICE, 'test-batch-2'),
+        (ALICE, 'test-batch-1'),
+        (ALICE, 'test-batch-2'),
+    ]
+    response = await _batch(client, pairs)
+
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert [(item['tg_user_id'], item['tg_gif_id']) for item in results] == pairs
+    assert [sorted(item['gif']['tags']) for item in results] == [
+        ['test-batch-z'],
+        ['test-batch-x'],
+        ['test-batch-x', 'test-batch-y'],
+        ['test-batch-x'],
+    ]
+    # Одна и та же гифка у разных пользователей, повторяющиеся пары получают одинаковый результат
+    assert results[0]['gif']['id'] == results[2]['gif']['id']
+    assert results[1] == results[3]
+
+
+async def test_missing_users_and_gifs_are_null(client):
+    response = await _batch(client, [
+        (ALICE, 'test-batch-missing'),
+        (NOBODY, 'test-batch-1'),
+        (BOB, 'test-batch-2'),
+        (ALICE, 'test-batch-1'),
+    ])
+
+    assert response.status_code == 200
+    assert [item['gif'] is None for item in response.json()['results']] == [True, True, True, False]
+
+
+async def test_items_count_is_validated(client):
+    assert (await _batch(client, [])).status_code == 422
+    too_many = [(ALICE, 'test-batch-1')] * (config.GIF_BATCH_MAX_ITEMS + 1)
+    assert (await _batch(client, too_many)).status_code == 422
+    assert (await _batch(client, too_many[1:])).status_code == 200
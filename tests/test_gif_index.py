@@ -0,0 +1,113 @@
+import asyncio
+import random
+import pytest
+from app.services import user_services
+from app.utils import GifIndex
+
+
+def _ids(gifs):
+    return [gif['id'] for gif in gifs]
+
+
+def test_search_intersects_tags_in_gif_id_order():
+    index = GifIndex([
+        (30, 'c', ['cat', 'funny']),
+        (10, 'a', ['cat']),
+        (20, 'b', ['funny', 'cat', 'dog']),
+    ])
+
+    assert index.search() == [
+        {'id': 10, 'tg_gif_id': 'a', 'tags': ['cat']},
+        {'id': 20, 'tg_gif_id': 'b', 'tags': ['cat', 'dog', 'funny']},
+        {'id': 30, 'tg_gif_id': 'c', 'tags': ['cat', 'funny']},
+    ]
+    assert _ids(index.search(tags=['cat', 'funny'])) == [20, 30]
+    assert _ids(index.search(tags=['cat', 'unknown'])) == []
+    assert _ids(index.search(tg_gifs_id=['c', 'a', 'missing'])) == [10, 30]
+
+
+def test_keyset_pages():
+    index = GifIndex([(gif_id, f'tg-{gif_id}', ['even' if gif_id % 2 == 0 else 'odd']) for gif_id in range(1, 101)])
+
+    assert _ids(index.search(tags=['even'], limit=3)) == [2, 4, 6]
+    assert _ids(index.search(tags=['even'], after_gif_id=6, limit=3)) == [8, 10, 12]
+    assert _ids(index.search(tags=['even'], after_gif_id=7, limit=2)) == [8, 10]
+    assert _ids(index.search(after_gif_id=100)) == []
+
+
+def test_updates_apply_without_rebuild_from_scratch():
+    index = GifIndex([(1, 'a', ['cat']), (5, 'b', ['cat', 'dog'])])
+
+    index.set_gif(5, 'b', ['dog'])
+    index.set_gif(9, 'c', ['cat'])
+    assert _ids(index.search(tags=['cat'])) == [1, 9]
+
+    # ID меньше последнего: индекс перенумеровывается
+    index.set_gif(3, 'd', ['cat', 'dog'])
+    assert _ids(index.search(tags=['cat'])) == [1, 3, 9]
+    assert _ids(index.search(tags=['dog'], after_gif_id=3)) == [5]
+
+    assert index.remove_gif(1)
+    assert not index.remove_gif(1)
+    index.set_gif(9, 'c', [])
+    assert index.search() == [
+        {'id': 3, 'tg_gif_id': 'd', 'tags': ['cat', 'dog']},
+        {'id': 5, 'tg_gif_id': 'b', 'tags': ['dog']},
+    ]
+    assert len(index) == 2
+
+
+def test_matches_brute_force():
+    rnd = random.Random(0)
+    vocabulary = [f'tag{i}' for i in range(8)]
+    gifs = {gif_id: set(rnd.sample(vocabulary, rnd.randint(1, 3))) for gif_id in rnd.sample(range(1, 500), 200)}
+    index = GifIndex([(gif_id, str(gif_id), tags) for gif_id, tags in gifs.items()])
+
+    for _ in range(200):
+        gif_id = rnd.randrange(1, 600)
+        if rnd.random() < 0.3:
+            gifs.pop(gif_id, None)
+            index.remove_gif(gif_id)
+        else:
+            gifs[gif_id] = set(rnd.sample(vocabulary, rnd.randint(1, 3)))
+            index.set_gif(gif_id, str(gif_id), gifs[gif_id])
+
+        query = rnd.sample(vocabulary, rnd.randint(1, 2))
+        after = rnd.randrange(0, 600)
+        expected = sorted(gif_id for gif_id, tags in gifs.items() if set(query) <= tags and gif_id > after)[:10]
+        assert _ids(index.search(tags=query, after_gif_id=after, limit=10)) == expected
+
+
+@pytest.mark.anyio
+async def test_search_gif_index_loads_in_background(monkeypatch, caplog):
+    loads = []
+
+    async def failing_load(tg_user_id, user_id):
+        loads.append(tg_user_id)
+        raise ConnectionError
+
+    monkeypatch.setattr(user_services, '_load_gif_index', failing_load)
+    try:
+        # Пустой индекс закэширован: это не промах, загрузка не запускается
+        user_services.gif_index_cache.set(-1, GifIndex([]))
+        assert user_services._search_gif_index(-1, 1) is None
+        assert user_services._gif_index_loads == {}
+
+        assert user_services._search_gif_index(-2, 2) is None
+        task = user_services._gif_index_loads[-2]
+        await asyncio.wait([task])
+        await asyncio.sleep(0)
+        assert loads == [-2]
+        assert user_services._gif_index_loads == {}
+        assert 'индекс гифок пользователя -2' in caplog.text
+
+        # Загрузка, отменённая до начала выполнения, тоже снимается с учёта
+        user_services._search_gif_index(-3, 3)
+        task = user_services._gif_index_loads[-3]
+        task.cancel()
+        await asyncio.wait([task])
+        await asyncio.sleep(0)
+        assert user_services._gif_index_loads == {}
+        assert loads == [-2]
+    finally:
+        user_services.gif_index_cache.clear()
@@ -0,0 +1,77 @@
+import asyncio
+from app.utils import GroupCommit
+
+
+def test_concurrent_items_are_applied_in_one_batch():
+    async def scenario():
+        batches = []
+
+        async def apply_batch(items):
+            batches.append(list(items))
+            return [ValueError(item) if item == 'bad' else None for item in items]
+
+        writes = GroupCommit(apply_batch=apply_batch, window=0.01, max_batch=100)
+        results = await asyncio.gather(
+            *(writes.submit(item) for item in ['a', 'bad', 'b']),
+            return_exceptions=True,
+        )
+        return writes, batches, results
+
+    writes, batches, results = asyncio.run(scenario())
+
+    assert batches == [['a', 'bad', 'b']]
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], ValueError)
+    assert writes.stats() == {'batches': 1, 'items': 3, 'failures': 1, 'pending': 0}
+
+
+def test_batches_are_applied_in_order_and_limited_by_size():
+    async def scenario():
+        applied = []
+
+        async def apply_batch(items):
+            await asyncio.sleep(0.01)
+            applied.append(list(items))
+            return [None] * len(items)
+
+        writes = GroupCommit(apply_batch=apply_batch, window=0.005, max_batch=2)
+        first = [asyncio.create_task(writes.submit(('key', version))) for version in range(3)]
+        await asyncio.sleep(0.008)
+        # Пакет применяется: следующие изменения того же ключа попадут в следующий пакет
+        second = [asyncio.create_task(writes.submit(('key', version))) for version in range(3, 5)]
+        await asyncio.gather(*first, *second)
+        return applied
+
+    applied = asyncio.run(scenario())
+
+    assert [len(batch) for batch in applied] == [2, 2, 1]
+    assert [version for batch in applied for _, version in batch] == list(range(5))
+
+
+def test_apply_batch_exception_fails_every_item():
+    async def scenario():
+        async def apply_batch(items):
+            raise ConnectionError('database is unavailable')
+
+        writes = GroupCommit(apply_batch=apply_batch, window=0, max_batch=10)
+        return await asyncio.gather(*(writes.submit(item) for item in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ConnectionError) for result in asyncio.run(scenario()))
+
+
+def test_cancelled_caller_does_not_cancel_write():
+    async def scenario():
+        applied = []
+
+        async def apply_batch(items):
+            applied.extend(items)
+            return [None] * len(items)
+
+        writes = GroupCommit(apply_batch=apply_batch, window=0.01, max_batch=10)
+        caller = asyncio.create_task(writes.submit('a'))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await writes.drain()
+        return applied
+
+    assert asyncio.run(scenario()) == ['a']
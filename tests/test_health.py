@@ -0,0 +1,48 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+from fastapi.testclient import TestClient
+
+
+def test_import_does_not_need_database_settings():
+    env = {key: value for key, value in os.environ.items() if not key.startswith('POSTGRES_')}
+    result = subprocess.run(
+        [sys.executable, '-c', 'import app.main, app.database as db; assert db._engine is None'],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+
+def test_ready_after_warmup(monkeypatch):
+    from app import database, main
+    from app.main import app
+
+    # Прогрев ждёт разрешения теста, чтобы ответ до его окончания проверялся детерминированно
+    released = threading.Event()
+    warmup_pool = main.warmup_pool
+
+    async def delayed_warmup_pool(*args, **kwargs):
+        while not released.is_set():
+            await asyncio.sleep(0.01)
+        return await warmup_pool(*args, **kwargs)
+
+    monkeypatch.setattr(main, 'warmup_pool', delayed_warmup_pool)
+    with TestClient(app) as client:
+        assert client.get('/health/live').json() == {'status': 'alive'}
+        assert client.get('/health/ready').status_code == 503
+        released.set()
+
+        deadline = time.monotonic() + 10
+        while (response := client.get('/health/ready')).status_code == 503 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert response.status_code == 200
+        assert response.json() == {'status': 'ready'}
+        assert client.get('/health/pool').json()['checked_in'] >= 1
+
+    # Движок закрывается при остановке, следующий запуск создаст новый
+    assert database._engine is None
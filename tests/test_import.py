@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from app import config
+from app.main import app
+from app.services import parse_ndjson_library, parse_csv_library
+
+
+def _parse(parser, body: bytes, chunk_size: int) -> list:
+    """Разбирает тело, поступающее частями по `chunk_size` байт."""
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    async def collect():
+        return [record async for record in parser(chunks())]
+
+    return asyncio.run(collect())
+
+
+CSV_BODY = (
+    'tg_gif_id,tags\r\n'
+    'gif-1,"tag, with comma","multi\nline"\r\n'
+    '\r\n'
+    'gif-2,ünïcødé,a b\x0bc\n'
+    '"gif-3",""""'
+).encode()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 1024])
+def test_parse_csv_library_streams_quoted_newlines(chunk_size):
+    assert _parse(parse_csv_library, CSV_BODY, chunk_size) == [
+        ('gif-1', ['tag, with comma', 'multi\nline']),
+        ('gif-2', ['ünïcødé', 'a b\x0bc']),
+        ('gif-3', ['"']),
+    ]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1024])
+def test_parse_ndjson_library_streams_lines(chunk_size):
+    body = '{"tg_gif_id": "gif-1", "tags": ["a b"]}\r\n\n{"tg_gif_id": "gif-2"}'.encode()
+    assert _parse(parse_ndjson_library, body, chunk_size) == [('gif-1', ['a b']), ('gif-2', [])]
+
+    with pytest.raises(ValueError, match='Строка 3'):
+        _parse(parse_ndjson_library, b'{"tg_gif_id": "gif-1"}\n\nnot json\n', chunk_size)
+
+
+def test_parse_library_rejects_invalid_utf8():
+    with pytest.raises(ValueError, match='UTF-8'):
+        _parse(parse_csv_library, b'gif-1,\xff\n', 1024)
+
+
+@pytest.mark.anyio
+async def test_import_endpoint(monkeypatch, db_engine):
+    # Импорт фиксирует свою транзакцию в сессии приложения, поэтому тест удаляет свои данные сам
+    monkeypatch.setattr(config, 'IMPORT_MAX_BODY_BYTES', 1024)
+    headers = {'content-type': 'text/csv'}
+    try:
+        with TestClient(app) as client:
+            body = b'test-import-1,"test-import-a\nb",test-import-c\n'
+            response = client.post('/user/-484848/import', content=body, headers=headers)
+            assert response.status_code == 200
+            assert response.json()['links'] == 2
+
+            # Без Content-Length размер проверяется по мере чтения тела
+            too_large = client.post('/user/-484848/import', content=iter([b'test-import-2,a\n'] * 100), headers=headers)
+            assert too_large.status_code == 413
+            assert client.post('/user/-484848/import', content=b'x' * 2048, headers=headers).status_code == 413
+
+        async with db_engine.connect() as conn:
+            assert (await conn.execute(text(
+                "SELECT tg_gif_id, tags FROM user_gifs JOIN users ON users.id = user_gifs.user_id WHERE tg_id = -484848"
+            ))).all() == [('test-import-1', ['test-import-a\nb', 'test-import-c'])]
+    finally:
+        async with db_engine.begin() as conn:
+            await conn.execute(text(
+                "DELETE FROM user_gif_tags WHERE user_id IN (SELECT id FROM users WHERE tg_id = -484848)"
+            ))
+            await conn.execute(text("DELETE FROM users WHERE tg_id = -484848"))
+            await conn.execute(text("DELETE FROM gifs WHERE tg_gif_id LIKE 'test-import-%'"))
+            await conn.execute(text("DELETE FROM tags WHERE tag LIKE 'test-import-%'"))
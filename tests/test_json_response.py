@@ -0,0 +1,23 @@
+import json
+from app.schemas import SearchOut
+from app.utils import FastJSONResponse, json_dumps
+
+
+def test_json_dumps_compact_utf8():
+    assert json_dumps({'tags': ['кот', 'funny'], 'next_cursor': None}) == \
+        '{"tags":["кот","funny"],"next_cursor":null}'.encode()
+    assert sorted(json.loads(json_dumps({'a', 'b'}))) == ['a', 'b']
+
+
+def test_response_body_matches_response_model():
+    payload = {
+        'tg_user_id': 1,
+        'id': 2,
+        'gifs_data': [{'id': 3, 'tg_gif_id': 'tg-3', 'tags': ['cat']}],
+        'next_cursor': None,
+    }
+    response = FastJSONResponse(payload, headers={'ETag': 'W/"2-1"'})
+
+    assert response.media_type == 'application/json'
+    assert response.headers['etag'] == 'W/"2-1"'
+    assert json.loads(response.body) == SearchOut.model_validate(payload).model_dump(mode='json')
@@ -0,0 +1,55 @@
+import json
+import logging
+from app.metrics import Registry, Counter, Gauge, Histogram, statement_fingerprint
+
+
+def test_render_prometheus_text_format():
+    registry = Registry()
+    requests = Counter('requests_total', 'Requests', ('route',), registry=registry)
+    in_flight = Gauge('in_flight', 'In flight', registry=registry)
+    latency = Histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1), registry=registry)
+
+    requests.labels('/a"b').inc()
+    requests.labels('/a"b').inc(2)
+    in_flight.inc()
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.labels('/a').observe(value)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{route="/a\\"b"} 3' in lines
+    assert 'in_flight 1' in lines
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{route="/a"} 3.65' in lines
+    assert 'latency_seconds_count{route="/a"} 4' in lines
+
+
+def test_registry_collectors():
+    registry = Registry()
+    registry.add_collector(lambda: [('pool_size', 'gauge', 'Size', [({'pool': 'main'}, 5)])])
+
+    assert 'pool_size{pool="main"} 5' in registry.render().splitlines()
+
+
+def test_statement_fingerprint_ignores_values_and_list_lengths():
+    one = statement_fingerprint('SELECT id FROM users WHERE tg_id IN ($1::BIGINT) LIMIT 5')
+    many = statement_fingerprint('SELECT id FROM users\n WHERE tg_id IN ($1::BIGINT, $2::BIGINT) LIMIT 50')
+    assert one == many
+    assert one[1] == 'SELECT'
+
+    rows = statement_fingerprint('INSERT INTO t (a, b) VALUES ($1, $2), ($3, $4)')
+    row = statement_fingerprint('INSERT INTO t (a, b) VALUES ($1, $2)')
+    assert rows[0] == row[0]
+    assert rows[0] != one[0]
+
+
+def test_statement_fingerprint_logs_statement_once(caplog):
+    statement = 'SELECT tag FROM tags WHERE id = $1 AND tag <> $2 -- test_statement_fingerprint_logs_statement_once'
+    with caplog.at_level(logging.INFO, logger='app.sql_fingerprint'):
+        fingerprint, _, normalized = statement_fingerprint(statement)
+        statement_fingerprint(statement.replace('$2', '$3'))
+    assert [json.loads(record.getMessage()) for record in caplog.records] == [
+        {'event': 'sql_fingerprint', 'fingerprint': fingerprint, 'operation': 'SELECT', 'statement': normalized},
+    ]
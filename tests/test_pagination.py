@@ -0,0 +1,12 @@
+import pytest
+from app.utils import encode_cursor, decode_cursor
+
+
+def test_cursor_roundtrip():
+    assert decode_cursor(encode_cursor(42)) == 42
+
+
+@pytest.mark.parametrize('cursor', ['', 'zzz', 'eyJpZCI6MX0', 'eyJnaWZfaWQiOiIxIn0'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
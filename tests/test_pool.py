@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import exc, text
+from app import config
+from app.database import build_engine, warmup_pool
+
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def engine(monkeypatch):
+    """Движок приложения (`InstrumentedAsyncQueuePool`) с пулом из двух соединений и одним сверх него."""
+    monkeypatch.setattr(config, 'DB_POOL_SIZE', 2)
+    monkeypatch.setattr(config, 'DB_MAX_OVERFLOW', 1)
+    monkeypatch.setattr(config, 'DB_POOL_TIMEOUT', 0.1)
+    engine = build_engine()
+    try:
+        yield engine
+    finally:
+        await engine.dispose()
+
+
+async def test_pool_counts_checkouts_overflow_and_timeouts(engine):
+    pool = engine.pool
+    assert pool.stats()['checkouts'] == 0
+
+    async with engine.connect() as first, engine.connect() as second, engine.connect() as third:
+        for conn in (first, second, third):
+            await conn.execute(text("SELECT 1"))
+        stats = pool.stats()
+        assert (stats['checked_out'], stats['overflow'], stats['checkouts']) == (3, 1, 3)
+
+        with pytest.raises(exc.TimeoutError):
+            async with engine.connect():
+                pass
+        assert pool.stats()['timeouts'] == 1
+        assert pool.stats()['wait_seconds_max'] >= 0.1
+
+    stats = pool.stats()
+    # Соединение сверх pool_size закрывается при возврате
+    assert (stats['checked_out'], stats['checked_in'], stats['overflow'], stats['waiting']) == (0, 2, 0, 0)
+    assert stats['checkouts'] == 3
+
+    # Счётчики переживают пересоздание пула при dispose()
+    await engine.dispose()
+    assert engine.pool.stats()['checkouts'] == 3
+
+
+async def test_warmup_pool_opens_pool_size_connections(engine):
+    prepared = []
+
+    async def prepare(session):
+        prepared.append((await session.execute(text("SELECT pg_backend_pid()"))).scalar())
+
+    assert await warmup_pool(engine, connections=10, prepare=prepare) == 2
+    stats = engine.pool.stats()
+    assert (stats['checked_in'], stats['checked_out'], stats['checkouts']) == (2, 0, 2)
+    # Соединения удерживаются до открытия всех, поэтому это два разных соединения
+    assert len(set(prepared)) == 2
+
+    assert await warmup_pool(engine, connections=0) == 0
@@ -0,0 +1,42 @@
+import asyncio
+from app import config
+from app.query_log import traced, _call_stack, _describe_parameters
+
+
+class FakeCRUD:
+    @traced
+    async def load(self):
+        return _call_stack.get()
+
+
+@traced
+async def service():
+    return await FakeCRUD().load()
+
+
+@traced
+async def stream_service():
+    for _ in range(2):
+        yield _call_stack.get()
+
+
+async def _collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_traced_builds_call_stack():
+    assert asyncio.run(service()) == ('service', 'FakeCRUD.load')
+    assert _call_stack.get() == ()
+
+
+def test_traced_async_generator_sets_stack_on_each_step():
+    assert asyncio.run(_collect(stream_service())) == [('stream_service',), ('stream_service',)]
+
+
+def test_parameters_redacted_by_default(monkeypatch):
+    monkeypatch.setattr(config, 'SLOW_QUERY_LOG_PARAMETERS', False)
+    assert _describe_parameters((42, 'secret', None)) == ['int', 'str', 'NoneType']
+
+    monkeypatch.setattr(config, 'SLOW_QUERY_LOG_PARAMETERS', True)
+    assert _describe_parameters((42, 'x' * 500))[0] == 42
+    assert _describe_parameters((42, 'x' * 500))[1].endswith('...')
@@ -0,0 +1,33 @@
+import asyncio
+from app import config, database
+
+
+def test_reads_round_robin_and_stick_to_primary_after_write(monkeypatch):
+    # Движки подключаются лениво, поэтому в качестве «реплик» подойдёт URL основной БД
+    url = database.get_database_url()
+    monkeypatch.setattr(config, 'DB_REPLICA_URLS', [url, url])
+    asyncio.run(database.dispose_engine())
+    try:
+        primary = database.get_engine()
+        replicas = database.get_replica_engines()
+        assert len(replicas) == 2
+
+        binds = [database.read_session().bind for _ in range(4)]
+        assert binds.count(replicas[0]) == binds.count(replicas[1]) == 2
+
+        database.stick_to_primary(42)
+        assert database.read_session(42).bind is primary
+        assert database.read_session(43).bind in replicas
+        assert database.AsyncSessionLocal().bind is primary
+    finally:
+        database.recent_writers.clear()
+        asyncio.run(database.dispose_engine())
+
+
+def test_without_replicas_reads_use_primary():
+    try:
+        primary = database.get_engine()
+        assert database.get_replica_engines() == []
+        assert database.read_session(42).bind is primary
+    finally:
+        asyncio.run(database.dispose_engine())
@@ -0,0 +1,183 @@
+import anyio
+import json
+import pytest
+from contextlib import asynccontextmanager
+from httpx import ASGITransport, AsyncClient
+from app import config
+from app.database import get_read_db
+from app.main import app
+from app.routers import search
+from app.services import get_user_gifs_with_tags, set_new_user_tags_on_gif
+
+
+pytestmark = pytest.mark.anyio
+
+TG_USER_ID = -525252
+LIBRARY = {
+    'test-search-1': ['a', 'b'],
+    'test-search-2': ['a'],
+    'test-search-3': ['a', 'b', 'c'],
+    'test-search-4': ['b', 'c'],
+}
+
+
+@pytest.fixture(params=['normalized', 'projection'])
+async def library(request, monkeypatch, db_session, no_group_commit):
+    """Библиотека `LIBRARY` пользователя `TG_USER_ID`; поиск выполняется в БД обоими вариантами `SEARCH_BACKEND`."""
+    monkeypatch.setattr(config, 'SEARCH_BACKEND', request.param)
+    monkeypatch.setattr(config, 'GIF_INDEX_ENABLED', False)
+    monkeypatch.setattr(config, 'SINGLE_FLIGHT_ENABLED', False)
+    for tg_gif_id, tags in LIBRARY.items():
+        await set_new_user_tags_on_gif(db_session, TG_USER_ID, tg_gif_id, [f'test-search-{tag}' for tag in tags])
+    return db_session
+
+
+async def _search(db_session, **filters) -> list[str]:
+    if 'tags' in filters:
+        filters['tags'] = [f'test-search-{tag}' for tag in filters['tags']]
+    data = await get_user_gifs_with_tags(db_session, tg_user_id=TG_USER_ID, **filters)
+    return [gif['tg_gif_id'].removeprefix('test-search-') for gif in data['gifs_data']]
+
+
+async def test_tags_filter_requires_all_tags(library):
+    assert await _search(library, tags=['a']) == ['1', '2', '3']
+    assert await _search(library, tags=['a', 'b']) == ['1', '3']
+    assert await _search(library, tags=['c', 'b', 'a']) == ['3']
+
+
+async def test_duplicate_tags_are_counted_once(library):
+    assert await _search(library, tags=['a', 'b', 'a']) == ['1', '3']
+    assert await _search(library, tags=['c', 'c']) == ['3', '4']
+
+
+async def test_unknown_tag_returns_empty_gifs_data(library):
+    assert await _search(library, tags=['missing']) == []
+    assert await _search(library, tags=['a', 'missing']) == []
+
+
+async def test_tags_with_gif_ids_and_pages(library):
+    assert await _search(library, tags=['b'], tg_gifs_id=['test-search-1', 'test-search-2', 'test-search-4']) == ['1', '4']
+    assert await _search(library, tags=['a', 'a'], tg_gifs_id='test-search-3') == ['3']
+
+    first = await get_user_gifs_with_tags(library, tg_user_id=TG_USER_ID, tags=['test-search-b'], limit=2)
+    assert [gif['tg_gif_id'] for gif in first['gifs_data']] == ['test-search-1', 'test-search-3']
+    assert first['next_gif_id'] == first['gifs_data'][-1]['id']
+    assert await _search(library, tags=['b'], after_gif_id=first['next_gif_id'], limit=2) == ['4']
+    assert await _search(library, tags=['b', 'c'], after_gif_id=first['gifs_data'][0]['id'], limit=1) == ['3']
+
+
+@pytest.fixture
+async def client(library, monkeypatch):
+    """
+    Клиент приложения в цикле теста: запросы и потоковые ответы читают библиотеку через сессию теста.
+
+    :return: клиент и список открытых потоковым ответом сессий (после закрытия генератора строк он пуст).
+    """
+    opened = []
+
+    @asynccontextmanager
+    async def read_session(tg_user_id=None):
+        opened.append(tg_user_id)
+        try:
+            yield library
+        finally:
+            opened.remove(tg_user_id)
+
+    monkeypatch.setattr(search, 'read_session', read_session)
+    app.dependency_overrides[get_read_db] = lambda: library
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url='http://test') as http:
+            yield http, opened
+    finally:
+        app.dependency_overrides.pop(get_read_db)
+
+
+async def test_ndjson_stream(client):
+    http, opened = client
+    response = await http.get('/search', params={'tg_user_id': TG_USER_ID, 'tags': 'test-search-a', 'stream': True})
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == search.NDJSON_MEDIA_TYPE
+    assert response.content.endswith(b'\n')
+    lines = [json.loads(line) for line in response.content.splitlines()]
+    assert [gif['tg_gif_id'] for gif in lines] == ['test-search-1', 'test-search-2', 'test-search-3']
+    assert opened == []
+
+
+async def test_ndjson_stream_empty_and_missing_user(client):
+    http, opened = client
+    # У пользователя есть гифки, но ни одна не подошла: пустое тело, как пустой gifs_data в JSON
+    response = await http.get('/search', params={'tg_user_id': TG_USER_ID, 'tags': 'missing'}, headers={
+        'accept': search.NDJSON_MEDIA_TYPE,
+    })
+    assert (response.status_code, response.content) == (200, b'')
+
+    response = await http.get('/search', params={'tg_user_id': -535353, 'stream': True})
+    assert response.status_code == 404
+    assert opened == []
+
+
+async def test_ndjson_first_gif_is_sent_separately(client):
+    chunks = [chunk async for chunk in search._ndjson_gifs(tg_user_id=TG_USER_ID)]
+
+    assert [json.loads(line)['tg_gif_id'] for line in chunks[0].splitlines()] == ['test-search-1']
+    assert [json.loads(line)['tg_gif_id'] for line in chunks[1].splitlines()] == [
+        'test-search-2', 'test-search-3', 'test-search-4',
+    ]
+    assert len(chunks) == 2
+
+
+async def test_ndjson_response_closes_lines_if_client_disconnects():
+    closed = []
+
+    async def lines():
+        try:
+            yield b'{}\n'
+        finally:
+            closed.append(True)
+
+    async def receive():
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        await anyio.sleep_forever()
+
+    # Клиент отключился до того, как началась отправка тела: генератор строк ни разу не читался
+    gen = lines()
+    await anext(gen)
+    await search._NDJSONResponse(gen, gen)({'type': 'http'}, receive, send)
+    assert closed == [True]
+
+
+@pytest.mark.parametrize('limit, tags', [(1, None), (2, None), (3, ['test-search-b']), (1000, None)])
+async def test_cursor_pages_cover_library_once(client, limit, tags):
+    http, _ = client
+    params = {'tg_user_id': TG_USER_ID, 'limit': limit}
+    if tags:
+        params['tags'] = tags
+    expected = (await http.get('/search', params={k: v for k, v in params.items() if k != 'limit'})).json()
+
+    pages = []
+    cursor = None
+    while True:
+        response = await http.get('/search', params={**params, **({'cursor': cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.json()
+        pages.append(page['gifs_data'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    gifs = [gif['id'] for page in pages for gif in page]
+    assert gifs == [gif['id'] for gif in expected['gifs_data']]
+    assert len(gifs) == len(set(gifs))
+    assert all(len(page) == limit for page in pages[:-1])
+    assert 0 < len(pages[-1]) <= limit
+
+
+@pytest.mark.parametrize('cursor', ['', 'zzz', 'eyJpZCI6MX0'])
+async def test_malformed_cursor_is_rejected(client, cursor):
+    http, _ = client
+    response = await http.get('/search', params={'tg_user_id': TG_USER_ID, 'cursor': cursor})
+    assert response.status_code == 400
+    assert response.json() == {'detail': 'Invalid cursor'}
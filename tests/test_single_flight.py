@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from app.utils import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def load(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return {'value': value}
+
+        results = await asyncio.gather(
+            *(flight.do(1, ('tags', 'cat'), lambda: load('cat')) for _ in range(5)),
+            flight.do(1, ('tags', 'dog'), lambda: load('dog')),
+            flight.do(2, ('tags', 'cat'), lambda: load('cat')),
+        )
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+
+    assert sorted(calls) == ['cat', 'cat', 'dog']
+    assert results[0] is results[4]
+    assert [result['value'] for result in results] == ['cat'] * 5 + ['dog', 'cat']
+    assert flight.stats() == {'executions': 3, 'coalesced': 4, 'in_flight': 0}
+
+
+def test_exception_is_shared():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError('boom')
+
+        return await asyncio.gather(*(flight.do(1, 'key', fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_forget_starts_new_execution():
+    async def scenario():
+        flight = SingleFlight()
+        versions = iter([1, 2])
+
+        async def load():
+            version = next(versions)
+            await asyncio.sleep(0.02)
+            return version
+
+        first = asyncio.create_task(flight.do(1, 'key', load))
+        await asyncio.sleep(0)
+        # Данные изменились, пока первый вызов выполнялся: новый вызов не должен получить его результат
+        flight.forget(1)
+        second = asyncio.create_task(flight.do(1, 'key', load))
+        return await first, await second, len(flight)
+
+    assert asyncio.run(scenario()) == (1, 2, 0)
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    async def scenario():
+        flight = SingleFlight()
+        started = 0
+
+        async def load():
+            nonlocal started
+            started += 1
+            await asyncio.sleep(0.02)
+            return started
+
+        leader = asyncio.create_task(flight.do(1, 'key', load))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do(1, 'key', load))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(scenario()) == 2
@@ -0,0 +1,33 @@
+import pytest
+from app.utils import TagIndex, trigrams, similarity
+
+
+def test_trigrams_match_pg_trgm():
+    # Примеры из документации pg_trgm
+    assert trigrams('cat') == {'  c', ' ca', 'cat', 'at '}
+    assert trigrams('foo|bar') == {'  f', ' fo', 'foo', 'oo ', '  b', ' ba', 'bar', 'ar '}
+    assert similarity('word', 'two words') == pytest.approx(4 / 11)
+
+
+def test_prefix_matches_go_first_case_insensitive():
+    index = TagIndex(['Cats', 'cat', 'dog', 'category', 'scat'])
+
+    assert index.suggest('CA', limit=10)[:3] == ['cat', 'category', 'Cats']
+    assert index.suggest('ca', limit=2) == ['cat', 'category']
+
+
+def test_fuzzy_matches_follow_prefix_matches():
+    index = TagIndex(['funny', 'fun', 'sunny', 'money'])
+
+    assert index.suggest('funy', limit=10) == ['funny', 'fun']
+    assert index.suggest('sunny day', limit=10) == ['sunny']
+    assert index.suggest('zzz') == []
+
+
+def test_similar_scores_and_threshold():
+    index = TagIndex(['word', 'words', 'sword'])
+
+    scores = dict(index.similar('word', limit=10, threshold=0))
+    for tag, score in scores.items():
+        assert score == pytest.approx(similarity('word', tag))
+    assert [tag for tag, _ in index.similar('word', limit=10, threshold=0.99)] == ['word']